@@ -0,0 +1,337 @@
+"""
+client_test/load_test.py
+
+Load generator built from the scenarios in test2.py.
+
+N virtual users run concurrently. Each one registers, logs in, creates a
+group with a peer as member, and then performs a weighted random mix of
+operations (list, store, update, grant, group share, revoke, delete) until
+its iteration budget is spent. Latency of every request is recorded per
+endpoint and reported as JSON (p50/p95/p99 and throughput), so results can be
+committed and compared between runs.
+
+Examples:
+    # against a running server
+    python load_test.py --users 20 --iterations 50 --output report.json
+
+    # in-process against the Flask test client (uses the server's database)
+    python load_test.py --target local --users 8 --mix list=70,store=20,update=10
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+BASE_URL = "http://localhost:5000"
+LOGIN_KEY = "loadtestloginkey"
+
+DEFAULT_MIX = {
+    "list": 40,
+    "store": 15,
+    "update": 15,
+    "grant": 8,
+    "group_share": 7,
+    "revoke": 7,
+    "delete": 8,
+}
+
+
+# --- Transports ---
+
+class HttpTransport:
+    """Sends requests to a live server with one keep-alive session per virtual user."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, payload=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.session.request(method, f"{self.base_url}{path}", json=payload, headers=headers)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+
+class FlaskTransport:
+    """Calls the Flask app in-process through its test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(path, method=method, json=payload, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+def load_local_app():
+    server_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+    sys.path.insert(0, os.path.abspath(server_dir))
+    from app import create_app
+    from models import db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+# --- Metrics ---
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def build_report(recorder, wall_time, args, mix):
+    endpoints = {}
+    total = 0
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        endpoints[endpoint] = {
+            "count": len(values),
+            "errors": recorder.errors.get(endpoint, 0),
+            "throughput_rps": round(len(values) / wall_time, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return {
+        "target": args.target,
+        "users": args.users,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "mix": mix,
+        "wall_time_s": round(wall_time, 3),
+        "total_requests": total,
+        "throughput_rps": round(total / wall_time, 2),
+        "endpoints": endpoints,
+    }
+
+
+# --- Virtual user ---
+
+class VirtualUser:
+    def __init__(self, index, run_id, transport, recorder, rng):
+        self.index = index
+        self.email = f"load_{run_id}_{index}@example.com"
+        self.run_id = run_id
+        self.transport = transport
+        self.recorder = recorder
+        self.rng = rng
+        self.token = None
+        self.user_id = None
+        self.group_id = None
+        self.password_ids = []
+        self.peer_ids = []
+        self.grants = []  # (password_id, {"user_id": x} or {"group_id": x})
+
+    def call(self, endpoint, method, path, payload=None, expected=(200, 201)):
+        start = time.perf_counter()
+        status, body = self.transport.request(method, path, payload, self.token)
+        self.recorder.record(endpoint, time.perf_counter() - start, status in expected)
+        return status, body
+
+    def fake_entry(self):
+        secret = json.dumps({"username": f"user{self.rng.randint(0, 9999)}", "password": uuid.uuid4().hex})
+        return {
+            "site": f"site{self.rng.randint(0, 999)}.example.com",
+            "encrypted_data": base64.b64encode(secret.encode("utf-8")).decode("utf-8"),
+            "iv": base64.b64encode(os.urandom(12)).decode("utf-8"),
+            "notes": "load test entry",
+        }
+
+    def setup(self):
+        payload = {"email": self.email, "login_key": LOGIN_KEY}
+        self.call("POST /register", "POST", "/register", payload)
+        status, body = self.call("POST /login", "POST", "/login", payload)
+        if status != 200:
+            raise RuntimeError(f"login failed for {self.email}: {status} {body}")
+        self.token = body["token"]
+        self.user_id = body["user_id"]
+        self.op_store()
+
+    def setup_group(self, peer_ids):
+        self.peer_ids = peer_ids
+        status, body = self.call("POST /groups", "POST", "/groups", {
+            "name": f"load_{self.run_id}_{self.index}",
+            "description": "load test group",
+        })
+        if status != 201:
+            return
+        self.group_id = body["group_id"]
+        for peer_id in self.peer_ids:
+            self.call("POST /groups/<id>/members", "POST", f"/groups/{self.group_id}/members",
+                      {"user_id": peer_id, "permission": "read"})
+
+    # 各種操作
+    def op_list(self):
+        self.call("GET /passwords", "GET", "/passwords")
+
+    def op_store(self):
+        status, body = self.call("POST /storage", "POST", "/storage", self.fake_entry())
+        if status == 201:
+            self.password_ids.append(body["password_id"])
+
+    def op_update(self):
+        if not self.password_ids:
+            return self.op_store()
+        password_id = self.rng.choice(self.password_ids)
+        self.call("PUT /storage/<id>", "PUT", f"/storage/{password_id}", self.fake_entry())
+
+    def op_grant(self):
+        if not self.password_ids or not self.peer_ids:
+            return self.op_store()
+        password_id = self.rng.choice(self.password_ids)
+        target = {"user_id": self.rng.choice(self.peer_ids)}
+        status, _ = self.call("POST /permission/grant", "POST", "/permission/grant",
+                              dict(password_id=password_id, permission="read", **target),
+                              expected=(201, 409))
+        if status == 201:
+            self.grants.append((password_id, target))
+
+    def op_group_share(self):
+        if not self.password_ids or not self.group_id:
+            return self.op_store()
+        password_id = self.rng.choice(self.password_ids)
+        target = {"group_id": self.group_id}
+        status, _ = self.call("POST /permission/grant (group)", "POST", "/permission/grant",
+                              dict(password_id=password_id, permission="read", **target),
+                              expected=(201, 409))
+        if status == 201:
+            self.grants.append((password_id, target))
+
+    def op_revoke(self):
+        if not self.grants:
+            return self.op_list()
+        password_id, target = self.grants.pop(self.rng.randrange(len(self.grants)))
+        self.call("DELETE /permission/revoke", "DELETE", "/permission/revoke",
+                  dict(password_id=password_id, **target))
+
+    def op_delete(self):
+        if len(self.password_ids) < 2:
+            return self.op_store()
+        password_id = self.password_ids.pop(self.rng.randrange(len(self.password_ids)))
+        self.grants = [g for g in self.grants if g[0] != password_id]
+        self.call("DELETE /storage/<id>", "DELETE", f"/storage/{password_id}")
+
+    def run(self, iterations, mix):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        for _ in range(iterations):
+            op = self.rng.choices(names, weights)[0]
+            getattr(self, f"op_{op}")()
+
+
+# --- Main ---
+
+def parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}', choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the password manager API")
+    parser.add_argument("--target", default=BASE_URL,
+                        help="server base URL, or 'local' to use the Flask test client in-process")
+    parser.add_argument("--users", type=int, default=10, help="number of concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=100, help="operations per virtual user")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="operation weights, e.g. list=50,store=20,update=10,delete=20")
+    parser.add_argument("--peers", type=int, default=3, help="group members / grant targets per user")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for reproducible runs")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    mix = args.mix or dict(DEFAULT_MIX)
+
+    if args.target == "local":
+        app = load_local_app()
+        make_transport = lambda: FlaskTransport(app)
+    else:
+        make_transport = lambda: HttpTransport(args.target.rstrip("/"))
+
+    recorder = Recorder()
+    run_id = f"{int(time.time())}_{args.seed}"
+    users = [
+        VirtualUser(i, run_id, make_transport(), recorder, random.Random(args.seed * 100003 + i))
+        for i in range(args.users)
+    ]
+
+    # 1. 註冊與登入（同時進行）
+    setup_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(lambda vu: vu.setup(), users))
+
+    # 2. 每個用戶建立群組並加入同伴
+    setup_rng = random.Random(args.seed)
+    all_ids = [vu.user_id for vu in users]
+    peers = {}
+    for vu in users:
+        others = [uid for uid in all_ids if uid != vu.user_id]
+        peers[vu.index] = setup_rng.sample(others, min(args.peers, len(others)))
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(lambda vu: vu.setup_group(peers[vu.index]), users))
+    setup_time = time.perf_counter() - setup_start
+
+    # 3. 混合負載（只計算這一階段的時間）
+    setup_recorder = recorder
+    recorder = Recorder()
+    for vu in users:
+        vu.recorder = recorder
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(lambda vu: vu.run(args.iterations, mix), users))
+    wall_time = time.perf_counter() - start
+
+    report = build_report(recorder, wall_time, args, mix)
+    report["setup"] = build_report(setup_recorder, setup_time, args, mix)["endpoints"]
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
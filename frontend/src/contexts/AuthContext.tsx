@@ -65,7 +65,11 @@ export const AuthProvider = ({ children }: AuthProviderProps) => {
       const storedEncKey = storedEncKeyBase64 ? 
         cryptoUtils.base64ToArrayBuffer(storedEncKeyBase64) : null;
 
-      if (storedToken && isJwtValid(storedToken) && storedUser) {
+      // 存取令牌過期但刷新令牌仍有效時，下一次請求會自動換發
+      const hasValidSession = !!storedToken &&
+        (isJwtValid(storedToken) || isJwtValid(apiClient.getRefreshToken()));
+
+      if (hasValidSession && storedUser) {
         setToken(storedToken);
         setUser(JSON.parse(storedUser));
         setEncryptionKey(storedEncKey);
@@ -73,7 +77,7 @@ export const AuthProvider = ({ children }: AuthProviderProps) => {
         // 檢查是否首次登入 (透過本地標記)
         const firstTimeLogin = localStorage.getItem(FIRST_TIME_LOGIN_KEY) === 'true';
         setIsFirstTimeLogin(firstTimeLogin);
-      } else if (storedToken && !isJwtValid(storedToken)) {
+      } else if (storedToken && !hasValidSession) {
         // Token 已過期，清除存儲
         logout();
       }
@@ -138,11 +142,11 @@ export const AuthProvider = ({ children }: AuthProviderProps) => {
       const response = await apiClient.login(email, loginKey);
       
       // 3. 登入成功，處理伺服器回應
-      const { token: jwtToken, user_id, data_salt, is_first_login } = response;
+      const { token: jwtToken, refresh_token, user_id, data_salt, is_first_login } = response;
       
       // 4. 保存數據鹽值和JWT令牌
       localStorage.setItem(`${DATA_SALT_KEY}_${email}`, data_salt);
-      apiClient.storeToken(jwtToken);
+      apiClient.storeToken(jwtToken, refresh_token);
       
       // 5. 從主密碼和數據鹽值推導加密密鑰 (用於E2EE加密)
       console.log('從主密碼和數據鹽值生成加密密鑰');
@@ -185,8 +189,8 @@ export const AuthProvider = ({ children }: AuthProviderProps) => {
     setEncryptionKey(null);
     sessionStorage.removeItem(ENCRYPTION_KEY_KEY);
     
-    // 2. 清除令牌和用戶信息
-    apiClient.clearAuthData();
+    // 2. 通知後端撤銷令牌，並清除令牌和用戶信息
+    apiClient.logout().finally(() => apiClient.clearAuthData());
     localStorage.removeItem(USER_KEY);
     
     // 3. 重置狀態
@@ -211,7 +215,8 @@ export const AuthProvider = ({ children }: AuthProviderProps) => {
     token,
     encryptionKey,
     isFirstTimeLogin,
-    isAuthenticated: !!token && isJwtValid(token),
+    // 存取令牌為短效令牌，只要刷新令牌仍有效就視為已登入
+    isAuthenticated: !!token && (isJwtValid(token) || isJwtValid(apiClient.getRefreshToken())),
     isLoading,
     login,
     register,
@@ -29,6 +29,7 @@ console.log('當前 API 基礎 URL:', API_BASE_URL);
 
 // 本地存儲鍵
 const TOKEN_KEY = 'lanbitou_auth_token';
+const REFRESH_TOKEN_KEY = 'lanbitou_refresh_token';
 const USER_SALT_KEY = 'lanbitou_user_salt';
 
 // 錯誤類型
@@ -57,6 +58,7 @@ export interface LoginRequest {
 // 用戶登入響應類型
 export interface LoginResponse {
   token: string;
+  refresh_token: string;
   user_id: number;
   data_salt: string;
   is_first_login: boolean;
@@ -78,6 +80,33 @@ export interface PasswordEntry {
   owner_id: number;
 }
 
+/**
+ * 使用刷新令牌換發新的存取令牌
+ */
+async function refreshAccessToken(): Promise<string | null> {
+  const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+  if (!refreshToken || !isJwtValid(refreshToken)) {
+    return null;
+  }
+
+  try {
+    const response = await fetch(`${API_BASE_URL}/refresh`, {
+      method: 'POST',
+      headers: { 'Authorization': `Bearer ${refreshToken}` },
+      mode: 'cors',
+    });
+    if (!response.ok) {
+      return null;
+    }
+    const result = await response.json();
+    localStorage.setItem(TOKEN_KEY, result.token);
+    return result.token;
+  } catch (error) {
+    console.error('刷新令牌失敗:', error);
+    return null;
+  }
+}
+
 /**
  * 通用 API 請求方法
  */
@@ -97,18 +126,18 @@ async function apiRequest<T>(
   
   // 如果需要身份驗證，添加 JWT
   if (requiresAuth) {
-    const token = localStorage.getItem(TOKEN_KEY);
+    let token = localStorage.getItem(TOKEN_KEY);
+    
+    // 存取令牌已過期或即將過期時，使用刷新令牌換發
+    if (!token || !isJwtValid(token) || shouldRefreshJwt(token)) {
+      token = (await refreshAccessToken()) || token;
+    }
+    
     if (!token || !isJwtValid(token)) {
       throw new ApiError('身份驗證已過期，請重新登入', 401);
     }
     
     headers['Authorization'] = `Bearer ${token}`;
-    
-    // 檢查是否需要刷新 token
-    if (shouldRefreshJwt(token)) {
-      // TODO: 實現 token 刷新邏輯
-      console.log('Token 即將過期，應該刷新');
-    }
   }
   
   try {
@@ -200,6 +229,20 @@ export async function login(email: string, loginKey: string): Promise<LoginRespo
   }
 }
 
+/**
+ * 用戶登出（撤銷存取令牌與刷新令牌）
+ */
+export async function logout(): Promise<void> {
+  try {
+    await apiRequest<{ msg: string }>('/logout', 'POST', {
+      refresh_token: localStorage.getItem(REFRESH_TOKEN_KEY)
+    }, true);
+  } catch (error) {
+    // 即使撤銷失敗，仍然清除本地的身份驗證信息
+    console.error('登出請求失敗:', error);
+  }
+}
+
 /**
  * 獲取用戶信息
  */
@@ -300,8 +343,11 @@ export function getUserSalt(email: string): ArrayBuffer | null {
 /**
  * 儲存 JWT 令牌到本地存儲
  */
-export function storeToken(token: string): void {
+export function storeToken(token: string, refreshToken?: string): void {
   localStorage.setItem(TOKEN_KEY, token);
+  if (refreshToken) {
+    localStorage.setItem(REFRESH_TOKEN_KEY, refreshToken);
+  }
 }
 
 /**
@@ -311,10 +357,18 @@ export function getToken(): string | null {
   return localStorage.getItem(TOKEN_KEY);
 }
 
+/**
+ * 從本地存儲獲取刷新令牌
+ */
+export function getRefreshToken(): string | null {
+  return localStorage.getItem(REFRESH_TOKEN_KEY);
+}
+
 /**
  * 清除存儲的身份驗證信息（登出）
  */
 export function clearAuthData(): void {
   localStorage.removeItem(TOKEN_KEY);
+  localStorage.removeItem(REFRESH_TOKEN_KEY);
   // 注意：不要清除用戶鹽值，因為它需要用於後續登入
 } 
\ No newline at end of file
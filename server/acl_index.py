@@ -0,0 +1,520 @@
+# server/acl_index.py
+"""
+Optional in-process ACL index (ACL_INDEX_ENABLED).
+
+Loads password_access, group_membership and group_closure into compact
+in-memory structures when the app starts, so get_user_permission and the
+/passwords visibility step become dictionary and array lookups instead of
+SQL joins:
+
+- owners: array of owner user ids indexed by password id (0 = unknown)
+- direct grants: per user, a sorted array of password ids with a parallel
+  array of permission ranks, searched with bisect (5 bytes per grant)
+- group grants: per group, the same sorted arrays, or a packed 2-bit rank
+  per password id when the group covers a large share of all entries
+- memberships: {user_id: {group_id: rank}}
+- closure: {descendant_id: {ancestor_id: rank}}. A nesting change only
+  affects (ancestors of the parent) x (descendants of the child), so the hooks
+  read just those closure rows, outside the lock, and swap them in
+- expiries: {(user_id, group_id, password_id): expires_at} for the few
+  time-limited grants; lookups skip a grant once it has expired, before the
+  sweeper (grant_expiry.py) deletes it and calls grant_removed
+
+Write paths call the hook functions below after they commit. Lookups that
+the index cannot answer (not built yet, or an entry it has not seen) return
+MISS and the caller falls back to SQL.
+
+The index lives in one process. Writes made by other worker processes or by
+scripts are not seen until restart, so only enable it with a single worker.
+"""
+
+import bisect
+import re
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+from models import db, UserPassword, PasswordAccess, GroupMembership, GroupClosure
+from group_closure import PERMISSION_ORDER, PERMISSION_BY_ORDER, ancestors_of, descendants_of
+
+MISS = object()
+
+DELETE_RANK = PERMISSION_ORDER[max(PERMISSION_ORDER, key=PERMISSION_ORDER.get)]
+BUILD_BATCH_SIZE = 10000
+_NONZERO = re.compile(rb'[^\x00]')
+
+class SortedGrants:
+    """Sorted password ids with a parallel array of ranks."""
+    __slots__ = ('ids', 'ranks')
+
+    def __init__(self):
+        self.ids = array('I')
+        self.ranks = array('B')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, password_id):
+        i = bisect.bisect_left(self.ids, password_id)
+        if i < len(self.ids) and self.ids[i] == password_id:
+            return self.ranks[i]
+        return 0
+
+    def set(self, password_id, rank):
+        i = bisect.bisect_left(self.ids, password_id)
+        if i < len(self.ids) and self.ids[i] == password_id:
+            self.ranks[i] = rank
+        else:
+            self.ids.insert(i, password_id)
+            self.ranks.insert(i, rank)
+
+    def remove(self, password_id):
+        i = bisect.bisect_left(self.ids, password_id)
+        if i < len(self.ids) and self.ids[i] == password_id:
+            del self.ids[i]
+            del self.ranks[i]
+
+    def append(self, password_id, rank):
+        # 建立索引時依 password_id 排序讀入，直接附加即可
+        self.ids.append(password_id)
+        self.ranks.append(rank)
+
+    def password_ids(self):
+        return self.ids
+
+    def items(self):
+        return zip(self.ids, self.ranks)
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.ids) + sys.getsizeof(self.ranks)
+
+class PackedRanks:
+    """A 2-bit rank per password id (four ids per byte); used for groups that see many entries."""
+    __slots__ = ('data', 'count')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, password_id):
+        index = password_id >> 2
+        if index >= len(self.data):
+            return 0
+        return (self.data[index] >> ((password_id & 3) * 2)) & 3
+
+    def set(self, password_id, rank):
+        index = password_id >> 2
+        if index >= len(self.data):
+            self.data.extend(bytes(index + 1 - len(self.data)))
+        shift = (password_id & 3) * 2
+        old = (self.data[index] >> shift) & 3
+        self.data[index] = (self.data[index] & ~(3 << shift) & 0xFF) | (rank << shift)
+        self.count += (rank != 0) - (old != 0)
+
+    def remove(self, password_id):
+        if self.get(password_id):
+            self.set(password_id, 0)
+
+    def password_ids(self):
+        data = self.data
+        for match in _NONZERO.finditer(data):
+            index = match.start()
+            byte = data[index]
+            for slot in range(4):
+                if (byte >> (slot * 2)) & 3:
+                    yield index * 4 + slot
+
+    def items(self):
+        return ((pid, self.get(pid)) for pid in self.password_ids())
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.data)
+
+def _should_pack(grants, id_space):
+    # 排序陣列每筆 5 bytes；打包後每個 password id 佔 2 bits，較小者勝出
+    return isinstance(grants, SortedGrants) and len(grants) * 5 > (id_space + 3) // 4
+
+class AclIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.ready = False
+        self.pending = None  # 建立期間發生的寫入，建立完成後重播
+        self.owners = array('I')
+        self.user_grants = {}
+        self.group_grants = {}
+        self.memberships = {}
+        self.ancestors = {}
+        self.expiries = {}
+        self.build_seconds = None
+
+    # --- Build ---
+
+    def build(self):
+        """Loads the index from the database; call inside an app context."""
+        start = time.perf_counter()
+        with self.lock:
+            self.pending = []
+
+        try:
+            max_id = db.session.scalar(select(func.max(UserPassword.id))) or 0
+            owners = array('I', [0]) * (max_id + 1)
+            for password_id, owner_id in db.session.execute(
+                select(UserPassword.id, UserPassword.user_id).where(UserPassword.deleted_at.is_(None))
+                .execution_options(yield_per=BUILD_BATCH_SIZE)
+            ):
+                owners[password_id] = owner_id
+
+            user_grants = self._load_grants(PasswordAccess.user_id, PasswordAccess.group_id.is_(None))
+            group_grants = self._load_grants(PasswordAccess.group_id, PasswordAccess.user_id.is_(None))
+            for group_id, grants in list(group_grants.items()):
+                if _should_pack(grants, len(owners)):
+                    group_grants[group_id] = self._packed(grants)
+
+            memberships = {}
+            for user_id, group_id, permission in db.session.execute(
+                select(GroupMembership.user_id, GroupMembership.group_id, GroupMembership.permission)
+                .execution_options(yield_per=BUILD_BATCH_SIZE)
+            ):
+                memberships.setdefault(user_id, {})[group_id] = PERMISSION_ORDER[permission]
+            ancestors = self._load_closure()
+            expiries = {
+                (user_id, group_id, password_id): expires_at
+                for user_id, group_id, password_id, expires_at in db.session.execute(
+                    select(PasswordAccess.user_id, PasswordAccess.group_id, PasswordAccess.password_id,
+                           PasswordAccess.expires_at).where(PasswordAccess.expires_at.is_not(None))
+                )
+            }
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+
+        with self.lock:
+            self.owners = owners
+            self.user_grants = user_grants
+            self.group_grants = group_grants
+            self.memberships = memberships
+            self.ancestors = ancestors
+            self.expiries = expiries
+            for method, args in self.pending:
+                method(*args)
+            self.pending = None
+            self.ready = True
+            self.build_seconds = time.perf_counter() - start
+
+    def _load_grants(self, target_column, other_is_null):
+        grants = {}
+        current_target, current = None, None
+        rows = db.session.execute(
+            select(target_column, PasswordAccess.password_id, PasswordAccess.permission)
+            .where(target_column.is_not(None), other_is_null)
+            .order_by(target_column, PasswordAccess.password_id)
+            .execution_options(yield_per=BUILD_BATCH_SIZE)
+        )
+        for target_id, password_id, permission in rows:
+            if target_id != current_target:
+                current_target, current = target_id, SortedGrants()
+                grants[target_id] = current
+            current.append(password_id, PERMISSION_ORDER[permission])
+        return grants
+
+    def _load_closure(self):
+        ancestors = {}
+        for ancestor_id, descendant_id, permission in db.session.execute(
+            select(GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission)
+            .execution_options(yield_per=BUILD_BATCH_SIZE)
+        ):
+            ancestors.setdefault(descendant_id, {})[ancestor_id] = PERMISSION_ORDER[permission]
+        return ancestors
+
+    @staticmethod
+    def _packed(grants):
+        packed = PackedRanks()
+        for password_id, rank in grants.items():
+            packed.set(password_id, rank)
+        return packed
+
+    # --- Lookups ---
+
+    def permission(self, user_id, password_id):
+        """PermissionEnum, None (no access) or MISS (ask SQL)."""
+        with self.lock:
+            if not self.ready or password_id >= len(self.owners) or not self.owners[password_id]:
+                return MISS
+            if self.owners[password_id] == user_id:
+                return PERMISSION_BY_ORDER[DELETE_RANK]
+
+            now = datetime.utcnow() if self.expiries else None
+            best = 0
+            grants = self.user_grants.get(user_id)
+            if grants is not None:
+                best = grants.get(password_id)
+                if best and now and self._expired(user_id, None, password_id, now):
+                    best = 0
+            for group_id, member_rank in self.memberships.get(user_id, {}).items():
+                if best == DELETE_RANK:
+                    break
+                for ancestor_id, nesting_rank in self.ancestors.get(group_id, {group_id: DELETE_RANK}).items():
+                    group_grants = self.group_grants.get(ancestor_id)
+                    if group_grants is None:
+                        continue
+                    rank = group_grants.get(password_id)
+                    if rank and not (now and self._expired(None, ancestor_id, password_id, now)):
+                        best = max(best, min(rank, nesting_rank, member_rank))
+            return PERMISSION_BY_ORDER.get(best)
+
+    def shared_ids(self, user_id):
+        """Ids of entries shared with user_id directly or through groups, or MISS."""
+        with self.lock:
+            if not self.ready:
+                return MISS
+            owners = self.owners
+            # 已過期、尚未清除的授權依來源（使用者或群組）分開排除，不影響其他路徑的同一條目
+            expired = {}
+            if self.expiries:
+                now = datetime.utcnow()
+                for (grant_user_id, grant_group_id, password_id), expires_at in self.expiries.items():
+                    if expires_at <= now:
+                        expired.setdefault((grant_user_id, grant_group_id), set()).add(password_id)
+
+            result = set()
+            grants = self.user_grants.get(user_id)
+            if grants is not None:
+                skip = expired.get((user_id, None))
+                result.update(grants.password_ids() if not skip else
+                              (pid for pid in grants.password_ids() if pid not in skip))
+            granting = set()
+            for group_id in self.memberships.get(user_id, ()):
+                granting.update(self.ancestors.get(group_id, (group_id,)))
+            for group_id in granting:
+                group_grants = self.group_grants.get(group_id)
+                if group_grants is not None:
+                    skip = expired.get((None, group_id))
+                    result.update(group_grants.password_ids() if not skip else
+                                  (pid for pid in group_grants.password_ids() if pid not in skip))
+            return {pid for pid in result if pid < len(owners) and owners[pid]}
+
+    def _expired(self, user_id, group_id, password_id, now):
+        expires_at = self.expiries.get((user_id, group_id, password_id))
+        return expires_at is not None and expires_at <= now
+
+    # --- Updates (called with the lock held through _apply) ---
+
+    def _apply(self, method, *args):
+        with self.lock:
+            method(*args)
+            if self.pending is not None:
+                self.pending.append((method, args))
+
+    def _set_owner(self, password_id, owner_id):
+        if password_id >= len(self.owners):
+            self.owners.extend(array('I', [0]) * (password_id + 1 - len(self.owners)))
+        self.owners[password_id] = owner_id
+
+    def _remove_entry(self, password_id, grants):
+        if password_id < len(self.owners):
+            self.owners[password_id] = 0
+        for user_id, group_id in grants:
+            self._remove_grant(password_id, user_id, group_id)
+
+    def _set_grant(self, password_id, user_id, group_id, rank, expires_at=None):
+        if expires_at is None:
+            self.expiries.pop((user_id, group_id, password_id), None)
+        else:
+            self.expiries[(user_id, group_id, password_id)] = expires_at
+        if group_id is None:
+            self.user_grants.setdefault(user_id, SortedGrants()).set(password_id, rank)
+            return
+        grants = self.group_grants.setdefault(group_id, SortedGrants())
+        grants.set(password_id, rank)
+        if _should_pack(grants, len(self.owners)):
+            self.group_grants[group_id] = self._packed(grants)
+
+    def _remove_grant(self, password_id, user_id, group_id):
+        self.expiries.pop((user_id, group_id, password_id), None)
+        targets = self.user_grants if group_id is None else self.group_grants
+        key = user_id if group_id is None else group_id
+        grants = targets.get(key)
+        if grants is not None:
+            grants.remove(password_id)
+            if not len(grants):
+                del targets[key]
+
+    def _set_membership(self, user_id, group_id, rank):
+        self.memberships.setdefault(user_id, {})[group_id] = rank
+
+    def _remove_membership(self, user_id, group_id):
+        groups = self.memberships.get(user_id)
+        if groups is not None:
+            groups.pop(group_id, None)
+            if not groups:
+                del self.memberships[user_id]
+
+    def _remove_group(self, group_id):
+        self.group_grants.pop(group_id, None)
+        for key in [key for key in self.expiries if key[1] == group_id]:
+            del self.expiries[key]
+        for user_id in [uid for uid, groups in self.memberships.items() if group_id in groups]:
+            self._remove_membership(user_id, group_id)
+
+    def _apply_closure_delta(self, replaced, delta):
+        # 只替換受影響後代的祖先表；replaced 中的祖先以 delta 重新載入的資料為準
+        for descendant_id, ancestors in delta.items():
+            current = self.ancestors.get(descendant_id, {descendant_id: DELETE_RANK})
+            kept = {a: rank for a, rank in current.items() if a not in replaced}
+            kept.update(ancestors)
+            self.ancestors[descendant_id] = kept
+
+    def _remove_closure_group(self, group_id, upper, delta):
+        self.ancestors.pop(group_id, None)
+        self._apply_closure_delta(upper | {group_id}, delta)
+
+    # --- Stats ---
+
+    def memory_usage(self):
+        with self.lock:
+            grant_count = sum(len(g) for g in self.user_grants.values()) + \
+                sum(len(g) for g in self.group_grants.values())
+            grant_bytes = sys.getsizeof(self.user_grants) + sys.getsizeof(self.group_grants) + \
+                sum(g.nbytes() for g in self.user_grants.values()) + \
+                sum(g.nbytes() for g in self.group_grants.values())
+            membership_bytes = sys.getsizeof(self.memberships) + sum(
+                sys.getsizeof(groups) for groups in self.memberships.values()
+            ) + sys.getsizeof(self.ancestors) + sum(
+                sys.getsizeof(groups) for groups in self.ancestors.values()
+            )
+            return {
+                "ready": self.ready,
+                "build_seconds": round(self.build_seconds, 3) if self.build_seconds is not None else None,
+                "entries": len(self.owners),
+                "grants": grant_count,
+                "expiring_grants": len(self.expiries),
+                "packed_groups": sum(1 for g in self.group_grants.values() if isinstance(g, PackedRanks)),
+                "owner_bytes": sys.getsizeof(self.owners),
+                "grant_bytes": grant_bytes,
+                "membership_bytes": membership_bytes,
+                "bytes_per_million_grants": round(grant_bytes / grant_count * 1_000_000) if grant_count else None,
+            }
+
+def init_app(app):
+    """Creates the index and builds it in a background thread; lookups use SQL until it is ready."""
+    if not app.config.get('ACL_INDEX_ENABLED'):
+        return None
+    index = AclIndex()
+    app.extensions['acl_index'] = index
+
+    def build():
+        with app.app_context():
+            try:
+                index.build()
+            except Exception as e:
+                # 例如資料表尚未建立：維持未就緒狀態，所有查詢回退到 SQL
+                app.logger.error("ACL index build failed: %s", e)
+                return
+            app.logger.info("ACL index ready: %s", index.memory_usage())
+
+    threading.Thread(target=build, name='acl-index-build', daemon=True).start()
+    return index
+
+def get_index():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('acl_index')
+
+def lookup(user_id, password_id):
+    index = get_index()
+    return MISS if index is None else index.permission(user_id, password_id)
+
+def shared_ids(user_id):
+    index = get_index()
+    return MISS if index is None else index.shared_ids(user_id)
+
+# --- Write hooks: call after the change is committed; no-ops when the index is disabled ---
+
+def entry_created(password_id, owner_id):
+    index = get_index()
+    if index is not None:
+        index._apply(index._set_owner, password_id, owner_id)
+
+def entry_grants(password_id):
+    """(user_id, group_id) of the entry's grants; read before deleting it so entry_deleted can drop them."""
+    if get_index() is None:
+        return []
+    return db.session.query(PasswordAccess.user_id, PasswordAccess.group_id).filter(
+        PasswordAccess.password_id == password_id
+    ).all()
+
+def entry_deleted(password_id, grants):
+    index = get_index()
+    if index is not None:
+        # 移到垃圾桶或刪除時呼叫；SQLite 可能重用被刪除的最大 id，因此連同授權一起清掉，而不只是標記擁有者
+        index._apply(index._remove_entry, password_id, list(grants))
+
+def entry_restored(password_id, owner_id):
+    """Re-adds a trashed entry together with the grants it kept while in the trash."""
+    index = get_index()
+    if index is None:
+        return
+    grants = db.session.query(
+        PasswordAccess.user_id, PasswordAccess.group_id, PasswordAccess.permission, PasswordAccess.expires_at
+    ).filter(PasswordAccess.password_id == password_id).all()
+    index._apply(index._set_owner, password_id, owner_id)
+    for user_id, group_id, permission, expires_at in grants:
+        index._apply(index._set_grant, password_id, user_id, group_id, PERMISSION_ORDER[permission], expires_at)
+
+def grant_set(password_id, user_id, group_id, permission, expires_at=None):
+    index = get_index()
+    if index is not None:
+        index._apply(index._set_grant, password_id, user_id, group_id, PERMISSION_ORDER[permission], expires_at)
+
+def grant_removed(password_id, user_id, group_id):
+    index = get_index()
+    if index is not None:
+        index._apply(index._remove_grant, password_id, user_id, group_id)
+
+def membership_set(user_id, group_id, permission):
+    index = get_index()
+    if index is not None:
+        index._apply(index._set_membership, user_id, group_id, PERMISSION_ORDER[permission])
+
+def membership_removed(user_id, group_id):
+    index = get_index()
+    if index is not None:
+        index._apply(index._remove_membership, user_id, group_id)
+
+def _closure_delta(upper, lower):
+    """Current closure rows for upper x lower as {descendant_id: {ancestor_id: rank}}; read without the lock."""
+    delta = {descendant_id: {} for descendant_id in lower}
+    if upper and lower:
+        for ancestor_id, descendant_id, permission in db.session.execute(
+            select(GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission).where(
+                GroupClosure.descendant_id.in_(list(lower)),
+                GroupClosure.ancestor_id.in_(list(upper))
+            )
+        ):
+            delta[descendant_id][ancestor_id] = PERMISSION_ORDER[permission]
+    return delta
+
+def group_deleted(group_id, upper=(), lower=()):
+    """upper / lower: the group's ancestors and descendants before the delete (group_closure.remove_group)."""
+    index = get_index()
+    if index is not None:
+        upper, lower = set(upper), set(lower)
+        delta = _closure_delta(upper, lower)
+        index._apply(index._remove_group, group_id)
+        index._apply(index._remove_closure_group, group_id, upper, delta)
+
+def closure_changed(parent_group_id, child_group_id):
+    """Call after committing a change to the parent -> child nesting edge."""
+    index = get_index()
+    if index is not None:
+        # 新增、修改或移除這條邊不會改變父群組的祖先與子群組的後代，只有兩者之間的路徑需要更新
+        upper = set(ancestors_of(parent_group_id))
+        lower = set(descendants_of(child_group_id))
+        index._apply(index._apply_closure_delta, upper, _closure_delta(upper, lower))
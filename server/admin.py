@@ -0,0 +1,137 @@
+# server/admin.py
+"""
+Operator endpoints. Disabled unless ADMIN_USER_IDS lists at least one user id;
+only those users may call them.
+
+GET /admin/grants replaces the old unauthenticated /debug/access dump: it
+pages through password_access by id with optional filters, selecting only
+the columns it returns, so one call never loads the whole table.
+"""
+
+import threading
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import select
+from models import db, PasswordAccess
+import backup
+
+admin_bp = Blueprint('admin', __name__)
+
+DEFAULT_GRANT_PAGE_SIZE = 100
+MAX_GRANT_PAGE_SIZE = 1000
+
+def admin_required(fn):
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        admin_ids = current_app.config.get('ADMIN_USER_IDS') or ()
+        if not admin_ids:
+            return jsonify({"msg": "Admin API is disabled"}), 404
+        if int(get_jwt_identity()) not in admin_ids:
+            return jsonify({"msg": "Admin privileges required"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+# 同一時間只執行一個備份；狀態保存在記憶體中
+_backup_lock = threading.Lock()
+_backup_state = {"running": False, "started_at": None, "progress": None, "report": None, "error": None}
+
+def _run_backup(app, source_path):
+    def progress(copied, total):
+        _backup_state["progress"] = {"pages_copied": copied, "pages_total": total}
+
+    try:
+        report = backup.backup_database(
+            source_path, app.config['BACKUP_DIR'],
+            step=app.config['BACKUP_STEP_PAGES'],
+            sleep=app.config['BACKUP_SLEEP'],
+            keep=app.config['BACKUP_KEEP'],
+            progress=progress,
+        )
+        _backup_state["report"] = report
+        app.logger.info("Backup written to %s (%s pages/s)", report["path"], report["pages_per_second"])
+    except Exception as e:
+        _backup_state["error"] = str(e)
+        app.logger.error("Backup failed: %s", e)
+    finally:
+        _backup_state["running"] = False
+
+# POST /admin/backup - Start an online backup in the background
+@admin_bp.route('/admin/backup', methods=['POST'])
+@admin_required
+def start_backup():
+    try:
+        source_path = backup.database_path(current_app)
+    except backup.BackupError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    with _backup_lock:
+        if _backup_state["running"]:
+            return jsonify({"msg": "A backup is already running", "backup": _backup_state}), 409
+        _backup_state.update(running=True, started_at=datetime.utcnow().isoformat(),
+                             progress=None, report=None, error=None)
+
+    threading.Thread(
+        target=_run_backup, args=(current_app._get_current_object(), source_path),
+        name='vault-backup', daemon=True
+    ).start()
+    return jsonify({"msg": "Backup started", "backup": _backup_state}), 202
+
+# GET /admin/backup - Status of the last backup and available snapshots
+@admin_bp.route('/admin/backup', methods=['GET'])
+@admin_required
+def get_backup_status():
+    try:
+        source_path = backup.database_path(current_app)
+    except backup.BackupError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    return jsonify({
+        "backup": _backup_state,
+        "snapshots": backup.list_backups(current_app.config['BACKUP_DIR'], source_path)
+    }), 200
+
+# GET /admin/grants - Grants in id order
+# Query: password_id, user_id, group_id (filters), after (the X-Next-After header of the previous page), limit
+@admin_bp.route('/admin/grants', methods=['GET'])
+@admin_required
+def list_grants():
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_GRANT_PAGE_SIZE)), MAX_GRANT_PAGE_SIZE)
+        after = int(request.args.get('after', 0))
+        filters = {
+            name: int(request.args[name])
+            for name in ('password_id', 'user_id', 'group_id') if name in request.args
+        }
+    except ValueError:
+        return jsonify({"msg": "limit, after and the id filters must be integers"}), 400
+    if limit < 1:
+        return jsonify({"msg": "limit must be positive"}), 400
+
+    # 只選需要的欄位並以 id 做鍵集分頁；各篩選欄位都有索引
+    access = PasswordAccess
+    query = select(
+        access.id, access.password_id, access.user_id, access.group_id, access.permission, access.created_at,
+        access.expires_at
+    ).where(access.id > after)
+    for name, value in filters.items():
+        query = query.where(getattr(access, name) == value)
+    rows = db.session.execute(query.order_by(access.id).limit(limit + 1)).all()
+
+    response = jsonify([
+        {
+            "id": grant_id,
+            "password_id": password_id,
+            "user_id": user_id,
+            "group_id": group_id,
+            "permission": permission.value,
+            "created_at": created_at.isoformat() if created_at else None,
+            "expires_at": expires_at.isoformat() if expires_at else None
+        }
+        for grant_id, password_id, user_id, group_id, permission, created_at, expires_at in rows[:limit]
+    ])
+    if len(rows) > limit:
+        response.headers['X-Next-After'] = str(rows[limit - 1][0])
+    return response, 200
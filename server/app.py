@@ -2,78 +2,217 @@
 server/app.py
 
 the main Flask application
+
+create_app() builds the app. Route modules are imported inside the factory,
+so importing this module stays cheap, and scripts that only need the database
+(reset_db.py, seed_db.py, backup.py) can pass components=() to skip the
+routes and background workers altogether. `from app import app` still works:
+the default app is created on first access.
+
+Unless SCHEMA_AUTO_UPGRADE is off, create_app() also creates missing tables
+and upgrades an existing database in place (schema.prepare_database), so
+`flask run` and `gunicorn app:app` start against an older vault.db.
 """
 
-from flask import Flask, g
+from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
-from sqlalchemy import text
 from models import db
-from auth import auth as auth_blueprint
-from storage import storage as storage_blueprint
-from get_passwords import get_passwords_bp
-from permission_storage import permission_storage as permission_storage_blueprint
-from groups import groups_bp 
-
-app = Flask(__name__)
-
-# 配置 CORS
-CORS(app, 
-     resources={r"/*": {"origins": ["http://localhost:3000", "https://localhost:3000", "chrome-extension://fkccdkmdocfojhkhjcbgofffbiabclgh"]}}, 
-     supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization"])
-
-# 數據庫配置
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vault.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# JWT配置
-app.config['JWT_SECRET_KEY'] = 'your-secret-key'
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = 60 * 60 * 24  # 令牌有效期24小時
-
-# 初始化插件
-db.init_app(app)
-jwt = JWTManager(app)
-
-# 註冊藍圖
-app.register_blueprint(auth_blueprint)
-app.register_blueprint(storage_blueprint)
-app.register_blueprint(get_passwords_bp)
-app.register_blueprint(permission_storage_blueprint)
-app.register_blueprint(groups_bp)
-
-# 啟用 SQLite 外鍵約束（只在第一次請求時）
-@app.before_request
-def enable_sqlite_foreign_keys_once():
-    if getattr(g, '_fk_checked', False):
-        return
-    g._fk_checked = True
-
-    if db.engine.dialect.name == 'sqlite':
-        with db.engine.connect() as connection:
-            connection.execute(text("PRAGMA foreign_keys=ON"))
+from token_blocklist import is_token_revoked
+from datetime import timedelta
+import importlib
+import os
+
+cors = CORS()
+jwt = JWTManager()
+jwt.token_in_blocklist_loader(is_token_revoked)
+
+# 依序載入的元件：(模組, 藍圖名稱, 是否有 init_app)
+# init_app 會啟動背景工作或註冊 hook，因此與藍圖一樣只在 create_app 時才匯入
+COMPONENTS = [
+    ('auth', 'auth', True),
+    ('storage', 'storage', False),
+    ('get_passwords', 'get_passwords_bp', False),
+    ('permission_storage', 'permission_storage', False),
+    ('groups', 'groups_bp', False),
+    ('audit', 'audit_bp', True),
+    ('vault_transfer', 'vault_bp', False),
+    ('admin', 'admin_bp', False),
+    ('key_rotation', 'key_rotation_bp', False),
+    ('envelope_keys', 'keys_bp', False),
+    ('events', 'events_bp', True),
+    ('acl_index', None, True),
+    ('trash', 'trash_bp', True),
+    ('grant_expiry', None, True),
+    ('history', 'history_bp', True),
+    ('limits', None, True),
+    ('attachments', 'attachments_bp', True),
+    ('compression', None, True),
+]
+
+def create_app(config=None, components=None):
+    """
+    config overrides the defaults below. components limits which modules of
+    COMPONENTS are loaded (by module name); None loads all of them.
+    """
+    app = Flask(__name__)
+
+    # 數據庫配置
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vault.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # 審計日誌寫入獨立的資料庫檔案，避免與 vault.db 的寫入互相競爭
+    app.config['SQLALCHEMY_BINDS'] = {'audit': 'sqlite:///audit.db'}
+
+    # 審計日誌配置
+    app.config['AUDIT_QUEUE_SIZE'] = 10000  # 記憶體佇列上限，滿了之後由請求執行緒直接寫入
+    app.config['AUDIT_BATCH_SIZE'] = 500  # 每次批次寫入的最大筆數
+    app.config['AUDIT_FLUSH_INTERVAL'] = 1.0  # 秒
+    app.config['AUDIT_ENQUEUE_TIMEOUT'] = 0.5  # 秒
+    app.config['AUDIT_RETRY_MAX_DELAY'] = 30.0  # 秒，寫入失敗時重試間隔的上限
+    app.config['AUDIT_SHUTDOWN_RETRIES'] = 3  # 程式結束時最多重試的次數
+
+    # 管理 API：列出允許使用的用戶 id，留空則停用
+    app.config['ADMIN_USER_IDS'] = []
+
+    # 線上備份配置（backup.py 與 POST /admin/backup）
+    app.config['BACKUP_DIR'] = os.path.join(app.instance_path, 'backups')
+    app.config['BACKUP_STEP_PAGES'] = 1024  # 每個步驟複製的頁數
+    app.config['BACKUP_SLEEP'] = 0.0  # 每個步驟之間暫停的秒數（節流）
+    app.config['BACKUP_KEEP'] = 7  # 保留的快照數量
+
+    # 即時通知（GET /events）配置
+    app.config['EVENTS_BACKEND'] = 'local'  # 'local' 或 'redis://host:6379/0'（多個 worker 時使用）
+    app.config['EVENTS_QUEUE_SIZE'] = 100  # 每個連線最多暫存的事件數，超過時送出 resync 並關閉
+    app.config['EVENTS_HEARTBEAT'] = 15  # 秒，沒有事件時送出 keepalive
+
+    # 記憶體 ACL 索引：啟動時載入授權與群組成員，權限檢查改查記憶體
+    # 索引只存在於單一行程中，多個 worker 時彼此看不到對方的寫入，因此只在單一 worker 時開啟
+    app.config['ACL_INDEX_ENABLED'] = False
+
+    # 垃圾桶：刪除只標記 deleted_at，保留期過後由背景工作分批真正刪除
+    app.config['TRASH_RETENTION'] = timedelta(days=30)
+    app.config['TRASH_PURGE_INTERVAL'] = 300  # 秒，設為 0 停用背景清除
+    app.config['TRASH_PURGE_BATCH'] = 100  # 每個交易刪除的條目數，限制持有寫入鎖的時間
+    app.config['TRASH_PURGE_PAUSE'] = 0.05  # 秒，批次之間暫停
+    app.config['TOMBSTONE_RETENTION'] = timedelta(days=90)  # 同步用的墓碑保留期
+
+    # 限時授權：POST /permission/grant 可帶 expires_at 或 expires_in_hours，過期後立即失效，由背景工作分批刪除
+    app.config['GRANT_MAX_TTL'] = None  # 最長有效期（timedelta），None 表示不限制
+    app.config['GRANT_SWEEP_INTERVAL'] = 60  # 秒，設為 0 停用背景刪除
+    app.config['GRANT_SWEEP_BATCH'] = 500  # 每個交易刪除的授權數
+    app.config['GRANT_SWEEP_PAUSE'] = 0.05  # 秒，批次之間暫停
+
+    # 條目版本歷史：每個條目保留最近的版本數與保存期限，由背景工作修剪
+    app.config['HISTORY_MAX_VERSIONS'] = 10
+    app.config['HISTORY_RETENTION'] = timedelta(days=365)  # None 表示不依時間刪除
+    app.config['HISTORY_PRUNE_INTERVAL'] = 600  # 秒，設為 0 停用修剪
+    app.config['HISTORY_PRUNE_BATCH'] = 500
+
+    # 請求大小限制（limits.py），超過時回傳 413
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024  # 位元組，一般 JSON 請求的上限
+    # 需要較大請求體的端點（以 endpoint 名稱指定，None 表示不限制）
+    app.config['ROUTE_MAX_CONTENT_LENGTH'] = {
+        'vault.import_vault': 1024 * 1024 * 1024,  # 以串流逐筆匯入，不會整個讀進記憶體
+        'key_rotation.stage_entries': 32 * 1024 * 1024,  # 每批最多 MAX_ROTATION_CHUNK 個條目
+        'keys.set_group_key': 8 * 1024 * 1024,
+        'keys.set_entry_keys': 8 * 1024 * 1024,
+        'attachments.upload_chunk': 1024 * 1024,  # 與 ATTACHMENT_CHUNK_SIZE 一致
+    }
+    # 單一欄位的字元數上限（有長度的欄位與 models.py 的欄位定義一致）
+    app.config['FIELD_MAX_LENGTHS'] = {
+        'site': 120,
+        'encrypted_data': 64 * 1024,
+        'iv': 24,
+        'notes': 16 * 1024,
+        'email': 120,
+        'login_key': 512,
+        'name': 120,
+        'description': 256,
+        'public_key': 4096,
+        'encrypted_private_key': 8192,
+        'wrapped_private_key': 8192,
+        'wrapped_key': 4096,
+    }
+
+    # 附件（attachments.py）：用戶端加密後分塊上傳，區塊以 SHA-256 存放在 ATTACHMENT_DIR
+    app.config['ATTACHMENT_DIR'] = os.path.join(app.instance_path, 'attachments')
+    app.config['ATTACHMENT_CHUNK_SIZE'] = 1024 * 1024  # 位元組
+    app.config['ATTACHMENT_MAX_SIZE'] = 25 * 1024 * 1024  # 單一附件上限
+    app.config['ATTACHMENT_MAX_PER_ENTRY'] = 20
+    app.config['ATTACHMENT_UPLOAD_TTL'] = timedelta(hours=24)  # 未完成的上傳保留多久
+    app.config['ATTACHMENT_GC_INTERVAL'] = 3600  # 秒，回收未完成上傳與不再引用的區塊檔案，設為 0 停用
+    app.config['ATTACHMENT_GC_GRACE'] = 3600  # 秒，最近寫入的區塊檔案不回收
+
+    # 回應壓縮（compression.py）：依 Accept-Encoding 選擇 zstd / br / gzip，br 與 zstd 需安裝對應套件
+    app.config['COMPRESS_ENABLED'] = True
+    app.config['COMPRESS_ALGORITHMS'] = ['zstd', 'br', 'gzip']  # q 值相同時的優先順序
+    app.config['COMPRESS_LEVELS'] = {'gzip': 1, 'br': 1, 'zstd': 1}  # 較高等級對密文幾乎沒有額外節省
+    app.config['COMPRESS_MIN_SIZE'] = 1024  # 位元組，較小的回應不壓縮
+    app.config['COMPRESS_MIMETYPES'] = ['application/json']
+
+    # JWT配置
+    app.config['JWT_SECRET_KEY'] = 'your-secret-key'
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=15)  # 存取令牌有效期15分鐘
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)  # 刷新令牌有效期30天
+    # 秒，各 worker 從 token_blocklist 同步其他 worker 撤銷紀錄的間隔；刷新令牌一律再查資料表確認
+    app.config['TOKEN_BLOCKLIST_SYNC_INTERVAL'] = 5
+
+    # 主密碼輪替工作階段的有效期
+    app.config['KEY_ROTATION_TTL'] = timedelta(hours=24)
+
+    # 啟動時建立缺少的資料表、為舊資料庫補上新增的欄位與索引（schema.prepare_database）
+    # components=() 的腳本（reset_db.py、seed_db.py、backup.py）不執行，由腳本自行處理
+    app.config['SCHEMA_AUTO_UPGRADE'] = True
+
+    if config:
+        app.config.update(config)
+
+    # 初始化插件
+    cors.init_app(app,
+                  resources={r"/*": {"origins": ["http://localhost:3000", "https://localhost:3000", "chrome-extension://fkccdkmdocfojhkhjcbgofffbiabclgh"]}},
+                  supports_credentials=True,
+                  allow_headers=["Content-Type", "Authorization"])
+    db.init_app(app)
+    jwt.init_app(app)
+
+    # 先依序初始化元件，再依序註冊藍圖
+    modules = [
+        (importlib.import_module(name), blueprint, has_init)
+        for name, blueprint, has_init in COMPONENTS
+        if components is None or name in components
+    ]
+    # 模型都已匯入（例如 audit.AuditEvent）之後、背景工作啟動之前準備資料庫
+    if app.config['SCHEMA_AUTO_UPGRADE'] and (components is None or components):
+        from schema import prepare_database
+        with app.app_context():
+            changes = prepare_database()
+        if changes:
+            app.logger.info("Upgraded database schema: %s", ", ".join(changes))
+    for module, _, has_init in modules:
+        if has_init:
+            module.init_app(app)
+    for module, blueprint, _ in modules:
+        if blueprint:
+            app.register_blueprint(getattr(module, blueprint))
+
+    # SQLite 外鍵約束在 models.py 中於每個連線建立時開啟
+
+    app.add_url_rule('/', 'health_check', health_check)
+    return app
 
 # 健康檢查路由
-@app.route('/')
 def health_check():
     return {"status": "ok", "message": "Lanbitou Password Manager API is running"}
 
+def __getattr__(name):
+    # `from app import app`、`flask --app app:app` 等舊用法：第一次存取時才建立預設的 app
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
+    # 資料表的建立與升級在 create_app() 中進行，flask run 與 gunicorn app:app 也一樣
+    app = create_app()
     app.run(debug=True)
-
-from flask import jsonify
-@app.route("/debug/access")
-def debug_access():
-    from models import PasswordAccess
-    result = []
-    for a in PasswordAccess.query.all():
-        result.append({
-            "id": a.id,
-            "user_id": a.user_id,
-            "group_id": a.group_id,
-            "password_id": a.password_id,
-            "permission": a.permission.value
-        })
-    return jsonify(result)
@@ -0,0 +1,443 @@
+# server/attachments.py
+"""
+File attachments for password entries (key files, recovery codes, ...).
+
+Attachments are kept out of user_password so /passwords stays small. The
+client encrypts the file, then uploads it in fixed-size chunks:
+
+    POST /storage/<password_id>/attachments      -> attachment id, chunk size, chunk count
+    PUT  /attachments/<id>/chunks/<index>         (raw bytes, any order, retry freely)
+    GET  /attachments/<id>                        -> which chunks are still missing
+    POST /attachments/<id>/complete
+
+Chunks are stored on disk under ATTACHMENT_DIR by their SHA-256, so a chunk
+that is uploaded twice (a retry, or the same file attached to two entries)
+is written once. Rows in attachment_chunk reference the files; attachment
+rows cascade from user_password, so deleting or purging an entry drops its
+attachments with it. The files themselves are removed by a periodic
+collector once nothing references them, which also drops uploads that were
+never completed within ATTACHMENT_UPLOAD_TTL.
+
+Downloads stream from the chunk files and honour HTTP Range requests, so an
+interrupted download can resume too. Access follows the entry:
+get_user_permission decides, and a trashed entry's attachments are hidden.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import quote
+from flask import Blueprint, Response, current_app, jsonify, request, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import delete, func, select
+from werkzeug.datastructures import ContentRange
+from models import db, Attachment, AttachmentChunk, PermissionEnum
+from permission_storage import get_user_permission
+from request_context import get_password_entry
+from audit import record as audit
+from jobs import PeriodicJob
+from limits import field_error
+import events
+
+attachments_bp = Blueprint('attachments', __name__)
+
+READ_SIZE = 64 * 1024
+
+PERMISSION_RANK = {PermissionEnum.READ: 1, PermissionEnum.WRITE: 2, PermissionEnum.DELETE: 3}
+
+class ChunkError(ValueError):
+    pass
+
+def _is_sha256(value):
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return True
+
+# --- Chunk storage ---
+
+def chunk_path(digest, root=None):
+    root = root or current_app.config['ATTACHMENT_DIR']
+    # 以雜湊前兩層分目錄，避免單一目錄放太多檔案
+    return os.path.join(root, digest[:2], digest[2:4], digest)
+
+def store_chunk(stream, expected_size, expected_digest=None):
+    """
+    Copies a chunk from stream to its content-addressed file and returns its
+    SHA-256. The body is hashed while it is written to a temporary file, so it
+    is never held in memory; the file is only moved into place once its size
+    (and digest, if the client sent one) match.
+    """
+    root = current_app.config['ATTACHMENT_DIR']
+    tmp_dir = os.path.join(root, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        hasher = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > expected_size:
+                    raise ChunkError(f"Chunk must be {expected_size} bytes")
+                hasher.update(block)
+                f.write(block)
+        if size != expected_size:
+            raise ChunkError(f"Chunk must be {expected_size} bytes, got {size}")
+        digest = hasher.hexdigest()
+        if expected_digest and expected_digest.lower() != digest:
+            raise ChunkError("Chunk digest does not match X-Chunk-SHA256")
+
+        path = chunk_path(digest, root)
+        if os.path.exists(path):
+            # 內容相同的區塊已存在：更新修改時間，讓回收工作在寬限期內不會刪除它
+            os.utime(path)
+            os.unlink(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return digest
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def _chunk_count(attachment):
+    return max(1, -(-attachment.size // attachment.chunk_size))
+
+def _expected_chunk_size(attachment, index):
+    if index < _chunk_count(attachment) - 1:
+        return attachment.chunk_size
+    return attachment.size - attachment.chunk_size * index
+
+def _chunks(attachment_id):
+    """[(digest, size)] in file order."""
+    return db.session.execute(
+        select(AttachmentChunk.digest, AttachmentChunk.size)
+        .where(AttachmentChunk.attachment_id == attachment_id)
+        .order_by(AttachmentChunk.index)
+    ).all()
+
+def _received_indexes(attachment_id):
+    return [i for (i,) in db.session.execute(
+        select(AttachmentChunk.index).where(AttachmentChunk.attachment_id == attachment_id)
+    )]
+
+# --- Collector ---
+
+def collect_garbage(upload_ttl=None, grace=3600):
+    """
+    Deletes uploads left incomplete for longer than upload_ttl, then removes
+    chunk files no attachment references. Files modified within grace seconds
+    are kept: they may belong to an upload whose row is not committed yet.
+    Returns (uploads deleted, files deleted).
+    """
+    uploads = 0
+    if upload_ttl:
+        uploads = db.session.execute(delete(Attachment).where(
+            Attachment.status == 'uploading',
+            Attachment.created_at < datetime.utcnow() - upload_ttl
+        )).rowcount
+        db.session.commit()
+
+    root = current_app.config['ATTACHMENT_DIR']
+    if not os.path.isdir(root):
+        return uploads, 0
+    referenced = set(db.session.execute(select(AttachmentChunk.digest).distinct()).scalars())
+    db.session.rollback()  # 不要在掃描檔案時佔著讀取交易
+
+    cutoff = time.time() - grace
+    files = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename in referenced:
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    files += 1
+            except FileNotFoundError:
+                pass
+    return uploads, files
+
+def _collect_job(app):
+    uploads, files = collect_garbage(app.config.get('ATTACHMENT_UPLOAD_TTL'), app.config.get('ATTACHMENT_GC_GRACE', 3600))
+    if uploads or files:
+        app.logger.info("Removed %d abandoned uploads and %d unreferenced chunk files", uploads, files)
+
+def init_app(app):
+    app.config.setdefault('ATTACHMENT_DIR', os.path.join(app.instance_path, 'attachments'))
+    if not app.config.get('ATTACHMENT_GC_INTERVAL'):
+        return None
+    job = PeriodicJob(app, 'attachment-collector', app.config['ATTACHMENT_GC_INTERVAL'], lambda: _collect_job(app))
+    app.extensions['attachment_collector'] = job
+    return job
+
+# --- Routes ---
+
+def _check_access(user_id, password_id, required):
+    perm = get_user_permission(user_id, password_id)
+    if not perm or not get_password_entry(password_id) or PERMISSION_RANK[perm] < PERMISSION_RANK[required]:
+        return jsonify({"msg": f"{required.value.capitalize()} permission required"}), 403
+    return None
+
+def _load(attachment_id, user_id, required):
+    """Returns (attachment, None) or (None, error response)."""
+    attachment = db.session.get(Attachment, attachment_id)
+    if not attachment:
+        return None, (jsonify({"msg": "Attachment not found"}), 404)
+    error = _check_access(user_id, attachment.password_id, required)
+    if error:
+        return None, error
+    return attachment, None
+
+def _serialize(attachment):
+    return {
+        "id": attachment.id,
+        "password_id": attachment.password_id,
+        "name": attachment.name,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "chunk_size": attachment.chunk_size,
+        "chunks": _chunk_count(attachment),
+        "sha256": attachment.sha256,
+        "status": attachment.status,
+        "created_by": attachment.created_by,
+        "created_at": attachment.created_at.isoformat() if attachment.created_at else None,
+        "completed_at": attachment.completed_at.isoformat() if attachment.completed_at else None
+    }
+
+# POST /storage/<password_id>/attachments - Start an upload (requires write access)
+# Body: {"name": ..., "size": bytes, "content_type": optional, "sha256": optional digest of the whole file}
+@attachments_bp.route('/storage/<int:password_id>/attachments', methods=['POST'])
+@jwt_required()
+def create_attachment(password_id):
+    current_user_id = int(get_jwt_identity())
+    error = _check_access(current_user_id, password_id, PermissionEnum.WRITE)
+    if error:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    error = field_error(data, ('name', 'content_type'))
+    if error:
+        return error
+    name = data.get('name')
+    size = data.get('size')
+    if not name or not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return jsonify({"msg": "name and a non-negative integer size are required"}), 400
+    if not isinstance(name, str) or not isinstance(data.get('content_type') or '', str):
+        return jsonify({"msg": "name and content_type must be strings"}), 400
+    sha256 = data.get('sha256')
+    if sha256 and not _is_sha256(sha256):
+        return jsonify({"msg": "sha256 must be a 64-character hex digest"}), 400
+    max_size = current_app.config['ATTACHMENT_MAX_SIZE']
+    if size > max_size:
+        return jsonify({"msg": "Attachment too large", "max_bytes": max_size}), 413
+
+    count = db.session.query(func.count(Attachment.id)).filter(Attachment.password_id == password_id).scalar()
+    if count >= current_app.config['ATTACHMENT_MAX_PER_ENTRY']:
+        return jsonify({"msg": "Too many attachments on this entry"}), 409
+
+    attachment = Attachment(
+        password_id=password_id,
+        name=name,
+        content_type=data.get('content_type'),
+        size=size,
+        chunk_size=current_app.config['ATTACHMENT_CHUNK_SIZE'],
+        sha256=sha256.lower() if sha256 else None,
+        created_by=current_user_id
+    )
+    db.session.add(attachment)
+    db.session.commit()
+    return jsonify(_serialize(attachment)), 201
+
+# GET /storage/<password_id>/attachments - Completed attachments of an entry (requires read access)
+@attachments_bp.route('/storage/<int:password_id>/attachments', methods=['GET'])
+@jwt_required()
+def list_attachments(password_id):
+    current_user_id = int(get_jwt_identity())
+    error = _check_access(current_user_id, password_id, PermissionEnum.READ)
+    if error:
+        return error
+
+    attachments = Attachment.query.filter_by(password_id=password_id, status='complete') \
+        .order_by(Attachment.id).all()
+    return jsonify([_serialize(a) for a in attachments]), 200
+
+# GET /attachments/<attachment_id> - Attachment details; while uploading, also the chunks still missing
+@attachments_bp.route('/attachments/<int:attachment_id>', methods=['GET'])
+@jwt_required()
+def get_attachment(attachment_id):
+    current_user_id = int(get_jwt_identity())
+    attachment, error = _load(attachment_id, current_user_id, PermissionEnum.READ)
+    if error:
+        return error
+
+    result = _serialize(attachment)
+    if attachment.status == 'uploading':
+        received = set(_received_indexes(attachment_id))
+        result["missing_chunks"] = [i for i in range(_chunk_count(attachment)) if i not in received]
+    return jsonify(result), 200
+
+# PUT /attachments/<attachment_id>/chunks/<index> - Upload one chunk as the raw request body
+# Optional header X-Chunk-SHA256 lets the server reject a chunk corrupted in transit.
+@attachments_bp.route('/attachments/<int:attachment_id>/chunks/<int:index>', methods=['PUT'])
+@jwt_required()
+def upload_chunk(attachment_id, index):
+    current_user_id = int(get_jwt_identity())
+    attachment, error = _load(attachment_id, current_user_id, PermissionEnum.WRITE)
+    if error:
+        return error
+    if attachment.status != 'uploading':
+        return jsonify({"msg": "Attachment upload is already complete"}), 409
+    if index >= _chunk_count(attachment):
+        return jsonify({"msg": f"Chunk index must be below {_chunk_count(attachment)}"}), 400
+
+    expected_size = _expected_chunk_size(attachment, index)
+    try:
+        digest = store_chunk(request.stream, expected_size, request.headers.get('X-Chunk-SHA256'))
+    except ChunkError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # 重傳同一個區塊時直接覆蓋，上傳可以安全地重試
+    db.session.merge(AttachmentChunk(attachment_id=attachment_id, index=index, digest=digest, size=expected_size))
+    db.session.commit()
+    return jsonify({"index": index, "sha256": digest, "size": expected_size}), 200
+
+# POST /attachments/<attachment_id>/complete - Finish an upload once every chunk is in
+@attachments_bp.route('/attachments/<int:attachment_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_attachment(attachment_id):
+    current_user_id = int(get_jwt_identity())
+    attachment, error = _load(attachment_id, current_user_id, PermissionEnum.WRITE)
+    if error:
+        return error
+    if attachment.status == 'complete':
+        return jsonify(_serialize(attachment)), 200
+
+    chunks = _chunks(attachment_id)
+    if len(chunks) != _chunk_count(attachment) or sum(size for _, size in chunks) != attachment.size:
+        received = set(_received_indexes(attachment_id))
+        missing = [i for i in range(_chunk_count(attachment)) if i not in received]
+        return jsonify({"msg": "Upload is missing chunks", "missing_chunks": missing}), 409
+
+    if attachment.sha256:
+        hasher = hashlib.sha256()
+        for block in _read_range(chunks, 0, attachment.size):
+            hasher.update(block)
+        if hasher.hexdigest() != attachment.sha256:
+            return jsonify({"msg": "File digest does not match sha256"}), 400
+
+    attachment.status = 'complete'
+    attachment.completed_at = datetime.utcnow()
+    db.session.commit()
+    audit('attachment.add', user_id=current_user_id, password_id=attachment.password_id, attachment_id=attachment_id)
+    events.notify(events.ENTRY_CHANGED, events.password_audience(attachment.password_id),
+                  action='attachment-added', password_id=attachment.password_id, attachment_id=attachment_id)
+    return jsonify(_serialize(attachment)), 200
+
+def _read_range(chunks, start, stop, root=None):
+    """Yields the bytes [start, stop) of a file stored as chunks, reading only the chunks it overlaps."""
+    root = root or current_app.config['ATTACHMENT_DIR']
+    offset = 0
+    for digest, size in chunks:
+        chunk_start, chunk_stop = offset, offset + size
+        offset = chunk_stop
+        if chunk_stop <= start:
+            continue
+        if chunk_start >= stop:
+            break
+        with open(chunk_path(digest, root), 'rb') as f:
+            f.seek(max(start - chunk_start, 0))
+            remaining = min(stop, chunk_stop) - max(start, chunk_start)
+            while remaining > 0:
+                block = f.read(min(READ_SIZE, remaining))
+                if not block:
+                    raise IOError(f"Chunk file {digest} is truncated")
+                remaining -= len(block)
+                yield block
+
+def _content_disposition(name):
+    return f"attachment; filename*=UTF-8''{quote(name)}"
+
+# GET /attachments/<attachment_id>/content - Download (requires read access; supports Range and If-Range)
+@attachments_bp.route('/attachments/<int:attachment_id>/content', methods=['GET'])
+@jwt_required()
+def download_attachment(attachment_id):
+    current_user_id = int(get_jwt_identity())
+    attachment, error = _load(attachment_id, current_user_id, PermissionEnum.READ)
+    if error:
+        return error
+    if attachment.status != 'complete':
+        return jsonify({"msg": "Attachment upload is not complete"}), 409
+
+    chunks = _chunks(attachment_id)
+    # ETag 由區塊雜湊組成，內容不變就不變，可用於 If-Range 續傳
+    etag = hashlib.sha256(''.join(digest for digest, _ in chunks).encode()).hexdigest()
+    mimetype = attachment.content_type or 'application/octet-stream'
+    audit('attachment.read', user_id=current_user_id, password_id=attachment.password_id, attachment_id=attachment_id)
+
+    if len(chunks) == 1:
+        # 單一區塊就是完整檔案，交給 send_file 處理 Range 與條件請求
+        response = send_file(
+            chunk_path(chunks[0][0]), mimetype=mimetype, as_attachment=True,
+            download_name=attachment.name, etag=etag, conditional=True
+        )
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    size = attachment.size
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    # If-Range 的 ETag 不符表示檔案已變更，改回傳完整內容
+    if_range_matches = 'If-Range' not in request.headers or request.if_range.etag == etag
+    if byte_range is not None and if_range_matches and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            response = Response(status=416)
+            response.content_range = ContentRange('bytes', None, None, size)
+            return response
+        start, stop = bounds
+        status = 206
+
+    # 產生器在請求結束後才執行，先取出目錄，不依賴 app context
+    response = Response(_read_range(chunks, start, stop, current_app.config['ATTACHMENT_DIR']), status=status, mimetype=mimetype)
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Content-Disposition'] = _content_disposition(attachment.name)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag)
+    if status == 206:
+        response.content_range = ContentRange('bytes', start, stop, size)
+    return response
+
+# DELETE /attachments/<attachment_id> - Delete an attachment (requires delete access; write access for an unfinished upload)
+@attachments_bp.route('/attachments/<int:attachment_id>', methods=['DELETE'])
+@jwt_required()
+def delete_attachment(attachment_id):
+    current_user_id = int(get_jwt_identity())
+    attachment = db.session.get(Attachment, attachment_id)
+    required = PermissionEnum.DELETE if attachment and attachment.status == 'complete' else PermissionEnum.WRITE
+    attachment, error = _load(attachment_id, current_user_id, required)
+    if error:
+        return error
+
+    password_id = attachment.password_id
+    was_complete = attachment.status == 'complete'
+    # 區塊列透過 ON DELETE CASCADE 刪除，檔案由回收工作清除
+    db.session.execute(delete(Attachment).where(Attachment.id == attachment_id))
+    db.session.commit()
+    if was_complete:
+        audit('attachment.delete', user_id=current_user_id, password_id=password_id, attachment_id=attachment_id)
+        events.notify(events.ENTRY_CHANGED, events.password_audience(password_id),
+                      action='attachment-deleted', password_id=password_id, attachment_id=attachment_id)
+    return jsonify({"msg": "Attachment deleted"}), 200
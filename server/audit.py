@@ -0,0 +1,249 @@
+# server/audit.py
+"""
+Append-only audit log.
+
+Routes call record() after a successful change or read. Events are queued in
+memory and a background thread writes them in batches to a separate database
+(the 'audit' bind), so auditing does not add a synchronous insert to every
+request on the main vault.db.
+
+- Backpressure: the queue is bounded. When it is full, record() waits up to
+  AUDIT_ENQUEUE_TIMEOUT seconds and then writes the event itself instead of
+  dropping it.
+- Write failures: the writer retries a failed batch with exponential backoff
+  (up to AUDIT_RETRY_MAX_DELAY seconds between attempts). An inline write that
+  fails is handed to the writer, which holds at most AUDIT_QUEUE_SIZE such
+  events. Events are only lost, with an error logged, if the audit database
+  stays unwritable past that backlog or through shutdown.
+- Durability on shutdown: an atexit hook stops the writer and flushes
+  everything still queued, giving up after AUDIT_SHUTDOWN_RETRIES attempts.
+"""
+
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import db, UserPassword
+
+audit_bp = Blueprint('audit', __name__)
+
+class AuditEvent(db.Model):
+    __bind_key__ = 'audit'
+    __tablename__ = 'audit_event'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    action = db.Column(db.String(32), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)  # actor
+    password_id = db.Column(db.Integer, nullable=True)
+    group_id = db.Column(db.Integer, nullable=True)
+    target_user_id = db.Column(db.Integer, nullable=True)
+    detail = db.Column(db.Text, nullable=True)  # JSON
+
+    __table_args__ = (
+        db.Index('ix_audit_password_time', 'password_id', 'created_at'),
+        db.Index('ix_audit_user_time', 'user_id', 'created_at'),
+        db.Index('ix_audit_group_time', 'group_id', 'created_at'),
+    )
+
+_STOP = object()
+
+class AuditWriter:
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(maxsize=app.config.get('AUDIT_QUEUE_SIZE', 10000))
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', 1.0)
+        self.enqueue_timeout = app.config.get('AUDIT_ENQUEUE_TIMEOUT', 0.5)
+        self.max_retry_delay = app.config.get('AUDIT_RETRY_MAX_DELAY', 30.0)
+        self.shutdown_retries = app.config.get('AUDIT_SHUTDOWN_RETRIES', 3)
+        self._failed = []  # 請求執行緒寫入失敗的事件，交給背景執行緒重試
+        self._failed_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._stopped = False
+        self._thread.start()
+
+    def submit(self, event):
+        if self._stopped:
+            self._write_with_retry([event])
+            return
+        try:
+            self.queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # 佇列已滿：由呼叫者自行寫入，放慢請求速度而不是遺失事件
+            if not self._write([event]):
+                self._hand_over(event)
+
+    def _hand_over(self, event):
+        with self._failed_lock:
+            if len(self._failed) < self.queue.maxsize:
+                self._failed.append(event)
+                return
+        self.app.logger.error("Audit backlog is full, dropped 1 audit event")
+
+    def _take_failed(self):
+        with self._failed_lock:
+            failed, self._failed = self._failed, []
+        return failed
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                failed = self._take_failed()
+                if failed:
+                    self._write_with_retry(failed)
+                continue
+            if first is _STOP:
+                self._drain()
+                return
+
+            batch = self._take_failed() + [first]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_with_retry(batch)
+            if stop:
+                self._drain()
+                return
+
+    def _drain(self):
+        batch = self._take_failed()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self._write_with_retry(batch)
+
+    def _write(self, events):
+        """Inserts one batch; returns False (after logging) if the audit database rejected it."""
+        try:
+            with self._write_lock, self.app.app_context():
+                with db.engines['audit'].begin() as connection:
+                    connection.execute(AuditEvent.__table__.insert(), events)
+            return True
+        except Exception as e:
+            self.app.logger.error("Failed to write %d audit events: %s", len(events), e)
+            return False
+
+    def _write_with_retry(self, events):
+        # 執行期間持續重試（期間佇列會累積，滿了之後由請求執行緒直接寫入）；停止後只重試有限次數
+        delay = 0.1
+        attempts = 1
+        while not self._write(events):
+            if self._stopped and attempts >= self.shutdown_retries:
+                self.app.logger.error("Dropped %d audit events after %d attempts", len(events), attempts)
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            attempts += 1
+        return True
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self.queue.put(_STOP)
+        self._thread.join()
+
+def init_app(app):
+    writer = AuditWriter(app)
+    app.extensions['audit'] = writer
+    atexit.register(writer.stop)
+    return writer
+
+def record(action, user_id=None, password_id=None, group_id=None, target_user_id=None, **detail):
+    """Queues one audit event; a no-op when the audit writer is not initialized."""
+    writer = current_app.extensions.get('audit')
+    if writer is None:
+        return
+    writer.submit({
+        "created_at": datetime.utcnow(),
+        "action": action,
+        "user_id": user_id,
+        "password_id": password_id,
+        "group_id": group_id,
+        "target_user_id": target_user_id,
+        "detail": json.dumps(detail, ensure_ascii=False) if detail else None,
+    })
+
+def _parse_time(value):
+    """ISO 8601 to naive UTC (created_at is stored in UTC); values without an offset are taken as UTC."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# GET /audit - Query audit events
+# Query: password_id (must be owned by the caller) or user_id (defaults to the caller),
+#        since, until (ISO 8601), limit, before_id (keyset pagination)
+@audit_bp.route('/audit', methods=['GET'])
+@jwt_required()
+def get_audit_events():
+    current_user_id = int(get_jwt_identity())
+
+    try:
+        password_id = request.args.get('password_id', type=int)
+        user_id = request.args.get('user_id', current_user_id, type=int)
+        since = _parse_time(request.args.get('since'))
+        until = _parse_time(request.args.get('until'))
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError:
+        return jsonify({"msg": "Invalid query parameters"}), 400
+    if limit < 1:
+        return jsonify({"msg": "limit must be positive"}), 400
+
+    query = AuditEvent.query
+    if password_id is not None:
+        password = db.session.get(UserPassword, password_id)
+        if not password or password.user_id != current_user_id:
+            return jsonify({"msg": "You do not own this password or it does not exist"}), 403
+        query = query.filter(AuditEvent.password_id == password_id)
+    else:
+        if user_id != current_user_id:
+            return jsonify({"msg": "You can only view your own audit events"}), 403
+        query = query.filter(AuditEvent.user_id == user_id)
+
+    if since:
+        query = query.filter(AuditEvent.created_at >= since)
+    if until:
+        query = query.filter(AuditEvent.created_at < until)
+    if before_id:
+        query = query.filter(AuditEvent.id < before_id)
+
+    events = query.order_by(AuditEvent.id.desc()).limit(limit).all()
+    response = jsonify([
+        {
+            "id": e.id,
+            "created_at": e.created_at.isoformat(),
+            "action": e.action,
+            "user_id": e.user_id,
+            "password_id": e.password_id,
+            "group_id": e.group_id,
+            "target_user_id": e.target_user_id,
+            "detail": json.loads(e.detail) if e.detail else None
+        }
+        for e in events
+    ])
+    if len(events) == limit:
+        response.headers['X-Next-Before-Id'] = str(events[-1].id)
+    return response, 200
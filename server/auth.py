@@ -5,16 +5,57 @@ authentication and registration routes
 """
 
 from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import create_access_token
-from argon2 import PasswordHasher
+from flask_jwt_extended import (
+    create_access_token, create_refresh_token, jwt_required,
+    get_jwt, get_jwt_identity, decode_token
+)
+from jwt.exceptions import PyJWTError
 from argon2.exceptions import VerifyMismatchError
 from models import db, User
+from token_blocklist import revoke_token
+from limits import field_error
 import os
 import secrets
 import base64
+import threading
+from functools import lru_cache
 
 auth = Blueprint('auth', __name__)
-ph = PasswordHasher()
+
+# 限制同時進行的 Argon2 運算數量（註冊、登入與假驗證共用同一個限制器）
+kdf_limiter = threading.BoundedSemaphore(os.cpu_count() or 2)
+
+@lru_cache(maxsize=None)
+def password_hasher():
+    """Argon2 hasher, created on first use so importing this module stays cheap."""
+    from argon2 import PasswordHasher
+    return PasswordHasher()
+
+@lru_cache(maxsize=None)
+def _dummy_hash():
+    # 假雜湊：帳號不存在時也做一次完整的 Argon2 驗證，
+    # 讓回應時間與帳號存在時相同，避免透過時間差列舉帳號。
+    # 第一次需要時才計算（約 0.2 秒），不拖慢啟動
+    return password_hasher().hash(secrets.token_urlsafe(32))
+
+def init_app(app):
+    # 在背景先算好假雜湊，第一個登入請求不必多等，也不延遲啟動
+    threading.Thread(target=_dummy_hash, name='argon2-warmup', daemon=True).start()
+
+def hash_login_key(login_key):
+    with kdf_limiter:
+        return password_hasher().hash(login_key)
+
+def verify_login_key(password_hash, login_key):
+    """驗證登入金鑰；password_hash 為 None 時改用假雜湊並一律視為失敗"""
+    with kdf_limiter:
+        if password_hash is None:
+            try:
+                password_hasher().verify(_dummy_hash(), login_key)
+            except VerifyMismatchError:
+                pass
+            raise VerifyMismatchError()
+        return password_hasher().verify(password_hash, login_key)
 
 # POST /register
 @auth.route('/register', methods=['POST'])
@@ -23,6 +64,9 @@ def register():
     
     if not data:
         return jsonify({"msg": "無法解析請求數據"}), 400
+    error = field_error(data)
+    if error:
+        return error
         
     email = data.get('email')
     login_key = data.get('login_key')  # 從PBKDF2推導的登入金鑰
@@ -35,7 +79,7 @@ def register():
 
     try:
         # 使用Argon2雜湊登入金鑰
-        hashed_login_key = ph.hash(login_key)
+        hashed_login_key = hash_login_key(login_key)
         
         # 生成數據鹽值用於E2EE加密 (32字節)
         data_salt = secrets.token_bytes(32)
@@ -76,15 +120,14 @@ def login():
         return jsonify({"msg": "需要電子郵件和登入金鑰"}), 400
 
     user = User.query.filter_by(email=email).first()
-    if not user:
-        return jsonify({"msg": "無效的憑證"}), 401
     
     try:
-        # 使用Argon2驗證提交的登入金鑰
-        ph.verify(user.password_hash, login_key)
+        # 使用Argon2驗證提交的登入金鑰（帳號不存在時仍會花費同樣的驗證成本）
+        verify_login_key(user.password_hash if user else None, login_key)
         
-        # 創建JWT令牌
+        # 創建JWT令牌（短效的存取令牌與用於換發的刷新令牌）
         token = create_access_token(identity=str(user.id))
+        refresh_token = create_refresh_token(identity=str(user.id))
         
         # 檢查是否是首次登入
         is_first_login = user.login_count == 0
@@ -93,9 +136,10 @@ def login():
         user.login_count += 1
         db.session.commit()
         
-        # 返回令牌、用戶ID、數據鹽值和是否首次登入
+        # 返回令牌、刷新令牌、用戶ID、數據鹽值和是否首次登入
         return jsonify({
             "token": token, 
+            "refresh_token": refresh_token,
             "user_id": user.id,
             "data_salt": user.data_salt,
             "is_first_login": is_first_login
@@ -105,3 +149,32 @@ def login():
         return jsonify({"msg": "無效的憑證"}), 401
     except Exception as e:
         return jsonify({"msg": "登入失敗", "error": str(e)}), 500
+
+
+# POST /refresh
+@auth.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    token = create_access_token(identity=get_jwt_identity())
+    return jsonify({"token": token}), 200
+
+# POST /logout
+@auth.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    current_user_id = get_jwt_identity()
+    revoke_token(get_jwt())
+
+    # 可一併撤銷刷新令牌
+    data = request.get_json(silent=True) or {}
+    refresh_token = data.get('refresh_token')
+    if refresh_token:
+        try:
+            refresh_payload = decode_token(refresh_token, allow_expired=True)
+        except PyJWTError:
+            return jsonify({"msg": "無效的刷新令牌"}), 400
+        if refresh_payload.get("sub") != current_user_id:
+            return jsonify({"msg": "無效的刷新令牌"}), 400
+        revoke_token(refresh_payload)
+
+    return jsonify({"msg": "已登出"}), 200
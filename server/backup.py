@@ -0,0 +1,250 @@
+# backup.py
+"""
+Online backup and restore of the SQLite vault.
+
+Uses SQLite's online backup API, which copies the database a few pages at a
+time. Between steps the source is unlocked, so writers are only blocked for
+the duration of one step. Each snapshot is written to a temporary file,
+checked with PRAGMA integrity_check, and then renamed into the backup
+directory. The oldest snapshots beyond --keep are removed.
+
+If another connection writes to the database during a backup, SQLite
+restarts the copy. The report counts these restarts, together with the
+pages/sec figure used to size backup windows.
+
+Usage:
+    python backup.py backup --step 1024 --sleep 0.01 --keep 7
+    python backup.py list
+    python backup.py verify instance/backups/vault-20250601-120000.db
+    python backup.py restore instance/backups/vault-20250601-120000.db
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+DEFAULT_STEP_PAGES = 1024  # 每次複製的頁數（4 KiB 頁面約 4 MiB）
+DEFAULT_SLEEP = 0.0  # 每個步驟之間暫停的秒數，用來限制備份對寫入的影響
+DEFAULT_KEEP = 7
+
+
+class BackupError(Exception):
+    pass
+
+
+def snapshot_name(source_path, now=None):
+    base = os.path.splitext(os.path.basename(source_path))[0]
+    return f"{base}-{(now or datetime.utcnow()):%Y%m%d-%H%M%S}.db"
+
+
+def integrity_check(path, quick=False):
+    """Returns a list of problems reported by SQLite; empty when the file is intact."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        pragma = "quick_check" if quick else "integrity_check"
+        rows = [row[0] for row in connection.execute(f"PRAGMA {pragma}")]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        connection.close()
+    return [] if rows == ["ok"] else rows
+
+
+def copy_database(source, destination, step=DEFAULT_STEP_PAGES, sleep=DEFAULT_SLEEP, progress=None):
+    """
+    Copies an open source connection into destination with the backup API.
+    Returns (total pages, restarts). progress(copied, total) is called after each step.
+    """
+    state = {"total": 0, "remaining": None, "restarts": 0}
+
+    def on_step(status, remaining, total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1  # 來源被其他連線寫入，SQLite 重新開始複製
+        state["remaining"] = remaining
+        state["total"] = total
+        if progress:
+            progress(total - remaining, total)
+        if sleep and remaining:
+            time.sleep(sleep)
+
+    source.backup(destination, pages=step, progress=on_step)
+    return state["total"], state["restarts"]
+
+
+def backup_database(source_path, backup_dir, step=DEFAULT_STEP_PAGES, sleep=DEFAULT_SLEEP,
+                    keep=DEFAULT_KEEP, verify=True, progress=None):
+    """Writes a verified snapshot of source_path into backup_dir and rotates old ones. Returns a report."""
+    if not os.path.exists(source_path):
+        raise BackupError(f"Database not found: {source_path}")
+    os.makedirs(backup_dir, exist_ok=True)
+
+    target = os.path.join(backup_dir, snapshot_name(source_path))
+    partial = target + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    start = time.perf_counter()
+    source = sqlite3.connect(source_path)
+    destination = sqlite3.connect(partial)
+    try:
+        page_size = source.execute("PRAGMA page_size").fetchone()[0]
+        pages, restarts = copy_database(source, destination, step, sleep, progress)
+    finally:
+        destination.close()
+        source.close()
+    copy_seconds = time.perf_counter() - start
+
+    if verify:
+        verify_start = time.perf_counter()
+        problems = integrity_check(partial)
+        verify_seconds = time.perf_counter() - verify_start
+        if problems:
+            os.remove(partial)
+            raise BackupError(f"Snapshot failed integrity check: {problems[:5]}")
+    else:
+        verify_seconds = None
+
+    os.replace(partial, target)
+    removed = rotate_backups(backup_dir, source_path, keep)
+
+    return {
+        "path": target,
+        "pages": pages,
+        "page_size": page_size,
+        "bytes": os.path.getsize(target),
+        "restarts": restarts,
+        "copy_seconds": round(copy_seconds, 3),
+        "pages_per_second": round(pages / max(copy_seconds, 1e-9)),
+        "verified": verify,
+        "verify_seconds": round(verify_seconds, 3) if verify_seconds is not None else None,
+        "rotated": removed,
+    }
+
+
+def list_backups(backup_dir, source_path):
+    """Snapshots of source_path in backup_dir, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = os.path.splitext(os.path.basename(source_path))[0] + "-"
+    names = [n for n in os.listdir(backup_dir) if n.startswith(prefix) and n.endswith(".db")]
+    return [os.path.join(backup_dir, n) for n in sorted(names, reverse=True)]
+
+
+def rotate_backups(backup_dir, source_path, keep):
+    removed = []
+    if keep is None or keep <= 0:
+        return removed
+    for path in list_backups(backup_dir, source_path)[keep:]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def restore_database(backup_path, target_path, step=DEFAULT_STEP_PAGES, progress=None):
+    """
+    Copies a verified snapshot over target_path through the backup API. SQLite
+    locks the target for the copy, so other connections see either the old or
+    the restored database. Restart the server afterwards: in-process caches
+    such as the token blocklist still describe the old data.
+    """
+    problems = integrity_check(backup_path)
+    if problems:
+        raise BackupError(f"Backup failed integrity check: {problems[:5]}")
+
+    start = time.perf_counter()
+    source = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+    destination = sqlite3.connect(target_path)
+    try:
+        pages, _ = copy_database(source, destination, step, 0, progress)
+    finally:
+        destination.close()
+        source.close()
+    seconds = time.perf_counter() - start
+    return {
+        "path": target_path,
+        "pages": pages,
+        "copy_seconds": round(seconds, 3),
+        "pages_per_second": round(pages / max(seconds, 1e-9)),
+    }
+
+
+def database_path(app):
+    from models import db
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        raise BackupError("Online backup is only supported for file-based SQLite databases")
+    return url.database
+
+
+def print_progress(copied, total):
+    print(f"\r  {copied}/{total} pages", end="", flush=True)
+
+
+def main():
+    parent = argparse.ArgumentParser(add_help=False)
+    parent.add_argument("--database", help="SQLite file to back up / restore (default: the app's vault.db)")
+    parent.add_argument("--backup-dir", help="snapshot directory (default: BACKUP_DIR from app.py)")
+    parent.add_argument("--step", type=int, default=None, help="pages copied per step")
+
+    parser = argparse.ArgumentParser(description="Online backup and restore of the SQLite vault")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_parser = commands.add_parser("backup", parents=[parent], help="take a verified snapshot")
+    backup_parser.add_argument("--sleep", type=float, default=None, help="seconds to pause between steps")
+    backup_parser.add_argument("--keep", type=int, default=None, help="snapshots to keep (0 keeps all)")
+    backup_parser.add_argument("--no-verify", action="store_true", help="skip PRAGMA integrity_check")
+    commands.add_parser("list", parents=[parent], help="list snapshots, newest first")
+    verify_parser = commands.add_parser("verify", parents=[parent], help="run integrity_check on a snapshot")
+    verify_parser.add_argument("snapshot")
+    restore_parser = commands.add_parser("restore", parents=[parent], help="copy a snapshot over the database")
+    restore_parser.add_argument("snapshot", nargs="?", help="snapshot to restore (default: newest)")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app(components=())
+    source_path = args.database or database_path(app)
+    backup_dir = args.backup_dir or app.config["BACKUP_DIR"]
+    step = args.step or app.config["BACKUP_STEP_PAGES"]
+
+    try:
+        if args.command == "backup":
+            report = backup_database(
+                source_path, backup_dir, step=step,
+                sleep=app.config["BACKUP_SLEEP"] if args.sleep is None else args.sleep,
+                keep=app.config["BACKUP_KEEP"] if args.keep is None else args.keep,
+                verify=not args.no_verify, progress=print_progress,
+            )
+            print()
+            print(f"Snapshot written to {report['path']} ({report['bytes'] / 1024 / 1024:.1f} MiB)")
+            print(f"  {report['pages']} pages in {report['copy_seconds']}s = {report['pages_per_second']} pages/s"
+                  f" ({report['restarts']} restarts)")
+            if report["verified"]:
+                print(f"  integrity_check ok in {report['verify_seconds']}s")
+            for path in report["rotated"]:
+                print(f"  removed old snapshot {path}")
+        elif args.command == "list":
+            for path in list_backups(backup_dir, source_path):
+                print(f"{path}  {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+        elif args.command == "verify":
+            problems = integrity_check(args.snapshot)
+            print("ok" if not problems else "\n".join(problems))
+            return 0 if not problems else 1
+        elif args.command == "restore":
+            snapshot = args.snapshot or next(iter(list_backups(backup_dir, source_path)), None)
+            if not snapshot:
+                raise BackupError(f"No snapshots found in {backup_dir}")
+            report = restore_database(snapshot, source_path, step=step, progress=print_progress)
+            print()
+            print(f"Restored {snapshot} into {report['path']}: {report['pages']} pages "
+                  f"in {report['copy_seconds']}s ({report['pages_per_second']} pages/s)")
+            print("Restart the server so in-process caches are reloaded.")
+    except BackupError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,675 @@
+# benchmark.py
+"""
+Micro-benchmarks for hot server paths.
+
+Each subcommand builds its own dataset in a scratch database (in-memory SQLite
+by default), checks results against a straightforward reference
+implementation, and prints timings plus SQL statements per call.
+
+Usage:
+    python benchmark.py permissions
+    python benchmark.py closure --depths 10,100,500
+    python benchmark.py group-delete --grants 10000
+    python benchmark.py acl-index --grants 1000000
+    python benchmark.py compression --entries 100,1000,10000
+    python benchmark.py import-time --budget-ms 1200
+    python benchmark.py permissions --repeat 500 --database-uri sqlite:////tmp/bench.db
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from sqlalchemy import event, insert
+from app import create_app
+from models import db, User, UserPassword, Group, GroupMembership, GroupNesting, GroupClosure, PasswordAccess, PermissionEnum
+from permission_storage import get_user_permission
+import group_closure
+from groups import delete_group
+from get_passwords import shared_passwords_from_db
+from acl_index import AclIndex
+import compression
+
+PERMISSION_ORDER = {PermissionEnum.READ: 1, PermissionEnum.WRITE: 2, PermissionEnum.DELETE: 3}
+PERMISSIONS = list(PERMISSION_ORDER)
+
+
+def make_app(database_uri):
+    # 不載入路由與背景工作，審計庫也改用暫存資料庫
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SQLALCHEMY_BINDS': {'audit': 'sqlite://'},
+    }, components=())
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def timed(app, fn, repeat):
+    """每次呼叫都在新的 app context 中執行，模擬一個請求"""
+    samples = []
+    for _ in range(repeat):
+        with app.app_context():
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p95_us": samples[int(len(samples) * 0.95)] * 1e6,
+    }
+
+
+def bulk_insert(model, rows):
+    if rows:
+        db.session.execute(insert(model.__table__), rows)
+
+
+# --- permissions ---
+
+def reference_permission(user_id, owner_id, grants, memberships):
+    """
+    get_user_permission 的參考實作（純 Python，不做任何最佳化）
+
+    grants: [(user_id, group_id, PermissionEnum)] for one password
+    memberships: {group_id: {user_id: PermissionEnum}}
+    """
+    if user_id == owner_id:
+        return PermissionEnum.DELETE
+
+    candidates = []
+    for grant_user_id, grant_group_id, permission in grants:
+        if grant_group_id is None and grant_user_id == user_id:
+            candidates.append(permission)
+        elif grant_user_id is None and user_id in memberships.get(grant_group_id, {}):
+            member_permission = memberships[grant_group_id][user_id]
+            candidates.append(min(permission, member_permission, key=PERMISSION_ORDER.get))
+    if not candidates:
+        return None
+    return max(candidates, key=PERMISSION_ORDER.get)
+
+
+def build_permission_scenario(rng, n_groups, n_grants, n_users=1200, n_other_groups=60):
+    """
+    user 1 是被測用戶（加入 n_groups 個群組），user 2 擁有被測密碼，
+    其他用戶與群組作為授權的干擾項
+    """
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+
+    bulk_insert(User, [
+        {"id": uid, "email": f"bench{uid}@example.com", "password_hash": "x", "login_count": 0}
+        for uid in range(1, n_users + 1)
+    ])
+    total_groups = n_groups + n_other_groups
+    bulk_insert(Group, [
+        {"id": gid, "name": f"bench-group-{gid}", "manager_id": 2}
+        for gid in range(1, total_groups + 1)
+    ])
+    bulk_insert(GroupClosure, [
+        {"ancestor_id": gid, "descendant_id": gid, "permission": PermissionEnum.DELETE}
+        for gid in range(1, total_groups + 1)
+    ])
+
+    memberships = {}
+    membership_rows = []
+    for gid in range(1, total_groups + 1):
+        # 前 n_groups 個群組包含被測用戶，每個群組另有幾位其他成員
+        members = set(rng.sample(range(3, n_users + 1), 5))
+        if gid <= n_groups:
+            members.add(1)
+        memberships[gid] = {}
+        for uid in members:
+            permission = rng.choice(PERMISSIONS)
+            memberships[gid][uid] = permission
+            membership_rows.append({"user_id": uid, "group_id": gid, "permission": permission})
+    bulk_insert(GroupMembership, membership_rows)
+
+    bulk_insert(UserPassword, [{"id": 1, "user_id": 2, "site": "bench", "encrypted_data": "x", "iv": "x"}])
+
+    # 一半直接授權、一半群組授權；被測用戶的群組與直接授權都有機會被抽中
+    grants = []
+    direct_targets = rng.sample(range(1, n_users + 1), min(n_users, n_grants // 2 + 1))
+    group_targets = rng.sample(range(1, total_groups + 1), min(total_groups, n_grants - n_grants // 2))
+    for uid in direct_targets[:n_grants // 2]:
+        if uid != 2:
+            grants.append((uid, None, rng.choice(PERMISSIONS)))
+    for gid in group_targets:
+        grants.append((None, gid, rng.choice(PERMISSIONS)))
+    # 群組數量有限時，用更多直接授權補足數量
+    extra = [uid for uid in range(3, n_users + 1) if uid not in {g[0] for g in grants}]
+    while len(grants) < n_grants and extra:
+        grants.append((extra.pop(), None, rng.choice(PERMISSIONS)))
+
+    bulk_insert(PasswordAccess, [
+        {"user_id": uid, "group_id": gid, "password_id": 1, "permission": permission}
+        for uid, gid, permission in grants
+    ])
+    db.session.commit()
+    return grants, memberships
+
+
+def cmd_permissions(args):
+    app = make_app(args.database_uri)
+    rng = random.Random(args.seed)
+    print(f"{'groups':>6} {'grants':>6} {'result':>7} {'stmts':>5} {'mean_us':>9} {'p50_us':>9} {'p95_us':>9}")
+
+    failures = 0
+    for n_groups in (0, 10, 100):
+        for n_grants in (0, 10, 1000):
+            with app.app_context():
+                grants, memberships = build_permission_scenario(rng, n_groups, n_grants)
+
+                # 與參考實作比對：被測用戶、擁有者與一批其他用戶
+                for uid in [1, 2] + rng.sample(range(3, 1201), 50):
+                    with app.app_context():
+                        actual = get_user_permission(uid, 1)
+                    expected = reference_permission(uid, 2, grants, memberships)
+                    if actual != expected:
+                        failures += 1
+                        print(f"  MISMATCH user={uid} groups={n_groups} grants={n_grants}: "
+                              f"got {actual}, expected {expected}")
+
+                with app.app_context():
+                    with count_statements(db.engine) as statements:
+                        result = get_user_permission(1, 1)
+
+                stats = timed(app, lambda: get_user_permission(1, 1), args.repeat)
+                print(f"{n_groups:>6} {n_grants:>6} {result.value if result else '-':>7} {len(statements):>5} "
+                      f"{stats['mean_us']:>9.1f} {stats['p50_us']:>9.1f} {stats['p95_us']:>9.1f}")
+
+    if failures:
+        raise SystemExit(f"{failures} permission mismatches against the reference implementation")
+    print("All results match the reference implementation.")
+
+
+# --- closure ---
+
+def reference_nested_permission(source_id, target_id, edges):
+    """從 source 到 target 所有路徑中，路徑上最弱權限的最大值（窮舉 DAG 路徑）"""
+    children = {}
+    for parent_id, child_id, permission in edges:
+        children.setdefault(parent_id, []).append((child_id, permission))
+
+    memo = {}
+    def best(node):
+        if node == target_id:
+            return PermissionEnum.DELETE
+        if node not in memo:
+            candidates = []
+            for child_id, permission in children.get(node, ()):
+                below = best(child_id)
+                if below is not None:
+                    candidates.append(min(permission, below, key=PERMISSION_ORDER.get))
+            memo[node] = max(candidates, key=PERMISSION_ORDER.get) if candidates else None
+        return memo[node]
+    return best(source_id)
+
+
+def build_groups(n_groups):
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    bulk_insert(User, [
+        {"id": uid, "email": f"bench{uid}@example.com", "password_hash": "x", "login_count": 0}
+        for uid in (1, 2)
+    ])
+    bulk_insert(Group, [
+        {"id": gid, "name": f"bench-group-{gid}", "manager_id": 2}
+        for gid in range(1, n_groups + 1)
+    ])
+    for gid in range(1, n_groups + 1):
+        group_closure.add_group(gid)
+    db.session.commit()
+
+
+def check_closure(edges, n_groups, rng, samples=300):
+    mismatches = 0
+    closure = {(a, d): p for a, d, p in db.session.query(
+        GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission)}
+    for _ in range(samples):
+        a, d = rng.randint(1, n_groups), rng.randint(1, n_groups)
+        if closure.get((a, d)) != reference_nested_permission(a, d, edges):
+            mismatches += 1
+    return mismatches
+
+
+def cmd_closure(args):
+    app = make_app(args.database_uri)
+    rng = random.Random(args.seed)
+    failures = 0
+
+    print("chain: user in the deepest group, DELETE grant on the root group, one WRITE link midway")
+    print(f"{'depth':>6} {'rows':>8} {'build_ms':>9} {'stmts':>5} {'mean_us':>9} {'p95_us':>9} {'result':>7}")
+    for depth in [int(d) for d in args.depths.split(",")]:
+        with app.app_context():
+            build_groups(depth)
+            edges = []
+            start = time.perf_counter()
+            for gid in range(1, depth):
+                permission = PermissionEnum.WRITE if gid == depth // 2 else PermissionEnum.DELETE
+                group_closure.add_nesting(gid, gid + 1, permission)
+                edges.append((gid, gid + 1, permission))
+            db.session.commit()
+            build_ms = (time.perf_counter() - start) * 1000
+
+            bulk_insert(UserPassword, [{"id": 1, "user_id": 2, "site": "bench", "encrypted_data": "x", "iv": "x"}])
+            bulk_insert(GroupMembership, [{"user_id": 1, "group_id": depth, "permission": PermissionEnum.DELETE}])
+            bulk_insert(PasswordAccess, [{"user_id": None, "group_id": 1, "password_id": 1, "permission": PermissionEnum.DELETE}])
+            db.session.commit()
+            rows = db.session.query(GroupClosure).count()
+
+            expected = reference_nested_permission(1, depth, edges)
+            with app.app_context():
+                with count_statements(db.engine) as statements:
+                    result = get_user_permission(1, 1)
+            if result != expected:
+                failures += 1
+                print(f"  MISMATCH depth={depth}: got {result}, expected {expected}")
+
+            stats = timed(app, lambda: get_user_permission(1, 1), args.repeat)
+            print(f"{depth:>6} {rows:>8} {build_ms:>9.1f} {len(statements):>5} "
+                  f"{stats['mean_us']:>9.1f} {stats['p95_us']:>9.1f} {result.value if result else '-':>7}")
+
+    print("\nlattice: random DAG, incremental add/remove checked against path enumeration and full rebuild")
+    print(f"{'layers':>6} {'width':>6} {'edges':>6} {'add_ms':>8} {'remove_ms':>9} {'mismatches':>10}")
+    for layers, width in [(10, 10), (20, 10), (30, 10)]:
+        with app.app_context():
+            n_groups = layers * width
+            build_groups(n_groups)
+            edges = []
+            for layer in range(layers - 1):
+                for i in range(width):
+                    parent_id = layer * width + i + 1
+                    for child_index in rng.sample(range(width), 2):
+                        edges.append((parent_id, (layer + 1) * width + child_index + 1, rng.choice(PERMISSIONS)))
+            rng.shuffle(edges)
+
+            start = time.perf_counter()
+            for parent_id, child_id, permission in edges:
+                group_closure.add_nesting(parent_id, child_id, permission)
+            db.session.commit()
+            add_ms = (time.perf_counter() - start) * 1000
+            mismatches = check_closure(edges, n_groups, rng)
+
+            removed = edges[:len(edges) // 10]
+            edges = edges[len(edges) // 10:]
+            start = time.perf_counter()
+            for parent_id, child_id, _ in removed:
+                group_closure.remove_nesting(parent_id, child_id)
+            db.session.commit()
+            remove_ms = (time.perf_counter() - start) * 1000
+            mismatches += check_closure(edges, n_groups, rng)
+
+            # 增量維護的結果必須與全量重建相同
+            incremental = set(db.session.query(
+                GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission))
+            group_closure.rebuild_closure()
+            db.session.commit()
+            rebuilt = set(db.session.query(
+                GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission))
+            mismatches += len(incremental ^ rebuilt)
+
+            failures += mismatches
+            print(f"{layers:>6} {width:>6} {len(edges) + len(removed):>6} {add_ms:>8.1f} {remove_ms:>9.1f} {mismatches:>10}")
+
+    if failures:
+        raise SystemExit(f"{failures} closure mismatches against the reference implementation")
+    print("All results match the reference implementation.")
+
+
+# --- group-delete ---
+
+def cmd_group_delete(args):
+    app = make_app(args.database_uri)
+    failures = 0
+    print(f"{'grants':>7} {'members':>7} {'stmts':>5} {'ms':>8}")
+
+    for n_grants in sorted({100, args.grants}):
+        with app.app_context():
+            build_groups(3)
+            # group 2 is nested between 1 and 3, so deleting it also re-derives closure paths
+            group_closure.add_nesting(1, 2, PermissionEnum.WRITE)
+            group_closure.add_nesting(2, 3, PermissionEnum.READ)
+            n_members = min(500, n_grants)
+            bulk_insert(User, [
+                {"id": uid, "email": f"bench{uid}@example.com", "password_hash": "x", "login_count": 0}
+                for uid in range(3, n_members + 3)
+            ])
+            bulk_insert(GroupMembership, [
+                {"user_id": uid, "group_id": 2, "permission": PermissionEnum.READ}
+                for uid in range(3, n_members + 3)
+            ])
+            bulk_insert(UserPassword, [
+                {"id": pid, "user_id": 2, "site": "bench", "encrypted_data": "x", "iv": "x"}
+                for pid in range(1, n_grants + 1)
+            ])
+            bulk_insert(PasswordAccess, [
+                {"user_id": None, "group_id": 2, "password_id": pid, "permission": PermissionEnum.READ}
+                for pid in range(1, n_grants + 1)
+            ])
+            db.session.commit()
+
+            with app.app_context():
+                with count_statements(db.engine) as statements:
+                    start = time.perf_counter()
+                    delete_group(2)
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+
+            leftovers = (
+                PasswordAccess.query.filter_by(group_id=2).count()
+                + GroupMembership.query.filter_by(group_id=2).count()
+                + GroupNesting.query.filter((GroupNesting.parent_group_id == 2) | (GroupNesting.child_group_id == 2)).count()
+                + GroupClosure.query.filter((GroupClosure.ancestor_id == 2) | (GroupClosure.descendant_id == 2)).count()
+                + GroupClosure.query.filter_by(ancestor_id=1, descendant_id=3).count()
+                + Group.query.filter_by(id=2).count()
+            )
+            print(f"{n_grants:>7} {n_members:>7} {len(statements):>5} {elapsed_ms:>8.1f}")
+            if leftovers:
+                failures += 1
+                print(f"  {leftovers} rows still reference the deleted group")
+            if len(statements) > args.max_statements:
+                failures += 1
+                print(f"  {len(statements)} statements exceeds the bound of {args.max_statements}")
+            if elapsed_ms > args.max_ms:
+                failures += 1
+                print(f"  {elapsed_ms:.1f} ms exceeds the bound of {args.max_ms} ms")
+
+    if failures:
+        raise SystemExit(f"{failures} group deletion checks failed")
+    print("Group deletion stayed within the statement and latency bounds.")
+
+
+# --- acl-index ---
+
+def build_acl_scenario(rng, n_grants, n_users, n_groups):
+    """
+    Entries owned by random users, mostly direct grants plus group grants;
+    groups 2..11 form a nesting chain and group 1 ("everyone") sees a quarter
+    of all entries, so it is stored packed.
+    """
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    n_entries = max(n_grants // 4, 1)
+
+    bulk_insert(User, [
+        {"id": uid, "email": f"bench{uid}@example.com", "password_hash": "x", "login_count": 0}
+        for uid in range(1, n_users + 1)
+    ])
+    bulk_insert(Group, [
+        {"id": gid, "name": f"bench-group-{gid}", "manager_id": 1}
+        for gid in range(1, n_groups + 1)
+    ])
+    bulk_insert(GroupClosure, [
+        {"ancestor_id": gid, "descendant_id": gid, "permission": PermissionEnum.DELETE}
+        for gid in range(1, n_groups + 1)
+    ])
+    for gid in range(3, min(n_groups, 11) + 1):
+        group_closure.add_nesting(gid - 1, gid, rng.choice(PERMISSIONS))
+
+    membership_rows = []
+    for uid in range(1, n_users + 1):
+        for gid in {1} | set(rng.sample(range(2, n_groups + 1), 3)):
+            membership_rows.append({"user_id": uid, "group_id": gid, "permission": rng.choice(PERMISSIONS)})
+    bulk_insert(GroupMembership, membership_rows)
+
+    for start in range(1, n_entries + 1, 50000):
+        bulk_insert(UserPassword, [
+            {"id": pid, "user_id": rng.randint(1, n_users), "site": "bench", "encrypted_data": "x", "iv": "x"}
+            for pid in range(start, min(start + 50000, n_entries + 1))
+        ])
+
+    seen = set()
+    rows = []
+    for pid in rng.sample(range(1, n_entries + 1), n_entries // 4):
+        seen.add((None, 1, pid))
+        rows.append({"user_id": None, "group_id": 1, "password_id": pid, "permission": rng.choice(PERMISSIONS)})
+    while len(seen) < n_grants:
+        pid = rng.randint(1, n_entries)
+        if rng.random() < 0.2:
+            key = (None, rng.randint(2, n_groups), pid)
+        else:
+            key = (rng.randint(1, n_users), None, pid)
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append({"user_id": key[0], "group_id": key[1], "password_id": pid, "permission": rng.choice(PERMISSIONS)})
+        if len(rows) % 50000 == 0:
+            bulk_insert(PasswordAccess, rows)
+            rows = []
+    bulk_insert(PasswordAccess, rows)
+    db.session.commit()
+    return n_entries
+
+
+def cmd_acl_index(args):
+    app = make_app(args.database_uri)
+    rng = random.Random(args.seed)
+    failures = 0
+
+    with app.app_context():
+        start = time.perf_counter()
+        n_entries = build_acl_scenario(rng, args.grants, args.users, args.groups)
+        print(f"dataset: {args.grants} grants, {n_entries} entries, {args.users} users, {args.groups} groups "
+              f"({time.perf_counter() - start:.1f}s to load)")
+
+        # 索引不註冊到 app.extensions，因此 get_user_permission 仍走 SQL，可直接比對兩者
+        index = AclIndex()
+        index.build()
+        usage = index.memory_usage()
+        print(f"build: {usage['build_seconds']}s, {usage['grants']} grants, {usage['packed_groups']} packed groups")
+        print(f"memory: grants {usage['grant_bytes'] / 2**20:.1f} MiB, owners {usage['owner_bytes'] / 2**20:.1f} MiB, "
+              f"memberships+closure {usage['membership_bytes'] / 2**20:.1f} MiB")
+        print(f"  {usage['bytes_per_million_grants'] / 2**20:.1f} MiB per million grants")
+
+    pairs = [(rng.randint(1, args.users), rng.randint(1, n_entries)) for _ in range(args.samples)]
+    for user_id, password_id in pairs:
+        with app.app_context():
+            expected = get_user_permission(user_id, password_id)
+            actual = index.permission(user_id, password_id)
+        if actual != expected:
+            failures += 1
+            print(f"  MISMATCH user={user_id} password={password_id}: index {actual}, SQL {expected}")
+
+    for user_id in rng.sample(range(1, args.users + 1), min(args.users, 20)):
+        with app.app_context():
+            expected = {p.id for p in shared_passwords_from_db(user_id)}
+            actual = index.shared_ids(user_id)
+        if actual != expected:
+            failures += 1
+            print(f"  MISMATCH visible entries of user={user_id}: {len(actual)} in index, {len(expected)} via SQL")
+
+    user_id, password_id = pairs[0]
+    print(f"{'path':>8} {'mean_us':>9} {'p50_us':>9} {'p95_us':>9}")
+    for name, fn in (
+        ("sql", lambda: get_user_permission(user_id, password_id)),
+        ("index", lambda: index.permission(user_id, password_id)),
+    ):
+        stats = timed(app, fn, args.repeat)
+        print(f"{name:>8} {stats['mean_us']:>9.1f} {stats['p50_us']:>9.1f} {stats['p95_us']:>9.1f}")
+
+    if failures:
+        raise SystemExit(f"{failures} ACL index results differ from SQL")
+    print("ACL index matches get_user_permission and the /passwords SQL path.")
+
+
+def vault_payload(rng, n_entries):
+    """A /passwords body: random AES-GCM ciphertext in base64, like real entries."""
+    entries = []
+    for i in range(1, n_entries + 1):
+        ciphertext = bytes(rng.getrandbits(8) for _ in range(rng.randint(80, 400)))
+        entries.append({
+            "id": i,
+            "site": f"site-{rng.randint(1, n_entries // 2 + 1)}.example.com",
+            "encrypted_data": base64.b64encode(ciphertext).decode(),
+            "iv": base64.b64encode(bytes(rng.getrandbits(8) for _ in range(12))).decode(),
+            "owner_id": rng.randint(1, 50),
+            "wrapped_key": None,
+            "key_group_id": None
+        })
+    return json.dumps(entries).encode()
+
+def decompress(data, encoding):
+    if encoding == "gzip":
+        import gzip
+        return gzip.decompress(data)
+    if encoding == "br":
+        return compression.brotli.decompress(data)
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+def cmd_compression(args):
+    rng = random.Random(args.seed)
+    levels = {
+        "gzip": [1, 6, 9],
+        "br": [1, 4, 9],
+        "zstd": [1, 3, 9],
+    }
+    encodings = compression.available_encodings()
+    missing = [e for e in levels if e not in encodings]
+    if missing:
+        print(f"not installed, skipped: {', '.join(missing)}")
+
+    print(f"{'entries':>8} {'raw_KiB':>8} {'enc':>5} {'level':>5} {'out_KiB':>8} {'saved':>6} "
+          f"{'ms':>8} {'MiB/s':>7} {'stream_ms':>9}")
+    for n_entries in (int(n) for n in args.entries.split(",")):
+        body = vault_payload(rng, n_entries)
+        pieces = [body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024)]
+        repeat = max(3, args.repeat // max(1, n_entries // 100))
+        for encoding in encodings:
+            for level in levels[encoding]:
+                out = compression.compress(body, encoding, level)
+                if decompress(out, encoding) != body:
+                    raise SystemExit(f"{encoding} level {level} did not round-trip")
+
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    compression.compress(body, encoding, level)
+                    samples.append(time.perf_counter() - start)
+                # 串流回應以 64 KiB 為單位逐塊壓縮
+                stream_samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    compressor = compression.make_compressor(encoding, level)
+                    for piece in pieces:
+                        compressor.compress(piece)
+                    compressor.finish()
+                    stream_samples.append(time.perf_counter() - start)
+
+                seconds = statistics.median(samples)
+                print(f"{n_entries:>8} {len(body) / 1024:>8.1f} {encoding:>5} {level:>5} {len(out) / 1024:>8.1f} "
+                      f"{1 - len(out) / len(body):>6.0%} {seconds * 1000:>8.2f} "
+                      f"{len(body) / seconds / 2**20:>7.0f} {statistics.median(stream_samples) * 1000:>9.2f}")
+
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_ms": (created - imported) * 1000}))
+"""
+IMPORT_BUDGET_MS = 1200
+
+def _probe_config(database_uri):
+    # 使用暫存資料庫，不碰 instance/ 下的資料庫
+    return json.dumps({'SQLALCHEMY_DATABASE_URI': database_uri, 'SQLALCHEMY_BINDS': {'audit': 'sqlite://'}})
+
+def probe_cold_start(database_uri="sqlite://"):
+    """Runs IMPORT_PROBE in a fresh interpreter; returns {"import_ms": ..., "create_ms": ...}."""
+    result = subprocess.run([sys.executable, "-c", IMPORT_PROBE, _probe_config(database_uri)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def cmd_import_time(args):
+    """Cold start: a fresh interpreter imports app and calls create_app(), as a new container would."""
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    runs = [probe_cold_start(args.database_uri) for _ in range(args.runs)]
+
+    # -X importtime 列出各模組的累計匯入時間，找出拖慢啟動的模組
+    profile = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_PROBE, _probe_config(args.database_uri)],
+                             cwd=server_dir, capture_output=True, text=True, check=True)
+    modules = []
+    for line in profile.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        modules.append((int(cumulative_us), int(self_us), name))
+    print(f"{'cumulative_ms':>14} {'self_ms':>8}  module")
+    for cumulative_us, self_us, name in sorted(modules, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    create_ms = statistics.median(r["create_ms"] for r in runs)
+    total_ms = statistics.median(r["import_ms"] + r["create_ms"] for r in runs)
+    print(f"median of {args.runs} runs: import {import_ms:.0f} ms, create_app {create_ms:.0f} ms, "
+          f"total {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if total_ms > args.budget_ms:
+        raise SystemExit(f"cold start {total_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--database-uri", default="sqlite://",
+                        help="scratch database; its tables are dropped and recreated")
+    common.add_argument("--repeat", type=int, default=200)
+    common.add_argument("--seed", type=int, default=1)
+
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot server paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("permissions", parents=[common],
+                          help="get_user_permission across group/grant counts")
+    closure = subparsers.add_parser("closure", parents=[common],
+                                    help="nested group closure maintenance and deep hierarchy lookups")
+    closure.add_argument("--depths", default="10,100,300")
+    group_delete = subparsers.add_parser("group-delete", parents=[common],
+                                         help="set-based deletion of a group with many grants")
+    group_delete.add_argument("--grants", type=int, default=10000)
+    group_delete.add_argument("--max-statements", type=int, default=15)
+    group_delete.add_argument("--max-ms", type=float, default=2000)
+    acl = subparsers.add_parser("acl-index", parents=[common],
+                                help="in-memory ACL index: memory per million grants, lookups vs SQL")
+    acl.add_argument("--grants", type=int, default=200000)
+    acl.add_argument("--users", type=int, default=5000)
+    acl.add_argument("--groups", type=int, default=200)
+    acl.add_argument("--samples", type=int, default=2000)
+    compress = subparsers.add_parser("compression", parents=[common],
+                                     help="response compression: CPU time vs bytes saved on /passwords bodies")
+    compress.add_argument("--entries", default="100,1000,10000")
+    import_time = subparsers.add_parser("import-time", parents=[common],
+                                        help="cold start: import app + create_app() against a time budget")
+    import_time.add_argument("--runs", type=int, default=5)
+    import_time.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    import_time.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    {
+        "permissions": cmd_permissions,
+        "closure": cmd_closure,
+        "group-delete": cmd_group_delete,
+        "acl-index": cmd_acl_index,
+        "compression": cmd_compression,
+        "import-time": cmd_import_time,
+    }[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
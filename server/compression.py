@@ -0,0 +1,151 @@
+# server/compression.py
+"""
+Negotiated response compression (gzip, brotli, zstd).
+
+The base64 ciphertext in /passwords, /permission/password/<id> and
+/groups/<id> compresses well, so large JSON responses are compressed with the
+best encoding the client accepts (Accept-Encoding q-values first, then
+COMPRESS_ALGORITHMS order). brotli and zstd are used only when their packages
+are installed; gzip is always available.
+
+Buffered responses smaller than COMPRESS_MIN_SIZE are sent as they are: the
+CPU and header overhead is not worth it. Streamed responses are compressed
+chunk by chunk as they are produced, so nothing is buffered. Only the
+COMPRESS_MIMETYPES are touched, which leaves event streams, already
+compressed vault exports, attachment downloads and range responses alone.
+"""
+
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # 可選套件：未安裝時不提供 br
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可選套件：未安裝時不提供 zstd
+    zstandard = None
+
+# 密文經 base64 後的可壓縮部分幾乎只靠熵編碼，高等級多花的 CPU 換不到明顯的節省
+# （python benchmark.py compression），因此預設用最快的等級
+DEFAULT_LEVELS = {'gzip': 1, 'br': 1, 'zstd': 1}
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31：gzip 格式
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def finish(self):
+        return self._obj.flush()
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def finish(self):
+        return self._obj.finish()
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def finish(self):
+        return self._obj.flush()
+
+COMPRESSORS = {'gzip': _GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = _BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _ZstdCompressor
+
+def available_encodings():
+    return list(COMPRESSORS)
+
+def make_compressor(encoding, level=None):
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+    return COMPRESSORS[encoding](level)
+
+def compress(data, encoding, level=None):
+    """One-shot compression of a bytes body."""
+    compressor = make_compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+def choose_encoding(accept_encodings, preferred):
+    """Picks the encoding with the highest q-value; ties go to the earlier entry of preferred."""
+    best, best_quality = None, 0
+    for encoding in preferred:
+        if encoding not in COMPRESSORS:
+            continue
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def _stream(iterable, compressor, charset='utf-8'):
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+def _compress_response(response):
+    config = current_app.config
+    if (request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']):
+        return response
+
+    # 是否壓縮取決於 Accept-Encoding，快取必須分開存
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings, config['COMPRESS_ALGORITHMS'])
+    if encoding is None:
+        return response
+    level = config['COMPRESS_LEVELS'].get(encoding)
+
+    if response.is_streamed:
+        # 串流回應無法事先得知大小，邊產生邊壓縮
+        if response.content_length is not None and response.content_length < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.response = _stream(response.response, make_compressor(encoding, level))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, level))
+
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag') and not response.headers['ETag'].startswith('W/'):
+        # 壓縮後位元組不同，強 ETag 改為弱 ETag
+        response.headers['ETag'] = 'W/' + response.headers['ETag']
+    return response
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ALGORITHMS', ['zstd', 'br', 'gzip'])
+    app.config.setdefault('COMPRESS_LEVELS', dict(DEFAULT_LEVELS))
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_MIMETYPES', ['application/json'])
+    if app.config.get('COMPRESS_ENABLED', True):
+        app.after_request(_compress_response)
@@ -0,0 +1,263 @@
+# server/envelope_keys.py
+"""
+Per-entry envelope keys.
+
+An entry can be encrypted with its own random data key instead of the
+owner's master key. The data key is stored wrapped (encrypted) for every
+recipient in wrapped_key: once for the owner, once per user it is shared
+with, and once per group. Sharing then uploads one small wrapped key instead
+of re-encrypting the entry.
+
+Each user publishes a key pair. The public key is stored in the clear and the
+private key is wrapped with the user's master key. A group has a key pair too:
+its private key is wrapped once per member in group_key_share, so an entry
+shared with a group is wrapped once, with the group's public key.
+
+The server never sees an unwrapped key. Entries without wrapped keys are
+still encrypted with the key derived from data_salt.
+"""
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import or_, select
+from models import (
+    db, Group, GroupMembership, GroupClosure, PasswordAccess,
+    UserKey, GroupKey, GroupKeyShare, WrappedKey
+)
+from request_context import get_password_entry, get_group_memberships
+from limits import field_error, list_field_error
+
+keys_bp = Blueprint('keys', __name__)
+
+MAX_BULK_KEYS = 1000
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def wrapped_key_error(data):
+    """Returns a 400 response if data carries a wrapped_key that is not a non-empty string."""
+    wrapped_key = data.get('wrapped_key') if isinstance(data, dict) else None
+    if wrapped_key is None or (isinstance(wrapped_key, str) and wrapped_key):
+        return None
+    return jsonify({"msg": "wrapped_key must be a non-empty string"}), 400
+
+def set_wrapped_key(password_id, wrapped_key, user_id=None, group_id=None):
+    """Adds or replaces the wrapped data key for one target; the caller commits."""
+    # 唯一鍵含 NULL 欄位時資料庫不會判定衝突，因此先查詢再更新
+    existing = WrappedKey.query.filter_by(password_id=password_id, user_id=user_id, group_id=group_id).first()
+    if existing:
+        existing.wrapped_key = wrapped_key
+    else:
+        db.session.add(WrappedKey(password_id=password_id, user_id=user_id, group_id=group_id, wrapped_key=wrapped_key))
+
+def delete_wrapped_key(password_id, user_id=None, group_id=None):
+    WrappedKey.query.filter_by(
+        password_id=password_id, user_id=user_id, group_id=group_id
+    ).delete(synchronize_session=False)
+
+def wrapped_keys_for(user_id, password_ids=None):
+    """
+    {password_id: {"wrapped_key": ..., "group_id": ...}} for the keys user_id
+    can unwrap, in one query. A key wrapped for the user wins over a group
+    key. Group keys include groups the user reaches through nesting.
+    password_ids=None returns every such key, which is cheaper than a huge
+    IN list when listing the whole vault.
+    """
+    if password_ids is not None:
+        password_ids = list(password_ids)
+        if not password_ids:
+            return {}
+    conditions = [WrappedKey.user_id == user_id]
+    group_ids = list(get_group_memberships(user_id))
+    if group_ids:
+        conditions.append(WrappedKey.group_id.in_(
+            select(GroupClosure.ancestor_id).where(GroupClosure.descendant_id.in_(group_ids))
+        ))
+
+    query = db.session.query(
+        WrappedKey.password_id, WrappedKey.user_id, WrappedKey.group_id, WrappedKey.wrapped_key
+    ).filter(or_(*conditions))
+    if password_ids is not None:
+        query = query.filter(WrappedKey.password_id.in_(password_ids))
+
+    result = {}
+    for password_id, target_user_id, group_id, wrapped_key in query:
+        if target_user_id is not None or password_id not in result:
+            result[password_id] = {"wrapped_key": wrapped_key, "group_id": group_id}
+    return result
+
+# PUT /keys/me - Publish the caller's key pair
+# Body: {"public_key": "...", "encrypted_private_key": "..."}
+@keys_bp.route('/keys/me', methods=['PUT'])
+@jwt_required()
+def set_user_key():
+    current_user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    public_key = data.get('public_key')
+    encrypted_private_key = data.get('encrypted_private_key')
+    if not public_key or not encrypted_private_key:
+        return jsonify({"msg": "public_key and encrypted_private_key are required"}), 400
+    error = field_error(data)
+    if error:
+        return error
+
+    user_key = db.session.get(UserKey, current_user_id)
+    if user_key:
+        user_key.public_key = public_key
+        user_key.encrypted_private_key = encrypted_private_key
+    else:
+        db.session.add(UserKey(
+            user_id=current_user_id, public_key=public_key, encrypted_private_key=encrypted_private_key
+        ))
+    db.session.commit()
+    return jsonify({"msg": "Key pair saved"}), 200
+
+# GET /keys/me
+@keys_bp.route('/keys/me', methods=['GET'])
+@jwt_required()
+def get_own_key():
+    user_key = db.session.get(UserKey, int(get_jwt_identity()))
+    if not user_key:
+        return jsonify({"msg": "No key pair published"}), 404
+    return jsonify({
+        "public_key": user_key.public_key,
+        "encrypted_private_key": user_key.encrypted_private_key
+    }), 200
+
+# GET /keys/users/<user_id> - Public key used to wrap data keys for a user
+@keys_bp.route('/keys/users/<int:user_id>', methods=['GET'])
+@jwt_required()
+def get_user_public_key(user_id):
+    user_key = db.session.get(UserKey, user_id)
+    if not user_key:
+        return jsonify({"msg": "User has no public key"}), 404
+    return jsonify({"user_id": user_id, "public_key": user_key.public_key}), 200
+
+# PUT /keys/groups/<group_id> - Set the group's public key and member shares (manager only)
+# Body: {"public_key": "...", "shares": [{"user_id": 2, "wrapped_private_key": "..."}]}
+@keys_bp.route('/keys/groups/<int:group_id>', methods=['PUT'])
+@jwt_required()
+def set_group_key(group_id):
+    current_user_id = int(get_jwt_identity())
+    group = db.session.get(Group, group_id)
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    data = request.get_json(silent=True) or {}
+    public_key = data.get('public_key')
+    shares = data.get('shares', [])
+    if not public_key or not isinstance(shares, list):
+        return jsonify({"msg": "public_key and a list of shares are required"}), 400
+    if len(shares) > MAX_BULK_KEYS:
+        return jsonify({"msg": f"At most {MAX_BULK_KEYS} shares per request"}), 400
+    error = field_error(data) or list_field_error(shares)
+    if error:
+        return error
+
+    group_key = db.session.get(GroupKey, group_id)
+    if group_key and group_key.public_key != public_key:
+        # 換掉群組金鑰會讓既有的包裝金鑰失效，必須由各條目擁有者重新包裝
+        return jsonify({"msg": "Group key is already set"}), 409
+
+    rows = {}
+    for share in shares:
+        if not isinstance(share, dict) or not share.get('user_id') or not share.get('wrapped_private_key'):
+            return jsonify({"msg": "Each share needs user_id and wrapped_private_key"}), 400
+        user_id = share['user_id']
+        if not _is_id(user_id) or not isinstance(share['wrapped_private_key'], str):
+            return jsonify({"msg": "user_id must be an integer and wrapped_private_key a string"}), 400
+        rows[user_id] = share['wrapped_private_key']
+
+    # 巢狀子群組的成員也能取得上層群組的私鑰
+    allowed = {uid for (uid,) in db.session.query(GroupMembership.user_id).filter(
+        GroupMembership.group_id.in_(select(GroupClosure.descendant_id).where(GroupClosure.ancestor_id == group_id)),
+        GroupMembership.user_id.in_(list(rows))
+    )} | {group.manager_id}
+    rejected = sorted(set(rows) - allowed)
+    if rejected:
+        return jsonify({"msg": "Shares can only be given to group members", "user_ids": rejected}), 400
+
+    if not group_key:
+        db.session.add(GroupKey(group_id=group_id, public_key=public_key))
+    if rows:
+        GroupKeyShare.query.filter(
+            GroupKeyShare.group_id == group_id,
+            GroupKeyShare.user_id.in_(list(rows))
+        ).delete(synchronize_session=False)
+        db.session.execute(GroupKeyShare.__table__.insert(), [
+            {"group_id": group_id, "user_id": uid, "wrapped_private_key": wrapped} for uid, wrapped in rows.items()
+        ])
+    db.session.commit()
+    return jsonify({"msg": "Group key saved", "shares": len(rows)}), 200
+
+# GET /keys/groups/<group_id> - Group public key, plus the caller's wrapped private key if any
+@keys_bp.route('/keys/groups/<int:group_id>', methods=['GET'])
+@jwt_required()
+def get_group_key(group_id):
+    current_user_id = int(get_jwt_identity())
+    group_key = db.session.get(GroupKey, group_id)
+    if not group_key:
+        return jsonify({"msg": "Group has no key"}), 404
+    share = db.session.get(GroupKeyShare, (group_id, current_user_id))
+    return jsonify({
+        "group_id": group_id,
+        "public_key": group_key.public_key,
+        "wrapped_private_key": share.wrapped_private_key if share else None
+    }), 200
+
+# GET /storage/<password_id>/keys - All wrapped keys of an entry (owner only)
+@keys_bp.route('/storage/<int:password_id>/keys', methods=['GET'])
+@jwt_required()
+def get_entry_keys(password_id):
+    current_user_id = int(get_jwt_identity())
+    password = get_password_entry(password_id)
+    if not password or password.user_id != current_user_id:
+        return jsonify({"msg": "You do not own this password or it does not exist"}), 403
+
+    keys = WrappedKey.query.filter_by(password_id=password_id).order_by(WrappedKey.id).all()
+    return jsonify([
+        {"user_id": k.user_id, "group_id": k.group_id, "wrapped_key": k.wrapped_key} for k in keys
+    ]), 200
+
+# PUT /storage/<password_id>/keys - Add or replace wrapped keys (owner only)
+# Body: {"keys": [{"user_id": 2, "wrapped_key": "..."}, {"group_id": 3, "wrapped_key": "..."}]}
+# Targets must be the owner or already hold a grant for the entry.
+@keys_bp.route('/storage/<int:password_id>/keys', methods=['PUT'])
+@jwt_required()
+def set_entry_keys(password_id):
+    current_user_id = int(get_jwt_identity())
+    password = get_password_entry(password_id)
+    if not password or password.user_id != current_user_id:
+        return jsonify({"msg": "You do not own this password or it does not exist"}), 403
+
+    data = request.get_json(silent=True)
+    keys = data.get('keys') if isinstance(data, dict) else data
+    if not isinstance(keys, list):
+        return jsonify({"msg": "A list of keys is required"}), 400
+    if len(keys) > MAX_BULK_KEYS:
+        return jsonify({"msg": f"At most {MAX_BULK_KEYS} keys per request"}), 400
+    error = list_field_error(keys)
+    if error:
+        return error
+
+    grants = {
+        (user_id, group_id) for user_id, group_id in db.session.query(
+            PasswordAccess.user_id, PasswordAccess.group_id
+        ).filter(PasswordAccess.password_id == password_id, PasswordAccess.active())
+    }
+    grants.add((current_user_id, None))
+
+    for key in keys:
+        if not isinstance(key, dict) or not key.get('wrapped_key') or bool(key.get('user_id')) == bool(key.get('group_id')):
+            return jsonify({"msg": "Each key needs wrapped_key and exactly one of user_id or group_id"}), 400
+        target = (key.get('user_id') or None, key.get('group_id') or None)
+        if not _is_id(target[0] or target[1]) or not isinstance(key['wrapped_key'], str):
+            return jsonify({"msg": "user_id/group_id must be an integer and wrapped_key a string"}), 400
+        if target not in grants:
+            return jsonify({"msg": "Target has no access to this password", "target": key}), 400
+        set_wrapped_key(password_id, key['wrapped_key'], user_id=target[0], group_id=target[1])
+
+    db.session.commit()
+    return jsonify({"msg": f"{len(keys)} wrapped keys saved"}), 200
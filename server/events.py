@@ -0,0 +1,291 @@
+# server/events.py
+"""
+Server-Sent Events change notifications.
+
+Write paths call notify() after they commit. It names an event type and the
+users who should hear about it; audience helpers below compute those users.
+The broker hands each message to the subscriptions of those users, one per
+open GET /events stream.
+
+Backends:
+- 'local' (default) delivers inside the process. This is enough for one worker.
+- 'redis://...' publishes through Redis pub/sub, so every worker process
+  delivers the events to its own streams. It needs the optional redis package
+  (requirements-optional.txt). If the connection drops, the listener
+  reconnects with backoff and sends resync to local streams, because events
+  published meanwhile were missed.
+
+Each open stream waits on a queue, so it costs whatever the server's worker
+model charges for an idle request. Under gevent (gunicorn -k gevent, also in
+requirements-optional.txt) that is a greenlet, not a thread, and thousands of
+idle streams are cheap.
+
+A stream outlives the request that authenticated it. It is closed with
+token-expired when the access token expires, and the blocklist is checked
+again every heartbeat, so a /logout also ends the stream.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from flask import Blueprint, Response, current_app, jsonify
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from sqlalchemy import select, union
+from models import db, Group, GroupClosure, GroupMembership, PasswordAccess, UserPassword
+from token_blocklist import is_token_revoked
+
+try:
+    import redis
+except ImportError:  # 可選套件：只有多個 worker 時才需要
+    redis = None
+
+events_bp = Blueprint('events', __name__)
+
+ENTRY_CHANGED = 'entry-changed'
+GRANT_ADDED = 'grant-added'
+GRANT_CHANGED = 'grant-changed'
+GRANT_REVOKED = 'grant-revoked'
+MEMBERSHIP_CHANGED = 'membership-changed'
+RESYNC = 'resync'
+TOKEN_EXPIRED = 'token-expired'
+
+REDIS_RECONNECT_MAX_DELAY = 30  # 秒
+
+_event_ids = itertools.count(1)
+
+class Subscription:
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # 用戶端讀取太慢：停止排隊，讓串流送出 resync 後關閉，由用戶端重新載入
+            self.overflowed = True
+
+class LocalBackend:
+    """Delivers messages in-process."""
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, message):
+        self.deliver(message)
+
+class RedisBackend:
+    """Publishes through a Redis channel; every process delivers to its own subscribers."""
+
+    def __init__(self, url, channel='lanbitou-events', logger=None):
+        if redis is None:
+            raise RuntimeError("The redis events backend requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.logger = logger or logging.getLogger(__name__)
+
+    def start(self, deliver):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        threading.Thread(target=self._listen, args=(pubsub, deliver), name='events-redis', daemon=True).start()
+
+    def _listen(self, pubsub, deliver):
+        delay = 1
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                    self.logger.info("Reconnected to the Redis events channel")
+                    # 斷線期間的事件已遺失，讓本行程的串流重新載入
+                    deliver({"type": RESYNC, "user_ids": None, "data": {}})
+                    delay = 1
+                for item in pubsub.listen():
+                    deliver(json.loads(item['data']))
+            except Exception as e:
+                self.logger.error("Redis events listener failed: %s; reconnecting in %ds", e, delay)
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+                pubsub = None
+            time.sleep(delay)
+            delay = min(delay * 2, REDIS_RECONNECT_MAX_DELAY)
+
+    def publish(self, message):
+        try:
+            self.client.publish(self.channel, json.dumps(message))
+        except Exception as e:
+            # 通知在 commit 之後送出，Redis 無法使用時不讓已成功的請求失敗
+            self.logger.error("Failed to publish event to Redis: %s", e)
+
+class EventBroker:
+    def __init__(self, backend, max_queue=100):
+        self.backend = backend
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        backend.start(self._deliver)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.max_queue)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, event_type, user_ids, data):
+        if user_ids:
+            self.backend.publish({"type": event_type, "user_ids": sorted(user_ids), "data": data})
+
+    def _deliver(self, message):
+        with self._lock:
+            if message["user_ids"] is None:  # 送給本行程的所有串流
+                targets = [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+            else:
+                targets = [s for uid in message["user_ids"] for s in self._subscriptions.get(uid, ())]
+        for subscription in targets:
+            subscription.deliver(message)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+def create_backend(spec, logger=None):
+    if not spec or spec == 'local':
+        return LocalBackend()
+    if spec.startswith(('redis://', 'rediss://')):
+        return RedisBackend(spec, logger=logger)
+    raise ValueError(f"Unknown events backend: {spec}")
+
+def init_app(app):
+    broker = EventBroker(create_backend(app.config.get('EVENTS_BACKEND'), app.logger),
+                         app.config.get('EVENTS_QUEUE_SIZE', 100))
+    app.extensions['events'] = broker
+    return broker
+
+def notify(event_type, recipients, **data):
+    """Publishes an event to the recipient user ids; a no-op when the broker is not initialized."""
+    broker = current_app.extensions.get('events')
+    if broker is not None:
+        broker.publish(event_type, {uid for uid in recipients if uid is not None}, data)
+
+# --- Audiences ---
+
+def group_audience(group_id):
+    """Manager and members of the group, including members of nested subgroups."""
+    members = select(GroupMembership.user_id).where(GroupMembership.group_id.in_(
+        select(GroupClosure.descendant_id).where(GroupClosure.ancestor_id == group_id)
+    ))
+    manager = select(Group.manager_id).where(Group.id == group_id)
+    return {uid for (uid,) in db.session.execute(union(members, manager))}
+
+def password_audience(password_id):
+    """Everyone who can see the entry: owner, direct grantees and members of granted groups."""
+    owner = select(UserPassword.user_id).where(UserPassword.id == password_id)
+    direct = select(PasswordAccess.user_id).where(
+        PasswordAccess.password_id == password_id,
+        PasswordAccess.user_id.is_not(None),
+        PasswordAccess.active()
+    )
+    via_groups = select(GroupMembership.user_id).join(
+        GroupClosure, GroupClosure.descendant_id == GroupMembership.group_id
+    ).join(
+        PasswordAccess, PasswordAccess.group_id == GroupClosure.ancestor_id
+    ).where(PasswordAccess.password_id == password_id, PasswordAccess.active())
+    return {uid for (uid,) in db.session.execute(union(owner, direct, via_groups))}
+
+def grant_audience(owner_id, user_id=None, group_id=None):
+    audience = {owner_id}
+    if user_id:
+        audience.add(user_id)
+    if group_id:
+        audience |= group_audience(group_id)
+    return audience
+
+# --- Stream ---
+
+def _format(event_type, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+def _token_valid(app, token):
+    if time.time() >= token["exp"]:
+        return False
+    with app.app_context():
+        return not is_token_revoked(None, token)
+
+def stream_events(broker, subscription, heartbeat, app=None, token=None):
+    """token (the decoded JWT) ends the stream once it expires or is revoked; checked at most every heartbeat."""
+    next_check = time.monotonic() + heartbeat
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            timeout = heartbeat
+            if token is not None:
+                remaining = token["exp"] - time.time()
+                if remaining <= 0:
+                    yield _format(TOKEN_EXPIRED, {})
+                    return
+                timeout = min(heartbeat, remaining)
+            try:
+                message = subscription.queue.get(timeout=timeout)
+            except queue.Empty:
+                message = None
+                if subscription.overflowed:
+                    yield _format(RESYNC, {})
+                    return
+
+            if token is not None and time.monotonic() >= next_check:
+                next_check = time.monotonic() + heartbeat
+                if not _token_valid(app, token):
+                    yield _format(TOKEN_EXPIRED, {})
+                    return
+
+            if message is None:
+                yield ": keepalive\n\n"  # 註解行：維持連線並偵測已斷線的用戶端
+                continue
+            yield _format(message["type"], message["data"], next(_event_ids))
+            if message["type"] == RESYNC:
+                return
+            if subscription.overflowed and subscription.queue.empty():
+                yield _format(RESYNC, {})
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+# GET /events - SSE stream of changes visible to the caller
+# EventSource cannot set headers, so the access token may also be passed as ?jwt=<token>
+@events_bp.route('/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def get_events():
+    broker = current_app.extensions.get('events')
+    if broker is None:
+        return jsonify({"msg": "Events are not enabled"}), 404
+
+    subscription = broker.subscribe(int(get_jwt_identity()))
+    # 不使用 stream_with_context：串流期間不需要請求上下文，讓資料庫連線在回應開始前就歸還
+    # 令牌檢查時才短暫建立 app context
+    return Response(
+        stream_events(broker, subscription, current_app.config.get('EVENTS_HEARTBEAT', 15),
+                      current_app._get_current_object(), dict(get_jwt())),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,47 +1,83 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, UserPassword, PasswordAccess, GroupMembership
+from models import db, UserPassword, PasswordAccess, GroupMembership, GroupClosure
+from request_context import get_group_memberships
+from audit import record as audit
+from envelope_keys import wrapped_keys_for
+import acl_index
 
 get_passwords_bp = Blueprint('get_passwords', __name__)
 
-@get_passwords_bp.route('/passwords', methods=['GET'])
-@jwt_required()
-def get_passwords():
-    user_id = int(get_jwt_identity())
-
-    # 1. 使用者自己建立的密碼
-    own_passwords = UserPassword.query.filter_by(user_id=user_id).all()
+SHARED_FETCH_CHUNK = 500
 
+def shared_passwords_from_db(user_id):
+    """Entries shared with user_id directly or through (nested) groups, via SQL."""
     # 2. 透過 PasswordAccess 授權的密碼（直接授權）
     direct_access_passwords = UserPassword.query.join(PasswordAccess).filter(
         PasswordAccess.user_id == user_id,
-        PasswordAccess.group_id == None
+        PasswordAccess.group_id == None,
+        PasswordAccess.active(),
+        UserPassword.deleted_at == None
     ).all()
 
-    # 3. 透過群組授權
-    group_ids = db.session.query(GroupMembership.group_id).filter_by(user_id=user_id).all()
-    group_ids = [gid[0] for gid in group_ids]
+    # 3. 透過群組授權（包含巢狀群組：授權給任何上層群組皆可見）
+    group_ids = list(get_group_memberships(user_id))
 
     group_access_passwords = []
     if group_ids:
+        granting_groups = db.session.query(GroupClosure.ancestor_id).filter(
+            GroupClosure.descendant_id.in_(group_ids)
+        )
         group_access_passwords = UserPassword.query.join(PasswordAccess).filter(
-            PasswordAccess.group_id.in_(group_ids),
-            PasswordAccess.user_id == None
+            PasswordAccess.group_id.in_(granting_groups),
+            PasswordAccess.user_id == None,
+            PasswordAccess.active(),
+            UserPassword.deleted_at == None
         ).all()
+    return direct_access_passwords + group_access_passwords
+
+@get_passwords_bp.route('/passwords', methods=['GET'])
+@jwt_required()
+def get_passwords():
+    user_id = int(get_jwt_identity())
+
+    # 1. 使用者自己建立的密碼
+    own_passwords = UserPassword.query.filter_by(user_id=user_id, deleted_at=None).all()
+
+    shared_ids = acl_index.shared_ids(user_id)
+    if shared_ids is not acl_index.MISS:
+        # 2-3. ACL 索引已算出可見的條目 id，只需分批取回資料列
+        shared_ids = sorted(shared_ids)
+        shared_passwords = []
+        for i in range(0, len(shared_ids), SHARED_FETCH_CHUNK):
+            shared_passwords += UserPassword.query.filter(
+                UserPassword.id.in_(shared_ids[i:i + SHARED_FETCH_CHUNK]),
+                UserPassword.deleted_at == None
+            ).all()
+    else:
+        shared_passwords = shared_passwords_from_db(user_id)
 
     # 4. 合併並去除重複
     seen = {}
-    for p in own_passwords + direct_access_passwords + group_access_passwords:
+    for p in own_passwords + shared_passwords:
         seen[p.id] = p
 
-    # 5. 序列化
+    # 5. 使用信封加密的條目：一次查詢取得可解開的包裝金鑰
+    keys = wrapped_keys_for(user_id)
+
+    # 6. 序列化
     def serialize(p):
+        key = keys.get(p.id, {})
         return {
             "id": p.id,
             "site": p.site,
             "encrypted_data": p.encrypted_data,
             "iv": p.iv,
-            "owner_id": p.user_id
+            "owner_id": p.user_id,
+            "wrapped_key": key.get("wrapped_key"),
+            "key_group_id": key.get("group_id")
         }
 
+    # 列表回傳所有密文，只記錄一筆事件（含數量），不逐條記錄
+    audit('entry.list', user_id=user_id, count=len(seen))
     return jsonify([serialize(p) for p in seen.values()])
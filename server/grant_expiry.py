@@ -0,0 +1,78 @@
+# server/grant_expiry.py
+"""
+Time-limited grants.
+
+A grant with expires_at stops counting the moment it expires: every
+permission query adds PasswordAccess.active(), a predicate on the indexed
+expires_at column, and the in-memory ACL index keeps the few expiring grants
+in a side table. Expired rows are never scanned on the request path.
+
+A background sweeper (GRANT_SWEEP_INTERVAL) then deletes expired grants
+GRANT_SWEEP_BATCH rows per transaction, together with their wrapped keys, and
+for each one updates the ACL index, writes a grant.expire audit event and
+sends grant-revoked to the owner and the former grantee.
+"""
+
+import time
+from datetime import datetime
+from sqlalchemy import delete, select
+from models import db, PasswordAccess, UserPassword
+from envelope_keys import delete_wrapped_key
+from audit import record as audit
+from jobs import PeriodicJob
+import acl_index
+import events
+
+def sweep_expired(batch_size, pause=0.0, max_batches=None):
+    """Deletes expired grants batch by batch; returns how many were deleted."""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        now = datetime.utcnow()
+        rows = db.session.execute(
+            select(PasswordAccess.id, PasswordAccess.password_id, PasswordAccess.user_id,
+                   PasswordAccess.group_id, UserPassword.user_id)
+            .join(UserPassword, UserPassword.id == PasswordAccess.password_id)
+            .where(PasswordAccess.expires_at <= now)
+            .order_by(PasswordAccess.expires_at).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        # 重新檢查 expires_at：查詢之後才被延長或重新授權的列不刪除
+        deleted_ids = {access_id for (access_id,) in db.session.execute(
+            delete(PasswordAccess).where(
+                PasswordAccess.id.in_([row[0] for row in rows]),
+                PasswordAccess.expires_at <= now
+            ).returning(PasswordAccess.id)
+        )}
+        expired = [row for row in rows if row[0] in deleted_ids]
+        for _, password_id, user_id, group_id, _ in expired:
+            delete_wrapped_key(password_id, user_id=user_id, group_id=group_id)
+        db.session.commit()
+
+        for _, password_id, user_id, group_id, owner_id in expired:
+            acl_index.grant_removed(password_id, user_id, group_id)
+            audit('grant.expire', user_id=owner_id, password_id=password_id,
+                  target_user_id=user_id, group_id=group_id)
+            events.notify(events.GRANT_REVOKED, events.grant_audience(owner_id, user_id, group_id),
+                          password_id=password_id, user_id=user_id, group_id=group_id, reason='expired')
+        total += len(expired)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)  # 讓其他寫入有機會取得資料庫鎖
+    return total
+
+def _sweep_job(app):
+    swept = sweep_expired(app.config.get('GRANT_SWEEP_BATCH', 500), app.config.get('GRANT_SWEEP_PAUSE', 0.05))
+    if swept:
+        app.logger.info("Removed %d expired grants", swept)
+
+def init_app(app):
+    if not app.config.get('GRANT_SWEEP_INTERVAL'):
+        return None
+    job = PeriodicJob(app, 'grant-expiry-sweeper', app.config['GRANT_SWEEP_INTERVAL'], lambda: _sweep_job(app))
+    app.extensions['grant_expiry_sweeper'] = job
+    return job
@@ -0,0 +1,208 @@
+# server/group_closure.py
+"""
+Maintenance of the group_closure table for nested groups.
+
+group_nesting stores direct edges (parent contains child with a permission).
+group_closure stores every (ancestor, descendant) pair reachable through those
+edges, plus a (g, g, DELETE) row for each group, with the effective permission
+of the best path: the minimum along a path, the maximum across paths.
+
+Permission checks then resolve nested access with one indexed join on
+group_closure instead of walking the hierarchy. None of these functions
+commit; callers commit together with their own changes.
+"""
+
+from collections import defaultdict
+from sqlalchemy import and_, bindparam, or_, update
+from models import db, Group, GroupNesting, GroupClosure, PermissionEnum
+
+PERMISSION_ORDER = {PermissionEnum.READ: 1, PermissionEnum.WRITE: 2, PermissionEnum.DELETE: 3}
+PERMISSION_BY_ORDER = {order: permission for permission, order in PERMISSION_ORDER.items()}
+
+def weakest(*permissions):
+    return min(permissions, key=PERMISSION_ORDER.get)
+
+def ancestors_of(group_id):
+    """{ancestor_id: permission} including the group itself"""
+    rows = db.session.query(GroupClosure.ancestor_id, GroupClosure.permission).filter(
+        GroupClosure.descendant_id == group_id
+    ).all()
+    return dict(rows)
+
+def descendants_of(group_id):
+    """{descendant_id: permission} including the group itself"""
+    rows = db.session.query(GroupClosure.descendant_id, GroupClosure.permission).filter(
+        GroupClosure.ancestor_id == group_id
+    ).all()
+    return dict(rows)
+
+def add_group(group_id):
+    db.session.add(GroupClosure(ancestor_id=group_id, descendant_id=group_id, permission=PermissionEnum.DELETE))
+
+def would_create_cycle(parent_group_id, child_group_id):
+    if parent_group_id == child_group_id:
+        return True
+    return db.session.query(GroupClosure.ancestor_id).filter_by(
+        ancestor_id=child_group_id, descendant_id=parent_group_id
+    ).first() is not None
+
+def add_nesting(parent_group_id, child_group_id, permission):
+    """
+    Adds the edge parent -> child and updates the closure incrementally: every
+    ancestor of parent gains (or improves) a path to every descendant of child.
+    The caller must have checked would_create_cycle first.
+    """
+    db.session.add(GroupNesting(
+        parent_group_id=parent_group_id, child_group_id=child_group_id, permission=permission
+    ))
+
+    upper = ancestors_of(parent_group_id)
+    lower = descendants_of(child_group_id)
+    existing = {
+        (ancestor_id, descendant_id): current
+        for ancestor_id, descendant_id, current in db.session.query(
+            GroupClosure.ancestor_id, GroupClosure.descendant_id, GroupClosure.permission
+        ).filter(
+            GroupClosure.ancestor_id.in_(list(upper)),
+            GroupClosure.descendant_id.in_(list(lower))
+        )
+    }
+
+    new_rows = []
+    improved_rows = []
+    for ancestor_id, up_perm in upper.items():
+        for descendant_id, down_perm in lower.items():
+            candidate = weakest(up_perm, permission, down_perm)
+            current = existing.get((ancestor_id, descendant_id))
+            if current is None:
+                new_rows.append({"ancestor_id": ancestor_id, "descendant_id": descendant_id, "permission": candidate})
+            elif PERMISSION_ORDER[candidate] > PERMISSION_ORDER[current]:
+                improved_rows.append({"a": ancestor_id, "d": descendant_id, "permission": candidate})
+    if new_rows:
+        db.session.execute(GroupClosure.__table__.insert(), new_rows)
+    if improved_rows:
+        closure = GroupClosure.__table__
+        db.session.execute(
+            update(closure).where(and_(
+                closure.c.ancestor_id == bindparam('a'),
+                closure.c.descendant_id == bindparam('d')
+            )).values(permission=bindparam('permission')),
+            improved_rows
+        )
+
+def set_nesting_permission(parent_group_id, child_group_id, permission):
+    edge = GroupNesting.query.filter_by(parent_group_id=parent_group_id, child_group_id=child_group_id).first()
+    if not edge:
+        return False
+    edge.permission = permission
+    db.session.flush()
+    _recompute(set(ancestors_of(parent_group_id)), set(descendants_of(child_group_id)))
+    return True
+
+def remove_nesting(parent_group_id, child_group_id):
+    edge = GroupNesting.query.filter_by(parent_group_id=parent_group_id, child_group_id=child_group_id).first()
+    if not edge:
+        return False
+    upper = set(ancestors_of(parent_group_id))
+    lower = set(descendants_of(child_group_id))
+    db.session.delete(edge)
+    db.session.flush()
+    _recompute(upper, lower)
+    return True
+
+def remove_group(group_id):
+    """
+    Drops every edge and closure row involving the group, re-deriving paths
+    that went through it. Returns the group's former (ancestors, descendants),
+    excluding itself: the pairs whose closure rows may have changed.
+    """
+    upper = set(ancestors_of(group_id)) - {group_id}
+    lower = set(descendants_of(group_id)) - {group_id}
+    GroupNesting.query.filter(or_(
+        GroupNesting.parent_group_id == group_id,
+        GroupNesting.child_group_id == group_id
+    )).delete(synchronize_session=False)
+    GroupClosure.query.filter(or_(
+        GroupClosure.ancestor_id == group_id,
+        GroupClosure.descendant_id == group_id
+    )).delete(synchronize_session=False)
+    _recompute(upper, lower)
+    return upper, lower
+
+def _recompute(ancestor_ids, descendant_ids):
+    """
+    Re-derives closure rows for ancestor_ids x descendant_ids from the current
+    edges. Used when an edge is removed or weakened, which can't be applied
+    incrementally.
+    """
+    if not ancestor_ids or not descendant_ids:
+        return
+    ancestor_ids = list(ancestor_ids)
+    descendant_ids = set(descendant_ids)
+
+    GroupClosure.query.filter(
+        GroupClosure.ancestor_id.in_(ancestor_ids),
+        GroupClosure.descendant_id.in_(list(descendant_ids)),
+        GroupClosure.ancestor_id != GroupClosure.descendant_id
+    ).delete(synchronize_session=False)
+
+    # 可能位於路徑上的節點：受影響的祖先與後代，以及祖先仍可到達的群組（這些路徑不受影響）
+    children = defaultdict(list)
+    reachable = db.session.query(GroupClosure.descendant_id).filter(GroupClosure.ancestor_id.in_(ancestor_ids))
+    for parent_id, child_id, permission in db.session.query(
+        GroupNesting.parent_group_id, GroupNesting.child_group_id, GroupNesting.permission
+    ).filter(or_(
+        GroupNesting.parent_group_id.in_(ancestor_ids + list(descendant_ids)),
+        GroupNesting.parent_group_id.in_(reachable)
+    )):
+        children[parent_id].append((child_id, PERMISSION_ORDER[permission]))
+
+    new_rows = []
+    for ancestor_id in ancestor_ids:
+        for descendant_id, order in widest_paths(ancestor_id, children).items():
+            if descendant_id != ancestor_id and descendant_id in descendant_ids:
+                new_rows.append({
+                    "ancestor_id": ancestor_id, "descendant_id": descendant_id,
+                    "permission": PERMISSION_BY_ORDER[order]
+                })
+    if new_rows:
+        db.session.execute(GroupClosure.__table__.insert(), new_rows)
+
+def widest_paths(source_id, children):
+    """
+    Best permission order from source to every reachable group, where
+    children maps parent -> [(child, permission order)]. Only three levels
+    exist, so a BFS restricted to edges of at least each level, strongest
+    first, settles every node at its best level.
+    """
+    best = {source_id: PERMISSION_ORDER[PermissionEnum.DELETE]}
+    for level in (3, 2, 1):
+        frontier = [source_id]
+        seen = {source_id}
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for child_id, order in children.get(node, ()):
+                    if child_id in seen or order < level:
+                        continue
+                    seen.add(child_id)
+                    best.setdefault(child_id, level)
+                    next_frontier.append(child_id)
+            frontier = next_frontier
+    return best
+
+def rebuild_closure():
+    """Recomputes the whole table, e.g. for databases created before nested groups existed."""
+    GroupClosure.query.delete(synchronize_session=False)
+    children = defaultdict(list)
+    for parent_id, child_id, permission in db.session.query(
+        GroupNesting.parent_group_id, GroupNesting.child_group_id, GroupNesting.permission
+    ):
+        children[parent_id].append((child_id, PERMISSION_ORDER[permission]))
+
+    rows = []
+    for (group_id,) in db.session.query(Group.id):
+        for descendant_id, order in widest_paths(group_id, children).items():
+            rows.append({"ancestor_id": group_id, "descendant_id": descendant_id, "permission": PERMISSION_BY_ORDER[order]})
+    if rows:
+        db.session.execute(GroupClosure.__table__.insert(), rows)
@@ -1,10 +1,91 @@
 # server/groups.py
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Group, GroupMembership, PermissionEnum, User
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects import sqlite, postgresql
+from models import db, Group, GroupMembership, GroupNesting, GroupKeyShare, PasswordAccess, PermissionEnum, User
+import group_closure
+from request_context import get_user, invalidate as invalidate_request_cache
+from audit import record as audit
+import events
+import acl_index
+from limits import field_error
 
 groups_bp = Blueprint('groups', __name__)
 
+MAX_BULK_MEMBERS = 1000
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _membership_insert():
+    # 以 _user_group_uc 做衝突處理，並發加入同一成員時不會整批失敗
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(GroupMembership).on_conflict_do_nothing(index_elements=['user_id', 'group_id'])
+    if dialect == 'postgresql':
+        return postgresql.insert(GroupMembership).on_conflict_do_nothing(constraint='_user_group_uc')
+    return insert(GroupMembership)
+
+def _parse_bulk_members(data):
+    """Accepts {"members": [...]} or a bare list; returns the list or None."""
+    members = data.get('members') if isinstance(data, dict) else data
+    if not isinstance(members, list):
+        return None
+    return members
+
+def _member_key(member):
+    """('user_id', int) or ('email', str) for a well-formed bulk member, otherwise None."""
+    if not isinstance(member, dict):
+        return None
+    user_id = member.get('user_id')
+    if user_id:
+        # bool 是 int 的子類別；1.5、"1" 等也不自動轉換
+        return ('user_id', user_id) if isinstance(user_id, int) and not isinstance(user_id, bool) else None
+    email = member.get('email')
+    return ('email', email) if isinstance(email, str) and email else None
+
+def _resolve_bulk_users(members):
+    """Loads every referenced user (by id or email) with a single IN query."""
+    keys = [key for key in map(_member_key, members) if key]
+    user_ids = {value for kind, value in keys if kind == 'user_id'}
+    emails = {value for kind, value in keys if kind == 'email'}
+    if not user_ids and not emails:
+        return {}, {}
+
+    conditions = []
+    if user_ids:
+        conditions.append(User.id.in_(user_ids))
+    if emails:
+        conditions.append(User.email.in_(emails))
+    rows = db.session.query(User.id, User.email).filter(or_(*conditions)).all()
+    return {uid: email for uid, email in rows}, {email: uid for uid, email in rows}
+
+def _lookup_bulk_member(member, users_by_id, users_by_email):
+    """Returns (user_id, result dict) for one requested member."""
+    if not isinstance(member, dict) or not (member.get('user_id') or member.get('email')):
+        return None, {"status": "invalid", "msg": "user_id or email is required"}
+
+    key = _member_key(member)
+    if key is None:
+        if member.get('user_id'):
+            return None, {"user_id": member['user_id'], "status": "invalid", "msg": "user_id must be an integer"}
+        return None, {"email": member['email'], "status": "invalid", "msg": "email must be a string"}
+
+    kind, value = key
+    if kind == 'user_id':
+        result = {"user_id": value}
+        if value not in users_by_id:
+            return None, dict(result, status="not_found")
+        result["email"] = users_by_id[value]
+        return value, result
+
+    result = {"email": value}
+    if value not in users_by_email:
+        return None, dict(result, status="not_found")
+    result["user_id"] = users_by_email[value]
+    return result["user_id"], result
+
 # POST /groups - Create a new group
 @groups_bp.route('/groups', methods=['POST'])
 @jwt_required()
@@ -12,23 +93,92 @@ def create_group_route():
     data = request.get_json()
     if not data or 'name' not in data:
         return jsonify({"msg": "Group name is required"}), 400
+    error = field_error(data)
+    if error:
+        return error
 
     manager_id = int(get_jwt_identity())
     new_group = Group(name=data['name'], description=data.get('description'), manager_id=manager_id)
     db.session.add(new_group)
+    db.session.flush()
+    group_closure.add_group(new_group.id)
     db.session.commit()
     return jsonify({"msg": "Group created successfully", "group_id": new_group.id}), 201
 
-# GET /groups - Get all groups managed by the current user
+# GET /groups - List groups the current user manages and/or belongs to
+# Query: role=manager|member|any (default manager), limit, offset, include=members
 @groups_bp.route('/groups', methods=['GET'])
 @jwt_required()
 def get_user_managed_groups():
     current_user_id = int(get_jwt_identity())
-    groups = Group.query.filter_by(manager_id=current_user_id).all()
-    return jsonify([
-        {"id": g.id, "name": g.name, "description": g.description, "manager_id": g.manager_id}
-        for g in groups
-    ]), 200
+
+    role = request.args.get('role', 'manager')
+    if role not in ('manager', 'member', 'any'):
+        return jsonify({"msg": "role must be one of manager, member, any"}), 400
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"msg": "limit and offset must be integers"}), 400
+    if limit < 1:
+        return jsonify({"msg": "limit must be positive"}), 400
+    include = set(filter(None, request.args.get('include', '').split(',')))
+
+    # 成員數、分享的密碼數與自己的成員權限都以相關子查詢在同一個 SQL 中取得
+    member_count = select(func.count(GroupMembership.id)).where(
+        GroupMembership.group_id == Group.id
+    ).correlate(Group).scalar_subquery()
+    password_count = select(func.count(PasswordAccess.id)).where(
+        PasswordAccess.group_id == Group.id,
+        PasswordAccess.active()
+    ).correlate(Group).scalar_subquery()
+    my_permission = select(GroupMembership.permission).where(
+        GroupMembership.group_id == Group.id,
+        GroupMembership.user_id == current_user_id
+    ).correlate(Group).scalar_subquery()
+
+    is_manager = Group.manager_id == current_user_id
+    is_member = Group.id.in_(
+        select(GroupMembership.group_id).where(GroupMembership.user_id == current_user_id)
+    )
+    role_filter = {'manager': is_manager, 'member': is_member, 'any': or_(is_manager, is_member)}[role]
+
+    query = db.session.query(Group, member_count, password_count, my_permission).filter(
+        role_filter
+    ).order_by(Group.id).limit(limit + 1).offset(offset)
+    if 'members' in include:
+        query = query.options(selectinload(Group.memberships).selectinload(GroupMembership.user))
+    rows = query.all()
+
+    has_more = len(rows) > limit
+    result = []
+    for group, members, passwords, permission in rows[:limit]:
+        item = {
+            "id": group.id,
+            "name": group.name,
+            "description": group.description,
+            "manager_id": group.manager_id,
+            "member_count": members,
+            "password_count": passwords,
+            "role": "manager" if group.manager_id == current_user_id else "member",
+            "permission": permission.value if permission else None
+        }
+        if 'members' in include:
+            item["members"] = [
+                {
+                    "membership_id": m.id,
+                    "user_id": m.user_id,
+                    "email": m.user.email if m.user else None,
+                    "permission": m.permission.value
+                }
+                for m in group.memberships
+            ]
+        result.append(item)
+
+    response = jsonify(result)
+    if has_more:
+        response.headers['X-Next-Offset'] = str(offset + limit)
+    return response, 200
 
 # GET /groups/<int:group_id> - Get details of a specific group
 @groups_bp.route('/groups/<int:group_id>', methods=['GET'])
@@ -48,7 +198,7 @@ def get_group_details(group_id):
     memberships = GroupMembership.query.filter_by(group_id=group_id).all()
     members_data = []
     for member_ship in memberships:
-        member_user = User.query.get(member_ship.user_id)
+        member_user = get_user(member_ship.user_id)
         if member_user:
             members_data.append({
                 "membership_id": member_ship.id,
@@ -57,12 +207,20 @@ def get_group_details(group_id):
                 "permission": member_ship.permission.value
             })
 
+    subgroups = db.session.query(GroupNesting.child_group_id, Group.name, GroupNesting.permission).join(
+        Group, Group.id == GroupNesting.child_group_id
+    ).filter(GroupNesting.parent_group_id == group_id).all()
+
     return jsonify({
         "id": group.id,
         "name": group.name,
         "description": group.description,
         "manager_id": group.manager_id,
-        "members": members_data
+        "members": members_data,
+        "subgroups": [
+            {"group_id": child_id, "name": name, "permission": permission.value}
+            for child_id, name, permission in subgroups
+        ]
     }), 200
 
 # PUT /groups/<int:group_id> - Update group details
@@ -70,6 +228,9 @@ def get_group_details(group_id):
 @jwt_required()
 def update_group_route(group_id):
     data = request.get_json()
+    error = field_error(data)
+    if error:
+        return error
     current_user_id = int(get_jwt_identity())
     group = Group.query.get(group_id)
 
@@ -83,6 +244,21 @@ def update_group_route(group_id):
     db.session.commit()
     return jsonify({"msg": "Group updated successfully"}), 200
 
+def delete_group(group_id):
+    """
+    Deletes a group with set-based statements in one transaction: memberships,
+    grants to the group, nesting/closure rows, then the group itself. The
+    statement count does not depend on how many grants or members it has.
+    """
+    GroupMembership.query.filter_by(group_id=group_id).delete(synchronize_session=False)
+    PasswordAccess.query.filter_by(group_id=group_id).delete(synchronize_session=False)
+    # Detach nested groups and re-derive closure paths that went through this group
+    upper, lower = group_closure.remove_group(group_id)
+    Group.query.filter_by(id=group_id).delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_request_cache()
+    acl_index.group_deleted(group_id, upper, lower)
+
 # DELETE /groups/<int:group_id> - Delete a group
 @groups_bp.route('/groups/<int:group_id>', methods=['DELETE'])
 @jwt_required()
@@ -95,14 +271,14 @@ def delete_group_route(group_id):
     if group.manager_id != current_user_id:
         return jsonify({"msg": "You are not the manager of this group"}), 403
 
-    # Delete associated group memberships first
-    GroupMembership.query.filter_by(group_id=group_id).delete()
-    # Delete associated password accesses (if any were granted via this group)
-    # This might require a more sophisticated cascade or manual cleanup if PasswordAccess points to group_id
-    # For now, rely on cascade delete if defined in models, or add explicit deletion if not.
-    # Assuming `ondelete='CASCADE'` on group_id in PasswordAccess for simplicity here.
-    db.session.delete(group)
-    db.session.commit()
+    audience = events.group_audience(group_id)
+    try:
+        delete_group(group_id)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Failed to delete group", "error": str(e)}), 500
+    audit('group.delete', user_id=current_user_id, group_id=group_id)
+    events.notify(events.MEMBERSHIP_CHANGED, audience, action='group_deleted', group_id=group_id)
     return jsonify({"msg": "Group deleted successfully"}), 200
 
 # POST /groups/<int:group_id>/members - Add a user to a group
@@ -124,7 +300,7 @@ def add_group_member(group_id):
     if not user_id_to_add:
         return jsonify({"msg": "User ID is required"}), 400
 
-    user_to_add = User.query.get(user_id_to_add)
+    user_to_add = get_user(user_id_to_add)
     if not user_to_add:
         return jsonify({"msg": "User not found"}), 404
 
@@ -142,8 +318,140 @@ def add_group_member(group_id):
     new_member = GroupMembership(user_id=user_id_to_add, group_id=group_id, permission=permission)
     db.session.add(new_member)
     db.session.commit()
+    acl_index.membership_set(user_to_add.id, group_id, permission)
+    audit('member.add', user_id=current_user_id, group_id=group_id,
+          target_user_id=user_to_add.id, permission=permission.value)
+    events.notify(events.MEMBERSHIP_CHANGED, [user_to_add.id, group.manager_id],
+                  action='added', group_id=group_id, user_ids=[user_to_add.id])
     return jsonify({"msg": "User added to group"}), 201
 
+# POST /groups/<int:group_id>/members/bulk - Add many users to a group
+@groups_bp.route('/groups/<int:group_id>/members/bulk', methods=['POST'])
+@jwt_required()
+def add_group_members_bulk(group_id):
+    current_user_id = int(get_jwt_identity())
+    group = Group.query.get(group_id)
+
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    members = _parse_bulk_members(request.get_json(silent=True))
+    if members is None:
+        return jsonify({"msg": "A list of members is required"}), 400
+    if len(members) > MAX_BULK_MEMBERS:
+        return jsonify({"msg": f"At most {MAX_BULK_MEMBERS} members per request"}), 400
+
+    users_by_id, users_by_email = _resolve_bulk_users(members)
+    existing = {
+        uid for (uid,) in db.session.query(GroupMembership.user_id).filter(
+            GroupMembership.group_id == group_id,
+            GroupMembership.user_id.in_(users_by_id)
+        )
+    } if users_by_id else set()
+
+    results = []
+    rows = []
+    seen = set()
+    for member in members:
+        user_id, result = _lookup_bulk_member(member, users_by_id, users_by_email)
+        results.append(result)
+        if user_id is None:
+            continue
+
+        try:
+            permission = PermissionEnum(str(member.get('permission', 'read')).upper())
+        except ValueError:
+            result["status"] = "invalid_permission"
+            continue
+
+        if user_id in existing:
+            result["status"] = "already_member"
+        elif user_id in seen:
+            result["status"] = "duplicate"
+        else:
+            seen.add(user_id)
+            result["status"] = "added"
+            result["permission"] = permission.value
+            rows.append({"user_id": user_id, "group_id": group_id, "permission": permission})
+
+    if rows:
+        db.session.execute(_membership_insert(), rows)
+    db.session.commit()
+    for row in rows:
+        acl_index.membership_set(row["user_id"], group_id, row["permission"])
+    if rows:
+        audit('member.bulk_add', user_id=current_user_id, group_id=group_id,
+              user_ids=[row["user_id"] for row in rows])
+        added_ids = [row["user_id"] for row in rows]
+        events.notify(events.MEMBERSHIP_CHANGED, added_ids + [group.manager_id],
+                      action='added', group_id=group_id, user_ids=added_ids)
+
+    added = sum(1 for r in results if r["status"] == "added")
+    return jsonify({"msg": f"{added} users added to group", "results": results}), 200
+
+# DELETE /groups/<int:group_id>/members/bulk - Remove many users from a group
+@groups_bp.route('/groups/<int:group_id>/members/bulk', methods=['DELETE'])
+@jwt_required()
+def remove_group_members_bulk(group_id):
+    current_user_id = int(get_jwt_identity())
+    group = Group.query.get(group_id)
+
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    members = _parse_bulk_members(request.get_json(silent=True))
+    if members is None:
+        return jsonify({"msg": "A list of members is required"}), 400
+    if len(members) > MAX_BULK_MEMBERS:
+        return jsonify({"msg": f"At most {MAX_BULK_MEMBERS} members per request"}), 400
+
+    users_by_id, users_by_email = _resolve_bulk_users(members)
+    existing = {
+        uid for (uid,) in db.session.query(GroupMembership.user_id).filter(
+            GroupMembership.group_id == group_id,
+            GroupMembership.user_id.in_(users_by_id)
+        )
+    } if users_by_id else set()
+
+    results = []
+    to_remove = set()
+    for member in members:
+        user_id, result = _lookup_bulk_member(member, users_by_id, users_by_email)
+        results.append(result)
+        if user_id is None:
+            continue
+        if user_id not in existing:
+            result["status"] = "not_member"
+        elif user_id in to_remove:
+            result["status"] = "duplicate"
+        else:
+            to_remove.add(user_id)
+            result["status"] = "removed"
+
+    if to_remove:
+        GroupMembership.query.filter(
+            GroupMembership.group_id == group_id,
+            GroupMembership.user_id.in_(to_remove)
+        ).delete(synchronize_session=False)
+        # 移除成員時一併刪除其群組私鑰副本（已取得的金鑰需由管理者輪替群組金鑰）
+        GroupKeyShare.query.filter(
+            GroupKeyShare.group_id == group_id,
+            GroupKeyShare.user_id.in_(to_remove)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    for user_id in to_remove:
+        acl_index.membership_removed(user_id, group_id)
+    if to_remove:
+        audit('member.bulk_remove', user_id=current_user_id, group_id=group_id, user_ids=sorted(to_remove))
+        events.notify(events.MEMBERSHIP_CHANGED, list(to_remove) + [group.manager_id],
+                      action='removed', group_id=group_id, user_ids=sorted(to_remove))
+
+    return jsonify({"msg": f"{len(to_remove)} users removed from group", "results": results}), 200
+
 # PUT/PATCH /groups/<int:group_id>/members/<int:user_id> - Update user's group permission
 @groups_bp.route('/groups/<int:group_id>/members/<int:user_id>', methods=['PUT', 'PATCH'])
 @jwt_required()
@@ -172,6 +480,11 @@ def update_group_member_permission(group_id, user_id):
 
     membership.permission = new_permission
     db.session.commit()
+    acl_index.membership_set(user_id, group_id, new_permission)
+    audit('member.update', user_id=current_user_id, group_id=group_id,
+          target_user_id=user_id, permission=new_permission.value)
+    events.notify(events.MEMBERSHIP_CHANGED, [user_id, group.manager_id],
+                  action='updated', group_id=group_id, user_ids=[user_id], permission=new_permission.value)
     return jsonify({"msg": "Group member permission updated successfully"}), 200
 
 
@@ -192,5 +505,107 @@ def remove_group_member(group_id, user_id):
         return jsonify({"msg": "User not found in this group"}), 404
 
     db.session.delete(membership)
+    GroupKeyShare.query.filter_by(group_id=group_id, user_id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+    acl_index.membership_removed(user_id, group_id)
+    audit('member.remove', user_id=current_user_id, group_id=group_id, target_user_id=user_id)
+    events.notify(events.MEMBERSHIP_CHANGED, [user_id, group.manager_id],
+                  action='removed', group_id=group_id, user_ids=[user_id])
+    return jsonify({"msg": "User removed from group"}), 200
+
+# POST /groups/<int:group_id>/subgroups - Nest another group inside this group
+@groups_bp.route('/groups/<int:group_id>/subgroups', methods=['POST'])
+@jwt_required()
+def add_subgroup(group_id):
+    current_user_id = int(get_jwt_identity())
+    group = Group.query.get(group_id)
+
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    data = request.get_json()
+    child_group_id = data.get('group_id')
+    permission_str = data.get('permission', 'read') # Default to read
+
+    if not child_group_id:
+        return jsonify({"msg": "Group ID is required"}), 400
+
+    child_group = Group.query.get(child_group_id)
+    if not child_group:
+        return jsonify({"msg": "Subgroup not found"}), 404
+
+    try:
+        permission = PermissionEnum(permission_str.upper())
+    except ValueError:
+        return jsonify({"msg": "Invalid permission type"}), 400
+
+    existing = GroupNesting.query.filter_by(parent_group_id=group_id, child_group_id=child_group.id).first()
+    if existing:
+        return jsonify({"msg": "Group is already a subgroup of this group"}), 409
+    if group_closure.would_create_cycle(group_id, child_group.id):
+        return jsonify({"msg": "Nesting this group would create a cycle"}), 409
+
+    group_closure.add_nesting(group_id, child_group.id, permission)
+    db.session.commit()
+    acl_index.closure_changed(group_id, child_group.id)
+    audit('subgroup.add', user_id=current_user_id, group_id=group_id,
+          child_group_id=child_group.id, permission=permission.value)
+    # 子群組成員可見的條目隨之改變
+    events.notify(events.MEMBERSHIP_CHANGED, events.group_audience(child_group.id) | {group.manager_id},
+                  action='subgroup_added', group_id=group_id, child_group_id=child_group.id)
+    return jsonify({"msg": "Subgroup added to group"}), 201
+
+# PUT/PATCH /groups/<int:group_id>/subgroups/<int:child_group_id> - Update a subgroup's permission
+@groups_bp.route('/groups/<int:group_id>/subgroups/<int:child_group_id>', methods=['PUT', 'PATCH'])
+@jwt_required()
+def update_subgroup_permission(group_id, child_group_id):
+    current_user_id = int(get_jwt_identity())
+    group = Group.query.get(group_id)
+
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    data = request.get_json()
+    new_permission_str = data.get('permission')
+    if not new_permission_str:
+        return jsonify({"msg": "New permission is required"}), 400
+
+    try:
+        new_permission = PermissionEnum(new_permission_str.upper())
+    except ValueError:
+        return jsonify({"msg": "Invalid permission type"}), 400
+
+    if not group_closure.set_nesting_permission(group_id, child_group_id, new_permission):
+        return jsonify({"msg": "Subgroup not found in this group"}), 404
+    db.session.commit()
+    acl_index.closure_changed(group_id, child_group_id)
+    audit('subgroup.update', user_id=current_user_id, group_id=group_id,
+          child_group_id=child_group_id, permission=new_permission.value)
+    events.notify(events.MEMBERSHIP_CHANGED, events.group_audience(child_group_id) | {group.manager_id},
+                  action='subgroup_updated', group_id=group_id, child_group_id=child_group_id)
+    return jsonify({"msg": "Subgroup permission updated successfully"}), 200
+
+# DELETE /groups/<int:group_id>/subgroups/<int:child_group_id> - Remove a nested group
+@groups_bp.route('/groups/<int:group_id>/subgroups/<int:child_group_id>', methods=['DELETE'])
+@jwt_required()
+def remove_subgroup(group_id, child_group_id):
+    current_user_id = int(get_jwt_identity())
+    group = Group.query.get(group_id)
+
+    if not group:
+        return jsonify({"msg": "Group not found"}), 404
+    if group.manager_id != current_user_id:
+        return jsonify({"msg": "You are not the manager of this group"}), 403
+
+    if not group_closure.remove_nesting(group_id, child_group_id):
+        return jsonify({"msg": "Subgroup not found in this group"}), 404
     db.session.commit()
-    return jsonify({"msg": "User removed from group"}), 200
\ No newline at end of file
+    acl_index.closure_changed(group_id, child_group_id)
+    audit('subgroup.remove', user_id=current_user_id, group_id=group_id, child_group_id=child_group_id)
+    events.notify(events.MEMBERSHIP_CHANGED, events.group_audience(child_group_id) | {group.manager_id},
+                  action='subgroup_removed', group_id=group_id, child_group_id=child_group_id)
+    return jsonify({"msg": "Subgroup removed from group"}), 200
@@ -0,0 +1,137 @@
+# server/history.py
+"""
+Entry version history.
+
+Before an update overwrites an entry, record_version() copies the current
+site, ciphertext, iv and notes into user_password_history with one INSERT in
+the same transaction. Versions are end-to-end encrypted like the entry
+itself, so they are stored whole: ciphertext does not delta-compress.
+
+The update path only inserts. A periodic job (HISTORY_PRUNE_INTERVAL) trims
+each entry to its newest HISTORY_MAX_VERSIONS versions and drops versions
+older than HISTORY_RETENTION, in batches.
+
+After a master-password rotation the old versions can no longer be
+decrypted, so key_rotation deletes the user's history when it commits.
+"""
+
+import time
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import delete, func, insert, select
+from models import db, UserPasswordHistory
+import permission_storage  # 模組匯入：permission_storage 也匯入本模組，兩者誰先載入都可以
+from request_context import get_password_entry
+from jobs import PeriodicJob
+
+history_bp = Blueprint('history', __name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def record_version(entry):
+    """Stores the entry's current contents as a history version; call before changing it. The caller commits."""
+    db.session.execute(insert(UserPasswordHistory), {
+        "password_id": entry.id,
+        "site": entry.site,
+        "encrypted_data": entry.encrypted_data,
+        "iv": entry.iv,
+        "notes": entry.notes,
+        "editor_id": entry.updated_by,
+        "edited_at": entry.updated_at,
+        "replaced_at": datetime.utcnow(),
+    })
+
+def prune(max_versions, retention=None, batch_size=500, pause=0.0):
+    """Deletes versions beyond max_versions per entry and versions older than retention. Returns rows deleted."""
+    deleted = 0
+    history = UserPasswordHistory
+
+    if max_versions:
+        while True:
+            # 只處理超出上限的條目，每批最多 batch_size 個
+            password_ids = [pid for (pid,) in db.session.execute(
+                select(history.password_id).group_by(history.password_id)
+                .having(func.count() > max_versions).limit(batch_size)
+            )]
+            if not password_ids:
+                break
+            for password_id in password_ids:
+                oldest_kept = select(history.id).where(history.password_id == password_id) \
+                    .order_by(history.id.desc()).offset(max_versions - 1).limit(1).scalar_subquery()
+                deleted += db.session.execute(
+                    delete(history).where(history.password_id == password_id, history.id < oldest_kept)
+                ).rowcount
+            db.session.commit()
+            if pause:
+                time.sleep(pause)
+
+    if retention:
+        cutoff = datetime.utcnow() - retention
+        while True:
+            batch = select(history.id).where(history.replaced_at < cutoff).limit(batch_size)
+            count = db.session.execute(delete(history).where(history.id.in_(batch))).rowcount
+            db.session.commit()
+            deleted += count
+            if count < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return deleted
+
+def _prune_job(app):
+    deleted = prune(
+        app.config.get('HISTORY_MAX_VERSIONS'),
+        app.config.get('HISTORY_RETENTION'),
+        app.config.get('HISTORY_PRUNE_BATCH', 500),
+        app.config.get('HISTORY_PRUNE_PAUSE', 0.05),
+    )
+    if deleted:
+        app.logger.info("Pruned %d history versions", deleted)
+
+def init_app(app):
+    if not app.config.get('HISTORY_PRUNE_INTERVAL'):
+        return None
+    job = PeriodicJob(app, 'history-pruner', app.config['HISTORY_PRUNE_INTERVAL'], lambda: _prune_job(app))
+    app.extensions['history_pruner'] = job
+    return job
+
+# GET /storage/<password_id>/history - Previous versions, newest first (requires read access)
+# Query: limit, before_id (the X-Next-Before-Id header of the previous page)
+@history_bp.route('/storage/<int:password_id>/history', methods=['GET'])
+@jwt_required()
+def get_history(password_id):
+    current_user_id = int(get_jwt_identity())
+    if not permission_storage.get_user_permission(current_user_id, password_id) or not get_password_entry(password_id):
+        return jsonify({"msg": "Access denied"}), 403
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError:
+        return jsonify({"msg": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"msg": "limit must be positive"}), 400
+
+    query = UserPasswordHistory.query.filter(UserPasswordHistory.password_id == password_id)
+    if before_id is not None:
+        query = query.filter(UserPasswordHistory.id < before_id)
+    versions = query.order_by(UserPasswordHistory.id.desc()).limit(limit + 1).all()
+
+    response = jsonify([
+        {
+            "id": v.id,
+            "site": v.site,
+            "encrypted_data": v.encrypted_data,
+            "iv": v.iv,
+            "notes": v.notes,
+            "editor_id": v.editor_id,
+            "edited_at": v.edited_at.isoformat() if v.edited_at else None,
+            "replaced_at": v.replaced_at.isoformat()
+        }
+        for v in versions[:limit]
+    ])
+    if len(versions) > limit:
+        response.headers['X-Next-Before-Id'] = str(versions[limit - 1].id)
+    return response, 200
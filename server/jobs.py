@@ -0,0 +1,34 @@
+# server/jobs.py
+"""
+Periodic background jobs (trash purge, history pruning, ...).
+
+Each job runs on its own daemon thread, inside an app context, every
+`interval` seconds. A failing run is logged and rolled back; the next run
+starts normally. Every worker process runs its own jobs, so job functions
+must be safe to run concurrently (delete-by-condition, not read-then-act).
+"""
+
+import threading
+from models import db
+
+class PeriodicJob:
+    def __init__(self, app, name, interval, fn):
+        self.app = app
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.fn()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error("%s failed: %s", self.name, e)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,316 @@
+# server/key_rotation.py
+"""
+Master-password rotation.
+
+Changing the master password changes the key every entry is encrypted with,
+so all entries must be re-encrypted, and the new login hash and data_salt
+must go live at the same moment. Rotation is a session:
+
+1. POST /rotation checks the current login key, hashes the new one, and
+   returns a token plus the new data_salt.
+2. PUT /rotation/<token>/entries uploads re-encrypted entries in chunks. Each
+   chunk is staged in key_rotation_entry in its own short transaction, so a
+   large vault never holds the write lock for the whole upload.
+3. POST /rotation/<token>/commit checks that every owned entry is staged and
+   unchanged since it was staged. This includes entries in the trash
+   (GET /trash lists their ciphertext), so a later restore still decrypts. It then swaps ciphertexts,
+   password_hash and data_salt in one commit.
+"""
+
+import base64
+import secrets
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from argon2.exceptions import VerifyMismatchError
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import sqlite, postgresql
+from models import db, User, UserPassword, UserPasswordHistory, UserKey, KeyRotation, KeyRotationEntry
+from auth import hash_login_key, verify_login_key
+from request_context import current_user, invalidate as invalidate_request_cache
+from audit import record as audit
+from limits import field_error, list_field_error
+
+key_rotation_bp = Blueprint('key_rotation', __name__)
+
+MAX_ROTATION_CHUNK = 1000
+MAX_LISTED_IDS = 1000
+
+def _staged_upsert(rows):
+    # 重新上傳同一筆條目時覆蓋暫存內容（例如續傳或修正過期條目）
+    table = KeyRotationEntry.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        module = sqlite if dialect == 'sqlite' else postgresql
+        stmt = module.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['rotation_id', 'password_id'],
+            set_={
+                "encrypted_data": stmt.excluded.encrypted_data, "iv": stmt.excluded.iv,
+                "notes": stmt.excluded.notes, "staged_at": stmt.excluded.staged_at
+            }
+        )
+        db.session.execute(stmt, rows)
+        return
+    KeyRotationEntry.query.filter(
+        KeyRotationEntry.rotation_id == rows[0]["rotation_id"],
+        KeyRotationEntry.password_id.in_([r["password_id"] for r in rows])
+    ).delete(synchronize_session=False)
+    db.session.execute(insert(table), rows)
+
+def _get_open_rotation(token, user_id):
+    """Returns (rotation, error response)."""
+    rotation = KeyRotation.query.filter_by(token=token, user_id=user_id).first()
+    if not rotation:
+        return None, (jsonify({"msg": "Rotation session not found"}), 404)
+    if rotation.status != 'open':
+        return None, (jsonify({"msg": f"Rotation session is {rotation.status}"}), 409)
+    if rotation.expires_at < datetime.utcnow():
+        return None, (jsonify({"msg": "Rotation session expired"}), 410)
+    return rotation, None
+
+def _missing_ids(rotation, limit=MAX_LISTED_IDS):
+    staged = select(KeyRotationEntry.password_id).where(KeyRotationEntry.rotation_id == rotation.id)
+    return [pid for (pid,) in db.session.query(UserPassword.id).filter(
+        UserPassword.user_id == rotation.user_id,
+        UserPassword.id.not_in(staged)
+    ).order_by(UserPassword.id).limit(limit)]
+
+def _stale_ids(rotation, limit=MAX_LISTED_IDS):
+    """Staged entries that were modified after they were staged and must be re-uploaded."""
+    return [pid for (pid,) in db.session.query(UserPassword.id).join(
+        KeyRotationEntry, KeyRotationEntry.password_id == UserPassword.id
+    ).filter(
+        KeyRotationEntry.rotation_id == rotation.id,
+        UserPassword.updated_at > KeyRotationEntry.staged_at
+    ).order_by(UserPassword.id).limit(limit)]
+
+def _rotation_status(rotation):
+    total = db.session.query(func.count(UserPassword.id)).filter(UserPassword.user_id == rotation.user_id).scalar()
+    staged = db.session.query(func.count()).select_from(KeyRotationEntry).filter(
+        KeyRotationEntry.rotation_id == rotation.id
+    ).scalar()
+    return {
+        "rotation_token": rotation.token,
+        "status": rotation.status,
+        "entries_total": total,
+        "entries_staged": staged,
+        "expires_at": rotation.expires_at.isoformat(),
+    }
+
+# POST /rotation - Start a master-password rotation
+# Body: {"login_key": "<current>", "new_login_key": "<new>"}
+@key_rotation_bp.route('/rotation', methods=['POST'])
+@jwt_required()
+def start_rotation():
+    current_user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    login_key = data.get('login_key')
+    new_login_key = data.get('new_login_key')
+    if not login_key or not new_login_key:
+        return jsonify({"msg": "login_key and new_login_key are required"}), 400
+
+    user = current_user()
+    try:
+        verify_login_key(user.password_hash if user else None, login_key)
+    except VerifyMismatchError:
+        return jsonify({"msg": "無效的憑證"}), 401
+
+    # 同一用戶只保留一個進行中的工作階段：舊的（含暫存條目）直接捨棄
+    KeyRotation.query.filter(
+        KeyRotation.user_id == current_user_id,
+        KeyRotation.status != 'committed'
+    ).delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    rotation = KeyRotation(
+        token=secrets.token_urlsafe(24),
+        user_id=current_user_id,
+        # Argon2 在這裡先算好，提交時不必在交易中做耗時運算
+        new_password_hash=hash_login_key(new_login_key),
+        new_data_salt=base64.b64encode(secrets.token_bytes(32)).decode('utf-8'),
+        created_at=now,
+        expires_at=now + current_app.config['KEY_ROTATION_TTL'],
+    )
+    db.session.add(rotation)
+    db.session.commit()
+
+    return jsonify(dict(
+        _rotation_status(rotation),
+        msg="Rotation started, re-encrypt every entry with a key derived from the new data_salt",
+        data_salt=rotation.new_data_salt
+    )), 201
+
+# GET /rotation/<token> - Progress, with ids still to upload
+@key_rotation_bp.route('/rotation/<token>', methods=['GET'])
+@jwt_required()
+def get_rotation(token):
+    current_user_id = int(get_jwt_identity())
+    rotation = KeyRotation.query.filter_by(token=token, user_id=current_user_id).first()
+    if not rotation:
+        return jsonify({"msg": "Rotation session not found"}), 404
+
+    status = _rotation_status(rotation)
+    if rotation.status == 'open':
+        status["missing_ids"] = _missing_ids(rotation)
+        status["stale_ids"] = _stale_ids(rotation)
+    return jsonify(status), 200
+
+# PUT /rotation/<token>/entries - Stage a chunk of re-encrypted entries
+# Body: {"entries": [{"password_id": 1, "encrypted_data": "...", "iv": "...", "notes": "..."}]}
+@key_rotation_bp.route('/rotation/<token>/entries', methods=['PUT'])
+@jwt_required()
+def stage_entries(token):
+    current_user_id = int(get_jwt_identity())
+    rotation, error = _get_open_rotation(token, current_user_id)
+    if error:
+        return error
+
+    data = request.get_json(silent=True)
+    entries = data.get('entries') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return jsonify({"msg": "A list of entries is required"}), 400
+    if len(entries) > MAX_ROTATION_CHUNK:
+        return jsonify({"msg": f"At most {MAX_ROTATION_CHUNK} entries per request"}), 400
+    error = list_field_error(entries)
+    if error:
+        return error
+
+    now = datetime.utcnow()
+    rows = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('encrypted_data') or not entry.get('iv'):
+            return jsonify({"msg": "Each entry needs password_id, encrypted_data and iv"}), 400
+        try:
+            password_id = int(entry.get('password_id'))
+        except (TypeError, ValueError):
+            return jsonify({"msg": "Each entry needs password_id, encrypted_data and iv"}), 400
+        rows[password_id] = {
+            "rotation_id": rotation.id,
+            "password_id": password_id,
+            "encrypted_data": entry['encrypted_data'],
+            "iv": entry['iv'],
+            "notes": entry.get('notes'),
+            "staged_at": now,
+        }
+
+    owned = {pid for (pid,) in db.session.query(UserPassword.id).filter(
+        UserPassword.user_id == current_user_id,
+        UserPassword.id.in_(list(rows))
+    )} if rows else set()
+    rejected = sorted(set(rows) - owned)
+    if rejected:
+        return jsonify({"msg": "Entries not found or not owned by you", "password_ids": rejected}), 403
+
+    if rows:
+        _staged_upsert(list(rows.values()))
+    db.session.commit()
+    return jsonify(dict(_rotation_status(rotation), msg=f"{len(rows)} entries staged")), 200
+
+# PUT /rotation/<token>/private-key - Envelope key pair re-wrapped with the new master key
+# Body: {"encrypted_private_key": "..."}
+@key_rotation_bp.route('/rotation/<token>/private-key', methods=['PUT'])
+@jwt_required()
+def stage_private_key(token):
+    current_user_id = int(get_jwt_identity())
+    rotation, error = _get_open_rotation(token, current_user_id)
+    if error:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    if not data.get('encrypted_private_key'):
+        return jsonify({"msg": "encrypted_private_key is required"}), 400
+    error = field_error(data)
+    if error:
+        return error
+    if not db.session.get(UserKey, current_user_id):
+        return jsonify({"msg": "No key pair published"}), 404
+
+    rotation.new_encrypted_private_key = data['encrypted_private_key']
+    db.session.commit()
+    return jsonify({"msg": "Private key staged"}), 200
+
+# POST /rotation/<token>/commit - Swap everything in one transaction
+@key_rotation_bp.route('/rotation/<token>/commit', methods=['POST'])
+@jwt_required()
+def commit_rotation(token):
+    current_user_id = int(get_jwt_identity())
+    rotation, error = _get_open_rotation(token, current_user_id)
+    if error:
+        return error
+
+    if not rotation.new_encrypted_private_key and db.session.get(UserKey, current_user_id):
+        # 私鑰以主密碼包裝，未重新包裝就提交會讓用戶無法再解開信封金鑰
+        return jsonify({"msg": "Stage the re-wrapped private key before committing"}), 409
+
+    missing = _missing_ids(rotation)
+    stale = _stale_ids(rotation)
+    if missing or stale:
+        return jsonify({
+            "msg": "Every owned entry must be staged, and entries changed since staging must be staged again",
+            "missing_ids": missing,
+            "stale_ids": stale,
+        }), 409
+
+    now = datetime.utcnow()
+    staged = KeyRotationEntry.__table__
+    entries = UserPassword.__table__
+
+    def staged_value(column):
+        return select(column).where(
+            staged.c.rotation_id == rotation.id,
+            staged.c.password_id == entries.c.id
+        ).scalar_subquery()
+
+    try:
+        # 一個 UPDATE 敘述換掉所有密文，與新的登入雜湊、data_salt 在同一個交易提交
+        db.session.execute(
+            update(entries)
+            .where(entries.c.id.in_(select(staged.c.password_id).where(staged.c.rotation_id == rotation.id)))
+            .values(
+                encrypted_data=staged_value(staged.c.encrypted_data),
+                iv=staged_value(staged.c.iv),
+                notes=func.coalesce(staged_value(staged.c.notes), entries.c.notes),
+                updated_at=now,
+            )
+        )
+        db.session.execute(
+            update(User).where(User.id == current_user_id)
+            .values(password_hash=rotation.new_password_hash, data_salt=rotation.new_data_salt, updated_at=now)
+        )
+        if rotation.new_encrypted_private_key:
+            db.session.execute(
+                update(UserKey).where(UserKey.user_id == current_user_id)
+                .values(encrypted_private_key=rotation.new_encrypted_private_key, updated_at=now)
+            )
+        # 舊版本以舊主密碼加密，輪替後無法再解開
+        db.session.execute(delete(UserPasswordHistory).where(UserPasswordHistory.password_id.in_(
+            select(UserPassword.id).where(UserPassword.user_id == current_user_id)
+        )))
+        KeyRotationEntry.query.filter_by(rotation_id=rotation.id).delete(synchronize_session=False)
+        rotation.status = 'committed'
+        rotation.committed_at = now
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "Failed to commit rotation", "error": str(e)}), 500
+
+    invalidate_request_cache()
+    audit('key.rotate', user_id=current_user_id)
+    return jsonify({"msg": "Master password rotated", "data_salt": rotation.new_data_salt}), 200
+
+# DELETE /rotation/<token> - Abort and drop staged entries
+@key_rotation_bp.route('/rotation/<token>', methods=['DELETE'])
+@jwt_required()
+def abort_rotation(token):
+    current_user_id = int(get_jwt_identity())
+    rotation = KeyRotation.query.filter_by(token=token, user_id=current_user_id).first()
+    if not rotation:
+        return jsonify({"msg": "Rotation session not found"}), 404
+    if rotation.status == 'committed':
+        return jsonify({"msg": "Rotation session is committed"}), 409
+
+    KeyRotationEntry.query.filter_by(rotation_id=rotation.id).delete(synchronize_session=False)
+    rotation.status = 'aborted'
+    db.session.commit()
+    return jsonify({"msg": "Rotation aborted"}), 200
@@ -0,0 +1,63 @@
+# server/limits.py
+"""
+Request and field size limits.
+
+MAX_CONTENT_LENGTH caps every request body. Werkzeug checks Content-Length
+before the body is read, and stops a chunked body once it passes the limit,
+so an oversized request is rejected without buffering it. Endpoints that
+legitimately take large bodies (vault import, attachment chunks) get their own
+cap through ROUTE_MAX_CONTENT_LENGTH.
+
+FIELD_MAX_LENGTHS caps individual JSON fields (in characters) so one entry
+cannot carry megabytes of notes or ciphertext into every /passwords response
+it appears in. Routes call field_error() on the parsed body before touching
+the database. Both kinds of violation answer 413 with a JSON body.
+"""
+
+from flask import current_app, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+def _apply_route_limit():
+    limits = current_app.config.get('ROUTE_MAX_CONTENT_LENGTH') or {}
+    if request.endpoint in limits:
+        # Flask 3.1 起可針對單一請求設定上限（None 表示不限制）
+        request.max_content_length = limits[request.endpoint]
+
+def _too_large(e):
+    return jsonify({"msg": "Request body too large", "max_bytes": request.max_content_length}), 413
+
+def init_app(app):
+    app.before_request(_apply_route_limit)
+    app.register_error_handler(RequestEntityTooLarge, _too_large)
+
+def oversized_field(data, fields=None):
+    """
+    Returns (name, limit) for the first string field longer than its limit, or
+    None. fields restricts the check to some names; by default every key with
+    a configured limit is checked.
+    """
+    if not isinstance(data, dict):
+        return None
+    limits = current_app.config.get('FIELD_MAX_LENGTHS') or {}
+    for name in fields or data.keys():
+        value = data.get(name)
+        limit = limits.get(name)
+        if limit is not None and isinstance(value, str) and len(value) > limit:
+            return name, limit
+    return None
+
+def field_error(data, fields=None):
+    """Returns a 413 response if a field is over its limit, otherwise None."""
+    oversized = oversized_field(data, fields)
+    if oversized is None:
+        return None
+    name, limit = oversized
+    return jsonify({"msg": f"Field '{name}' is too long", "field": name, "max_length": limit}), 413
+
+def list_field_error(items):
+    """field_error() for each dict in a list body (bulk endpoints)."""
+    for item in items:
+        error = field_error(item)
+        if error:
+            return error
+    return None
@@ -1,9 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, or_
+from sqlalchemy.engine import Engine
 import enum
+import sqlite3
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# SQLite 預設不檢查外鍵，必須在每個連線上開啟，ON DELETE CASCADE 才會生效
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 class PermissionEnum(enum.Enum):
     READ = "READ"
     WRITE = "WRITE"
@@ -29,6 +40,10 @@ class UserPassword(db.Model):
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_by = db.Column(db.Integer, nullable=True)  # 最後修改者；舊資料為 NULL
+    # 軟刪除：移到垃圾桶的時間與操作者；trash.py 的背景清除工作在保留期過後真正刪除
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
+    deleted_by = db.Column(db.Integer, nullable=True)
 
     user = db.relationship('User', backref=db.backref('passwords', lazy=True))
     accessors = db.relationship(
@@ -47,25 +62,55 @@ class Group(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     members = db.relationship('User', secondary='group_membership', backref='groups')
+    # Read-only view of membership rows (with permissions); writes go through GroupMembership
+    memberships = db.relationship('GroupMembership', viewonly=True, order_by='GroupMembership.id')
 
 # Group membership with permissions
 class GroupMembership(db.Model):
     __tablename__ = 'group_membership'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), nullable=False, index=True)
     permission = db.Column(db.Enum(PermissionEnum), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    user = db.relationship('User', viewonly=True)
+
     __table_args__ = (
         db.UniqueConstraint('user_id', 'group_id', name='_user_group_uc'),
     )
 
+# Group nested inside another group: members of the child group inherit the
+# parent's grants, capped by the nesting permission
+class GroupNesting(db.Model):
+    __tablename__ = 'group_nesting'
+    id = db.Column(db.Integer, primary_key=True)
+    parent_group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), nullable=False, index=True)
+    child_group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), nullable=False, index=True)
+    permission = db.Column(db.Enum(PermissionEnum), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('parent_group_id', 'child_group_id', name='_parent_child_uc'),
+    )
+
+# Transitive closure of group_nesting, maintained by group_closure.py.
+# Every group has a (g, g, DELETE) row; permission is the best path's weakest link.
+class GroupClosure(db.Model):
+    __tablename__ = 'group_closure'
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), primary_key=True)
+    permission = db.Column(db.Enum(PermissionEnum), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_group_closure_descendant', 'descendant_id', 'ancestor_id'),
+    )
+
 # Password access control: per user or group
 class PasswordAccess(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), nullable=True, index=True)
     password_id = db.Column(
         db.Integer,
         db.ForeignKey('user_password.id', ondelete="CASCADE"),
@@ -74,9 +119,10 @@ class PasswordAccess(db.Model):
     )
     permission = db.Column(db.Enum(PermissionEnum), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)  # NULL = permanent; expired rows are swept by grant_expiry.py
 
     user = db.relationship('User', backref='password_accesses')
-    group = db.relationship('Group', backref='password_accesses')
+    group = db.relationship('Group', backref=db.backref('password_accesses', passive_deletes=True))
 
     __table_args__ = (
         db.CheckConstraint(
@@ -85,3 +131,171 @@ class PasswordAccess(db.Model):
         ),
         db.UniqueConstraint('user_id', 'group_id', 'password_id', name='_user_group_password_uc'),
     )
+
+    @classmethod
+    def active(cls, now=None):
+        """Filter for grants that have not expired yet."""
+        return or_(cls.expires_at.is_(None), cls.expires_at > (now or datetime.utcnow()))
+
+    def is_active(self, now=None):
+        return self.expires_at is None or self.expires_at > (now or datetime.utcnow())
+
+# Revoked JWTs (logout); checked through the in-memory set in token_blocklist.py
+class TokenBlocklist(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    token_type = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # token_blocklist 依此增量同步
+
+# Resumable vault import (vault_transfer.py): progress of one archive upload.
+# records_committed is advanced in the same transaction as each chunk.
+class VaultImport(db.Model):
+    __tablename__ = 'vault_import'
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    export_id = db.Column(db.String(64), nullable=True)  # header of the archive being imported
+    records_committed = db.Column(db.Integer, nullable=False, default=0)
+    entries_imported = db.Column(db.Integer, nullable=False, default=0)
+    grants_imported = db.Column(db.Integer, nullable=False, default=0)
+    grants_skipped = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Archive entry id -> new UserPassword id, so grants later in the archive
+# (or in a resumed upload) can be attached to the imported entries
+class VaultImportMap(db.Model):
+    __tablename__ = 'vault_import_map'
+    import_id = db.Column(db.Integer, db.ForeignKey('vault_import.id', ondelete="CASCADE"), primary_key=True)
+    source_id = db.Column(db.Integer, primary_key=True)
+    password_id = db.Column(db.Integer, db.ForeignKey('user_password.id', ondelete="CASCADE"), nullable=False)
+
+# Master-password rotation session (key_rotation.py). Re-encrypted entries are
+# staged in KeyRotationEntry and swapped in together with the new login hash
+# and data_salt in a single commit.
+class KeyRotation(db.Model):
+    __tablename__ = 'key_rotation'
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    new_password_hash = db.Column(db.String(256), nullable=False)
+    new_data_salt = db.Column(db.String(64), nullable=False)
+    new_encrypted_private_key = db.Column(db.Text, nullable=True)  # user key pair re-wrapped with the new master key
+    status = db.Column(db.String(16), nullable=False, default='open')  # open / committed / aborted
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    committed_at = db.Column(db.DateTime, nullable=True)
+
+class KeyRotationEntry(db.Model):
+    __tablename__ = 'key_rotation_entry'
+    rotation_id = db.Column(db.Integer, db.ForeignKey('key_rotation.id', ondelete="CASCADE"), primary_key=True)
+    password_id = db.Column(db.Integer, db.ForeignKey('user_password.id', ondelete="CASCADE"), primary_key=True)
+    encrypted_data = db.Column(db.Text, nullable=False)
+    iv = db.Column(db.String(24), nullable=False)
+    notes = db.Column(db.Text, nullable=True)  # None keeps the entry's current notes
+    staged_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Envelope encryption (envelope_keys.py). Each entry may be encrypted with its
+# own data key; the data key is stored wrapped for each recipient, so sharing
+# adds one small row instead of re-encrypting the entry.
+# User key pair, kept out of the user table so the hot row stays small
+class UserKey(db.Model):
+    __tablename__ = 'user_key'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), primary_key=True)
+    public_key = db.Column(db.Text, nullable=False)
+    encrypted_private_key = db.Column(db.Text, nullable=False)  # wrapped with the master key on the client
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GroupKey(db.Model):
+    __tablename__ = 'group_key'
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), primary_key=True)
+    public_key = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# The group's private key wrapped with one member's public key
+class GroupKeyShare(db.Model):
+    __tablename__ = 'group_key_share'
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), primary_key=True, index=True)
+    wrapped_private_key = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# An entry's data key wrapped for one user or one group
+class WrappedKey(db.Model):
+    __tablename__ = 'wrapped_key'
+    id = db.Column(db.Integer, primary_key=True)
+    password_id = db.Column(db.Integer, db.ForeignKey('user_password.id', ondelete="CASCADE"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True, index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id', ondelete="CASCADE"), nullable=True, index=True)
+    wrapped_key = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.CheckConstraint(
+            "(user_id IS NOT NULL) <> (group_id IS NOT NULL)",
+            name="wrapped_key_user_xor_group"
+        ),
+        db.UniqueConstraint('password_id', 'user_id', 'group_id', name='_wrapped_key_target_uc'),
+    )
+
+# Record of an entry purged from the trash, so sync clients can drop it for good.
+# password_id has no foreign key: the entry row no longer exists.
+class Tombstone(db.Model):
+    __tablename__ = 'tombstone'
+    id = db.Column(db.Integer, primary_key=True)
+    password_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    purged_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_tombstone_user_id', 'user_id', 'id'),
+    )
+
+# Previous versions of an entry (history.py). A row is the version that an
+# update replaced: what it contained, who saved it and when.
+class UserPasswordHistory(db.Model):
+    __tablename__ = 'user_password_history'
+    id = db.Column(db.Integer, primary_key=True)
+    password_id = db.Column(db.Integer, db.ForeignKey('user_password.id', ondelete="CASCADE"), nullable=False)
+    site = db.Column(db.String(120), nullable=False)
+    encrypted_data = db.Column(db.Text, nullable=False)
+    iv = db.Column(db.String(24), nullable=False)
+    notes = db.Column(db.Text, nullable=True)
+    editor_id = db.Column(db.Integer, nullable=True)  # who saved this version; NULL if unknown
+    edited_at = db.Column(db.DateTime, nullable=True)  # when this version was saved
+    replaced_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # 歷史查詢與修剪都依 (password_id, id) 掃描，不影響 user_password 本身的查詢
+        db.Index('ix_password_history_entry', 'password_id', 'id'),
+    )
+
+# A file attached to an entry (attachments.py). The client encrypts the file
+# before upload; the server only sees ciphertext split into chunks.
+class Attachment(db.Model):
+    __tablename__ = 'attachment'
+    id = db.Column(db.Integer, primary_key=True)
+    password_id = db.Column(db.Integer, db.ForeignKey('user_password.id', ondelete="CASCADE"), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)  # may itself be encrypted by the client
+    content_type = db.Column(db.String(120), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)  # total bytes declared when the upload started
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)  # optional digest of the whole file, checked on completion
+    status = db.Column(db.String(16), nullable=False, default='uploading')  # uploading / complete
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="SET NULL"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+# One chunk of an attachment. The bytes live on disk under their SHA-256, so
+# identical chunks are stored once; unreferenced files are removed by the
+# attachment collector.
+class AttachmentChunk(db.Model):
+    __tablename__ = 'attachment_chunk'
+    attachment_id = db.Column(db.Integer, db.ForeignKey('attachment.id', ondelete="CASCADE"), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
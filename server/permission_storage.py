@@ -1,11 +1,57 @@
 # server/permission_storage.py
 
-from flask import Blueprint, request, jsonify
+import math
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, UserPassword, PasswordAccess, GroupMembership, PermissionEnum, User, Group
+from sqlalchemy import and_, or_
+from models import db, UserPassword, PasswordAccess, GroupMembership, GroupClosure, PermissionEnum, User, Group
+from request_context import get_password_entry, get_group_memberships, get_user
+from audit import record as audit
+from envelope_keys import set_wrapped_key, delete_wrapped_key, wrapped_keys_for, wrapped_key_error
+import events
+import acl_index
+from trash import soft_delete
+import history  # 模組匯入：history 也匯入本模組，兩者誰先載入都可以
+from limits import field_error
 
 permission_storage = Blueprint('permission_storage', __name__)
 
+def parse_expiry(data):
+    """
+    Reads a grant expiry from a request body: expires_at (ISO 8601, UTC if no
+    offset) or expires_in_hours. Returns (expires_at or None, error message or None).
+    """
+    now = datetime.utcnow()
+    if data.get('expires_in_hours') is not None:
+        try:
+            hours = float(data['expires_in_hours'])
+        except (TypeError, ValueError):
+            return None, "expires_in_hours must be a number"
+        if not math.isfinite(hours):
+            return None, "expires_in_hours must be a finite number"
+        try:
+            expires_at = now + timedelta(hours=hours)
+        except (OverflowError, ValueError):
+            # 超出 datetime 可表示的範圍（例如 1e308）
+            return None, "expires_in_hours is out of range"
+    elif data.get('expires_at') is not None:
+        try:
+            expires_at = datetime.fromisoformat(str(data['expires_at']).replace('Z', '+00:00'))
+        except ValueError:
+            return None, "expires_at must be an ISO 8601 timestamp"
+        if expires_at.tzinfo is not None:
+            expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        return None, None
+
+    if expires_at <= now:
+        return None, "Expiry must be in the future"
+    max_ttl = current_app.config.get('GRANT_MAX_TTL')
+    if max_ttl and expires_at > now + max_ttl:
+        return None, f"Expiry can be at most {max_ttl.total_seconds() / 3600:g} hours away"
+    return expires_at, None
+
 def get_user_permission(user_id, password_id):
     permission_order = {
         "READ": 1,
@@ -14,37 +60,55 @@ def get_user_permission(user_id, password_id):
     }
     highest_perm_found = None
 
-    password_entry = UserPassword.query.get(password_id)
-    if password_entry and password_entry.user_id == user_id:
-        return PermissionEnum.DELETE
-
-    direct_access = PasswordAccess.query.filter_by(
-        user_id=user_id,
-        password_id=password_id,
-        group_id=None
-    ).first()
-    if direct_access:
-        highest_perm_found = direct_access.permission
+    # 啟用 ACL_INDEX_ENABLED 時先查記憶體索引，索引無法回答時才查資料庫
+    indexed = acl_index.lookup(user_id, password_id)
+    if indexed is not acl_index.MISS:
+        return indexed
 
-    group_memberships = GroupMembership.query.filter_by(user_id=user_id).all()
-    group_ids = [gm.group_id for gm in group_memberships]
-    membership_perms = {gm.group_id: gm.permission for gm in group_memberships}
+    password_entry = get_password_entry(password_id)
+    if not password_entry:
+        return None  # 不存在或已在垃圾桶中
+    if password_entry.user_id == user_id:
+        return PermissionEnum.DELETE
 
-    group_accesses = PasswordAccess.query.filter(
-        PasswordAccess.group_id.in_(group_ids),
+    membership_perms = get_group_memberships(user_id)
+
+    # 直接授權與群組授權一次查出；群組授權經 group_closure 展開巢狀群組
+    query = db.session.query(PasswordAccess.group_id, PasswordAccess.permission)
+    access_filter = and_(PasswordAccess.user_id == user_id, PasswordAccess.group_id.is_(None))
+    if membership_perms:
+        query = db.session.query(
+            PasswordAccess.group_id, PasswordAccess.permission,
+            GroupClosure.descendant_id, GroupClosure.permission
+        ).outerjoin(GroupClosure, and_(
+            GroupClosure.ancestor_id == PasswordAccess.group_id,
+            GroupClosure.descendant_id.in_(list(membership_perms))
+        ))
+        access_filter = or_(access_filter, and_(
+            PasswordAccess.user_id.is_(None),
+            GroupClosure.descendant_id.isnot(None)
+        ))
+    accesses = query.filter(
         PasswordAccess.password_id == password_id,
-        PasswordAccess.user_id.is_(None)
+        access_filter,
+        PasswordAccess.active()  # 已過期但尚未被清除的授權不算
     ).all()
 
-    for entry in group_accesses:
-        gm_perm = membership_perms.get(entry.group_id)
-        if gm_perm:
+    for group_id, permission, *via in accesses:
+        if group_id is None:
+            effective = permission
+        else:
+            # via = (使用者所屬的群組, 該群組到授權群組的巢狀權限)
+            member_group_id, nesting_perm = via
+            gm_perm = membership_perms.get(member_group_id)
+            if not gm_perm:
+                continue
             effective = min(
-                [entry.permission, gm_perm],
+                [permission, nesting_perm, gm_perm],
                 key=lambda p: permission_order[p.value]
             )
-            if not highest_perm_found or permission_order[effective.value] > permission_order[highest_perm_found.value]:
-                highest_perm_found = effective
+        if not highest_perm_found or permission_order[effective.value] > permission_order[highest_perm_found.value]:
+            highest_perm_found = effective
 
     return highest_perm_found
 
@@ -58,17 +122,21 @@ def get_protected_password(password_id):
     if not perm:
         return jsonify({"msg": "Access denied"}), 403
 
-    password = UserPassword.query.get(password_id)
+    password = get_password_entry(password_id)
     if not password:
         return jsonify({"msg": "Password not found"}), 404
 
+    audit('entry.read', user_id=user_id, password_id=password_id)
+    key = wrapped_keys_for(user_id, [password_id]).get(password_id, {})
     return jsonify({
         'id': password.id,
         'site': password.site,
         'encrypted_data': password.encrypted_data,
         'iv': password.iv,
         'notes': password.notes,
-        'owner_id': password.user_id
+        'owner_id': password.user_id,
+        'wrapped_key': key.get('wrapped_key'),
+        'key_group_id': key.get('group_id')
     })
 
 @permission_storage.route('/api/storage/<int:password_id>', methods=['PUT'])
@@ -81,16 +149,23 @@ def update_protected_password(password_id):
         return jsonify({"msg": "Write permission required"}), 403
 
     data = request.get_json()
-    password = UserPassword.query.get(password_id)
+    error = field_error(data)
+    if error:
+        return error
+    password = get_password_entry(password_id)
     if not password:
         return jsonify({"msg": "Password not found"}), 404
 
+    history.record_version(password)  # 覆寫前保存舊版本，與更新在同一個交易提交
     password.site = data.get("site", password.site)
     password.encrypted_data = data.get("encrypted_data", password.encrypted_data)
     password.iv = data.get("iv", password.iv)
     password.notes = data.get("notes", password.notes)
+    password.updated_by = user_id
 
     db.session.commit()
+    audit('entry.update', user_id=user_id, password_id=password_id)
+    events.notify(events.ENTRY_CHANGED, events.password_audience(password_id), action='updated', password_id=password_id)
     return jsonify({"msg": "Password updated successfully"}), 200
 
 @permission_storage.route('/api/storage/<int:password_id>', methods=['DELETE'])
@@ -102,14 +177,16 @@ def delete_protected_password(password_id):
     if perm != PermissionEnum.DELETE:
         return jsonify({"msg": "Delete permission required"}), 403
 
-    password = UserPassword.query.get(password_id)
+    password = get_password_entry(password_id)
     if not password:
         return jsonify({"msg": "Password not found"}), 404
 
     try:
-        db.session.delete(password)
-        db.session.commit()
-        return jsonify({"msg": "Password deleted successfully"}), 200
+        # 只移到垃圾桶；真正的刪除由 trash.py 的背景工作分批進行
+        soft_delete(password, user_id)
+        audit('entry.delete', user_id=user_id, password_id=password_id)
+        events.notify(events.ENTRY_CHANGED, events.password_audience(password_id), action='deleted', password_id=password_id)
+        return jsonify({"msg": "Password deleted successfully", "trashed": True}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": "Failed to delete password", "error": str(e)}), 500
@@ -119,6 +196,9 @@ def delete_protected_password(password_id):
 def grant_permission():
     current_user_id = int(get_jwt_identity())
     data = request.get_json()
+    error = field_error(data) or wrapped_key_error(data)
+    if error:
+        return error
 
     password_id = data.get('password_id')
     target_user_id = data.get('user_id')
@@ -132,7 +212,7 @@ def grant_permission():
     if target_user_id and target_group_id:
         return jsonify({"msg": "Cannot grant to both user and group simultaneously"}), 400
 
-    password = UserPassword.query.get(password_id)
+    password = get_password_entry(password_id)
     if not password or password.user_id != current_user_id:
         return jsonify({"msg": "You do not own this password or it does not exist"}), 403
 
@@ -140,6 +220,9 @@ def grant_permission():
         permission_enum = PermissionEnum(permission_str.upper())
     except ValueError:
         return jsonify({"msg": "Invalid permission type"}), 400
+    expires_at, expiry_error = parse_expiry(data)
+    if expiry_error:
+        return jsonify({"msg": expiry_error}), 400
 
     existing_access = None
     if target_user_id:
@@ -151,19 +234,40 @@ def grant_permission():
             password_id=password_id, group_id=target_group_id, user_id=None
         ).first()
 
-    if existing_access:
+    if existing_access and existing_access.is_active():
         return jsonify({"msg": "Permission already exists for this target. Use PATCH /permission/update to change it."}), 409
 
-    new_access = PasswordAccess(
-    password_id=password_id,
-    user_id=target_user_id if target_user_id else None,
-    group_id=target_group_id if target_group_id else None,
-    permission=permission_enum
-)
-
-    db.session.add(new_access)
+    if existing_access:
+        # 已過期、尚未被背景工作清除的授權：直接沿用該列
+        new_access = existing_access
+        new_access.permission = permission_enum
+        new_access.expires_at = expires_at
+        new_access.created_at = datetime.utcnow()
+    else:
+        new_access = PasswordAccess(
+        password_id=password_id,
+        user_id=target_user_id if target_user_id else None,
+        group_id=target_group_id if target_group_id else None,
+        permission=permission_enum,
+        expires_at=expires_at
+    )
+        db.session.add(new_access)
+    if data.get('wrapped_key'):
+        # 分享只需新增一把以目標公鑰（或群組公鑰）包裝的資料金鑰，不必重新加密條目
+        set_wrapped_key(password_id, data['wrapped_key'], user_id=new_access.user_id, group_id=new_access.group_id)
     db.session.commit()
-    return jsonify({"msg": "Permission granted successfully", "access_id": new_access.id}), 201
+    acl_index.grant_set(new_access.password_id, new_access.user_id, new_access.group_id, permission_enum, expires_at)
+    audit('grant.add', user_id=current_user_id, password_id=password_id,
+          target_user_id=new_access.user_id, group_id=new_access.group_id, permission=permission_enum.value,
+          expires_at=expires_at.isoformat() if expires_at else None)
+    events.notify(events.GRANT_ADDED, events.grant_audience(current_user_id, new_access.user_id, new_access.group_id),
+                  password_id=password_id, user_id=new_access.user_id, group_id=new_access.group_id,
+                  permission=permission_enum.value)
+    return jsonify({
+        "msg": "Permission granted successfully",
+        "access_id": new_access.id,
+        "expires_at": expires_at.isoformat() if expires_at else None
+    }), 201
 
 @permission_storage.route('/permission/revoke', methods=['DELETE'])
 @jwt_required()
@@ -182,7 +286,7 @@ def revoke_permission():
     if target_user_id and target_group_id:
         return jsonify({"msg": "Cannot revoke from both user and group simultaneously"}), 400
 
-    password = UserPassword.query.get(password_id)
+    password = get_password_entry(password_id)
     if not password or password.user_id != current_user_id:
         return jsonify({"msg": "You do not own this password or it does not exist"}), 403
 
@@ -199,8 +303,15 @@ def revoke_permission():
     if not access_to_revoke:
         return jsonify({"msg": "Permission not found"}), 404
 
+    revoked = (access_to_revoke.password_id, access_to_revoke.user_id, access_to_revoke.group_id)
     db.session.delete(access_to_revoke)
+    delete_wrapped_key(password_id, user_id=access_to_revoke.user_id, group_id=access_to_revoke.group_id)
     db.session.commit()
+    acl_index.grant_removed(*revoked)
+    audit('grant.revoke', user_id=current_user_id, password_id=password_id,
+          target_user_id=target_user_id or None, group_id=target_group_id or None)
+    events.notify(events.GRANT_REVOKED, events.grant_audience(current_user_id, target_user_id, target_group_id),
+                  password_id=password_id, user_id=target_user_id or None, group_id=target_group_id or None)
     return jsonify({"msg": "Permission revoked successfully"}), 200
 
 @permission_storage.route('/permission/password/<int:password_id>', methods=['GET'])
@@ -208,20 +319,24 @@ def revoke_permission():
 def get_password_permissions(password_id):
     current_user_id = int(get_jwt_identity())
 
-    password = UserPassword.query.get(password_id)
+    password = get_password_entry(password_id)
     if not password or password.user_id != current_user_id:
         return jsonify({"msg": "You do not own this password or it does not exist"}), 403
 
-    access_entries = PasswordAccess.query.filter_by(password_id=password_id).all()
+    access_entries = PasswordAccess.query.filter(
+        PasswordAccess.password_id == password_id,
+        PasswordAccess.active()
+    ).all()
     permissions_list = []
     for entry in access_entries:
         entry_data = {
             "id": entry.id,
             "password_id": entry.password_id,
-            "permission": entry.permission.value
+            "permission": entry.permission.value,
+            "expires_at": entry.expires_at.isoformat() if entry.expires_at else None
         }
         if entry.user_id:
-            user = User.query.get(entry.user_id)
+            user = get_user(entry.user_id)
             entry_data["target_type"] = "user"
             entry_data["target_id"] = entry.user_id
             entry_data["target_email"] = user.email if user else "Unknown User"
@@ -240,12 +355,14 @@ def update_permission(access_id):
     current_user_id = int(get_jwt_identity())
     data = request.get_json()
     new_permission_str = data.get('permission')
+    # expires_at / expires_in_hours 可單獨更新；明確傳入 "expires_at": null 表示改為永久
+    change_expiry = 'expires_at' in data or 'expires_in_hours' in data
 
-    if not new_permission_str:
+    if not new_permission_str and not change_expiry:
         return jsonify({"msg": "New permission is required"}), 400
 
     access_entry = PasswordAccess.query.get(access_id)
-    if not access_entry:
+    if not access_entry or not access_entry.is_active():
         return jsonify({"msg": "Permission entry not found"}), 404
 
     password = UserPassword.query.get(access_entry.password_id)
@@ -253,10 +370,27 @@ def update_permission(access_id):
         return jsonify({"msg": "You do not own the password associated with this permission"}), 403
 
     try:
-        new_permission_enum = PermissionEnum(new_permission_str.upper())
+        new_permission_enum = PermissionEnum(new_permission_str.upper()) if new_permission_str else access_entry.permission
     except ValueError:
         return jsonify({"msg": "Invalid permission type"}), 400
+    if change_expiry:
+        expires_at, expiry_error = parse_expiry(data)
+        if expiry_error:
+            return jsonify({"msg": expiry_error}), 400
+        access_entry.expires_at = expires_at
 
     access_entry.permission = new_permission_enum
     db.session.commit()
-    return jsonify({"msg": "Permission updated successfully", "new_permission": new_permission_enum.value}), 200
+    acl_index.grant_set(access_entry.password_id, access_entry.user_id, access_entry.group_id, new_permission_enum,
+                        access_entry.expires_at)
+    audit('grant.update', user_id=current_user_id, password_id=access_entry.password_id,
+          target_user_id=access_entry.user_id, group_id=access_entry.group_id, permission=new_permission_enum.value,
+          expires_at=access_entry.expires_at.isoformat() if access_entry.expires_at else None)
+    events.notify(events.GRANT_CHANGED, events.grant_audience(current_user_id, access_entry.user_id, access_entry.group_id),
+                  password_id=access_entry.password_id, user_id=access_entry.user_id, group_id=access_entry.group_id,
+                  permission=new_permission_enum.value)
+    return jsonify({
+        "msg": "Permission updated successfully",
+        "new_permission": new_permission_enum.value,
+        "expires_at": access_entry.expires_at.isoformat() if access_entry.expires_at else None
+    }), 200
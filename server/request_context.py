@@ -0,0 +1,77 @@
+"""
+server/request_context.py
+
+request-scoped memoization on flask.g
+
+A single request often needs the same rows several times: a route loads the
+password entry, then get_user_permission loads it again together with the
+caller's group memberships. These helpers cache those lookups on flask.g so
+each row is fetched at most once per request. Outside an app context (scripts,
+benchmarks) they simply query every time.
+"""
+
+from flask import g, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from models import db, User, UserPassword, GroupMembership
+
+def _cache(name):
+    if not has_app_context():
+        return None
+    cache = g.get(name)
+    if cache is None:
+        cache = {}
+        setattr(g, name, cache)
+    return cache
+
+def current_user():
+    return get_user(int(get_jwt_identity()))
+
+def get_user(user_id):
+    cache = _cache('_ctx_users')
+    if cache is None:
+        return db.session.get(User, user_id)
+    if user_id not in cache:
+        cache[user_id] = db.session.get(User, user_id)
+    return cache[user_id]
+
+def _live_entry(password_id):
+    entry = db.session.get(UserPassword, password_id)
+    # 已移到垃圾桶的條目視為不存在（trash.py）
+    return entry if entry is not None and entry.deleted_at is None else None
+
+def get_password_entry(password_id):
+    cache = _cache('_ctx_passwords')
+    if cache is None:
+        return _live_entry(password_id)
+    if password_id not in cache:
+        cache[password_id] = _live_entry(password_id)
+    return cache[password_id]
+
+def get_group_memberships(user_id):
+    """回傳 {group_id: PermissionEnum}，為該用戶所屬的群組與其成員權限"""
+    cache = _cache('_ctx_memberships')
+    if cache is not None and user_id in cache:
+        return cache[user_id]
+
+    rows = db.session.query(GroupMembership.group_id, GroupMembership.permission).filter_by(
+        user_id=user_id
+    ).all()
+    memberships = {group_id: permission for group_id, permission in rows}
+    if cache is not None:
+        cache[user_id] = memberships
+    return memberships
+
+def invalidate(password_id=None, user_id=None):
+    """在同一請求中修改資料後呼叫，丟棄對應的快取"""
+    if not has_app_context():
+        return
+    passwords = g.get('_ctx_passwords')
+    memberships = g.get('_ctx_memberships')
+    if password_id is None and user_id is None:
+        g.pop('_ctx_passwords', None)
+        g.pop('_ctx_memberships', None)
+        return
+    if password_id is not None and passwords is not None:
+        passwords.pop(password_id, None)
+    if user_id is not None and memberships is not None:
+        memberships.pop(user_id, None)
@@ -1,5 +1,9 @@
 # reset_db.py
-from app import app, db
+from app import create_app
+from models import db
+
+# 只需要資料庫：不載入路由與背景工作
+app = create_app(components=())
 
 with app.app_context():
     db.drop_all()
@@ -0,0 +1,70 @@
+# server/schema.py
+"""
+Small in-place upgrades for existing databases.
+
+db.create_all() creates missing tables but never alters existing ones. When a
+model gains a nullable column, upgrade_schema() adds it with ALTER TABLE ADD
+COLUMN and then creates any declared index that is still missing. Changes
+that need a real migration (new NOT NULL columns, type changes) are not
+handled here.
+
+prepare_database() is the startup step create_app() runs (SCHEMA_AUTO_UPGRADE):
+create missing tables, upgrade every bind, and backfill the nested-group
+closure. Every step is idempotent, so it is safe on every start.
+"""
+
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from models import db
+
+def upgrade_schema(bind_key=None):
+    """Adds missing nullable columns and indexes; returns the list of changes made."""
+    engine = db.engines[bind_key]
+    existing_tables = set(inspect(engine).get_table_names())
+    changes = []
+
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in db.metadata.sorted_tables:
+            if table.info.get('bind_key') != bind_key or table.name not in existing_tables:
+                continue
+            columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} in place")
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                changes.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+    return changes
+
+def prepare_database(attempts=3):
+    """Creates missing tables and upgrades existing ones; call inside an app context. Returns the changes made."""
+    for attempt in range(attempts):
+        try:
+            return _prepare_database()
+        except OperationalError:
+            # 多個 worker 同時啟動時可能互相搶先建立同一個表或索引，稍後重試即可
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
+
+def _prepare_database():
+    from models import Group, GroupClosure
+    from group_closure import rebuild_closure
+
+    db.create_all()
+    changes = []
+    for bind_key in db.engines:
+        changes += upgrade_schema(bind_key)
+    # 補上舊資料庫缺少的巢狀群組 closure 資料
+    if db.session.query(GroupClosure).count() < db.session.query(Group).count():
+        rebuild_closure()
+        db.session.commit()
+        changes.append("group_closure")
+    return changes
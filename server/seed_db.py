@@ -0,0 +1,206 @@
+# seed_db.py
+"""
+Populate vault.db with synthetic data for scale testing.
+
+Generates users, a skewed (Pareto) distribution of vault sizes, groups with
+power-law membership, and direct and group PasswordAccess grants with random
+ciphertext blobs. Rows are written with Core executemany inserts in large
+batches on a single connection, so millions of rows take minutes.
+
+Every seeded user shares the login key SEED_LOGIN_KEY, so the load test and
+benchmarks can log in as any of them.
+
+Usage:
+    python seed_db.py --users 10000 --groups 500 --mean-vault 40
+    python seed_db.py --users 100000 --reset --seed 7
+"""
+
+import argparse
+import base64
+import random
+import time
+from datetime import datetime
+from sqlalchemy import func, insert, text
+from argon2 import PasswordHasher
+from app import create_app
+from models import db, User, UserPassword, Group, GroupMembership, GroupClosure, PasswordAccess, PermissionEnum
+
+SEED_LOGIN_KEY = "seedloginkey"
+PERMISSIONS = [PermissionEnum.READ, PermissionEnum.WRITE, PermissionEnum.DELETE]
+PERMISSION_WEIGHTS = [70, 25, 5]
+
+
+class BatchWriter:
+    """Buffers rows per table and flushes them with executemany."""
+
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, table, row):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        tables = [table] if table is not None else list(self.buffers)
+        for t in tables:
+            rows = self.buffers.get(t)
+            if rows:
+                self.connection.execute(insert(t), rows)
+                self.counts[t.name] = self.counts.get(t.name, 0) + len(rows)
+                rows.clear()
+
+
+def next_id(connection, model):
+    return (connection.execute(db.select(func.max(model.id))).scalar() or 0) + 1
+
+
+def vault_size(rng, mean, cap):
+    # Pareto(alpha=1.5) 的平均值為 3，縮放到指定平均值
+    return min(cap, int(rng.paretovariate(1.5) * mean / 3))
+
+
+def random_blob(rng, min_len, max_len):
+    return base64.b64encode(rng.randbytes(rng.randint(min_len, max_len))).decode("utf-8")
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    password_hash = PasswordHasher().hash(SEED_LOGIN_KEY)
+
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == "sqlite":
+            # 只用於產生測試資料：關閉同步寫入以加快批次插入
+            connection.execute(text("PRAGMA synchronous=OFF"))
+            connection.execute(text("PRAGMA journal_mode=MEMORY"))
+            # 批次可能不依外鍵順序寫入，產生資料期間不檢查外鍵
+            connection.execute(text("PRAGMA foreign_keys=OFF"))
+
+        writer = BatchWriter(connection, args.batch_size)
+        start = time.perf_counter()
+
+        # 1. 用戶
+        first_user = next_id(connection, User)
+        user_ids = list(range(first_user, first_user + args.users))
+        for user_id in user_ids:
+            writer.add(User.__table__, {
+                "id": user_id,
+                "email": f"seed{user_id}@example.com",
+                "password_hash": password_hash,
+                "data_salt": base64.b64encode(rng.randbytes(32)).decode("utf-8"),
+                "login_count": 1,
+                "created_at": now,
+                "updated_at": now,
+            })
+        writer.flush()
+
+        # 2. 群組：成員數服從冪次分佈（少數大群組、大量小群組）
+        first_group = next_id(connection, Group)
+        group_ids = list(range(first_group, first_group + args.groups))
+        group_sizes = {}
+        for group_id in group_ids:
+            size = max(2, min(args.users, int(rng.paretovariate(args.group_alpha) * 2)))
+            members = rng.sample(user_ids, size)
+            group_sizes[group_id] = size
+            writer.add(Group.__table__, {
+                "id": group_id,
+                "name": f"seed-group-{group_id}",
+                "description": "synthetic group",
+                "manager_id": members[0],
+                "created_at": now,
+            })
+            writer.add(GroupClosure.__table__, {
+                "ancestor_id": group_id,
+                "descendant_id": group_id,
+                "permission": PermissionEnum.DELETE,
+            })
+            for user_id in members:
+                writer.add(GroupMembership.__table__, {
+                    "user_id": user_id,
+                    "group_id": group_id,
+                    "permission": rng.choices(PERMISSIONS, PERMISSION_WEIGHTS)[0],
+                    "created_at": now,
+                })
+        writer.flush()
+
+        # 大群組被分享的機率較高
+        group_weights = [group_sizes[g] for g in group_ids]
+
+        # 3. 密碼條目與授權
+        password_id = next_id(connection, UserPassword)
+        for user_id in user_ids:
+            for _ in range(vault_size(rng, args.mean_vault, args.max_vault)):
+                writer.add(UserPassword.__table__, {
+                    "id": password_id,
+                    "user_id": user_id,
+                    "site": f"site{rng.randint(0, 99999)}.example.com",
+                    "encrypted_data": random_blob(rng, 48, 512),
+                    "iv": base64.b64encode(rng.randbytes(12)).decode("utf-8"),
+                    "notes": random_blob(rng, 16, 128) if rng.random() < 0.3 else None,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+
+                if rng.random() < args.direct_share_ratio:
+                    targets = set(rng.sample(user_ids, min(len(user_ids), rng.randint(1, args.max_direct_grants))))
+                    targets.discard(user_id)
+                    for target in targets:
+                        writer.add(PasswordAccess.__table__, {
+                            "user_id": target,
+                            "group_id": None,
+                            "password_id": password_id,
+                            "permission": rng.choices(PERMISSIONS, PERMISSION_WEIGHTS)[0],
+                            "created_at": now,
+                        })
+
+                if group_ids and rng.random() < args.group_share_ratio:
+                    for group_id in set(rng.choices(group_ids, group_weights, k=rng.randint(1, 3))):
+                        writer.add(PasswordAccess.__table__, {
+                            "user_id": None,
+                            "group_id": group_id,
+                            "password_id": password_id,
+                            "permission": rng.choices(PERMISSIONS, PERMISSION_WEIGHTS)[0],
+                            "created_at": now,
+                        })
+                password_id += 1
+        writer.flush()
+
+        elapsed = time.perf_counter() - start
+
+    total = sum(writer.counts.values())
+    for table, count in writer.counts.items():
+        print(f"  {table}: {count} rows")
+    print(f"Inserted {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    print(f"All seeded users log in with login_key '{SEED_LOGIN_KEY}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic users, vaults, groups and grants")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--mean-vault", type=float, default=30, help="average entries per user")
+    parser.add_argument("--max-vault", type=int, default=5000, help="cap on entries per user")
+    parser.add_argument("--group-alpha", type=float, default=1.2, help="Pareto shape for group sizes")
+    parser.add_argument("--direct-share-ratio", type=float, default=0.1)
+    parser.add_argument("--max-direct-grants", type=int, default=5)
+    parser.add_argument("--group-share-ratio", type=float, default=0.15)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    args = parser.parse_args()
+
+    app = create_app(components=())
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        seed(args)
+
+
+if __name__ == "__main__":
+    main()
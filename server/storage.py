@@ -2,14 +2,19 @@
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from models import db, UserPassword, PermissionEnum # Removed Group, GroupMembership, PasswordAccess as they are not directly used in this module's routes
 # Import the centralized permission checker
 from permission_storage import get_user_permission # <-- IMPORT THIS!
+from request_context import get_password_entry
+from audit import record as audit
+from envelope_keys import set_wrapped_key, wrapped_key_error
+import events
+import acl_index
+from trash import soft_delete
+from history import record_version
+from limits import field_error
 
 storage = Blueprint('storage', __name__)
-ph = PasswordHasher()
 
 # Remove the has_password_permission helper function here, it's now centralized in permission_storage.py
 
@@ -18,6 +23,9 @@ ph = PasswordHasher()
 @jwt_required()
 def store_password():
     data = request.get_json()
+    error = field_error(data) or wrapped_key_error(data)
+    if error:
+        return error
     current_user_id = int(get_jwt_identity())
 
     site = data.get('site')
@@ -37,11 +45,19 @@ def store_password():
         site=site,
         encrypted_data=encrypted_data,
         iv=iv,
-        notes=notes
+        notes=notes,
+        updated_by=current_user_id
     )
 
     db.session.add(new_entry)
+    if data.get('wrapped_key'):
+        # 條目使用獨立資料金鑰時，同時保存以擁有者公鑰包裝的金鑰
+        db.session.flush()
+        set_wrapped_key(new_entry.id, data['wrapped_key'], user_id=current_user_id)
     db.session.commit()
+    acl_index.entry_created(new_entry.id, current_user_id)
+    audit('entry.create', user_id=current_user_id, password_id=new_entry.id)
+    events.notify(events.ENTRY_CHANGED, [current_user_id], action='created', password_id=new_entry.id)
 
     return jsonify({"msg": "Password stored successfully", "password_id": new_entry.id}), 201
 
@@ -50,9 +66,12 @@ def store_password():
 @jwt_required()
 def update_password(password_id):
     data = request.get_json()
+    error = field_error(data)
+    if error:
+        return error
     current_user_id = int(get_jwt_identity())
 
-    password_entry = UserPassword.query.get(password_id) # Use .get()
+    password_entry = get_password_entry(password_id) # memoized for get_user_permission
     if not password_entry:
         return jsonify({"msg": "Password not found"}), 404
 
@@ -73,12 +92,16 @@ def update_password(password_id):
         if not iv: missing_fields.append('iv')
         return jsonify({"msg": f"Missing required fields: {', '.join(missing_fields)}"}), 400
 
+    record_version(password_entry) # 覆寫前保存舊版本，與更新在同一個交易提交
     password_entry.site = site
     password_entry.encrypted_data = encrypted_data
     password_entry.iv = iv
     password_entry.notes = notes
+    password_entry.updated_by = current_user_id
 
     db.session.commit()
+    audit('entry.update', user_id=current_user_id, password_id=password_id)
+    events.notify(events.ENTRY_CHANGED, events.password_audience(password_id), action='updated', password_id=password_id)
     return jsonify({"msg": "Password updated successfully"}), 200
 
 # DELETE /storage/<password_id>
@@ -87,7 +110,7 @@ def update_password(password_id):
 def delete_password(password_id):
     current_user_id = int(get_jwt_identity())
 
-    password_entry = UserPassword.query.get(password_id) # Use .get()
+    password_entry = get_password_entry(password_id) # memoized for get_user_permission
     if not password_entry:
         return jsonify({"msg": "Password not found"}), 404
 
@@ -97,11 +120,11 @@ def delete_password(password_id):
         return jsonify({"msg": "You don't have permission to delete this password"}), 403
 
     try:
-        # Cascade delete is handled by PasswordAccess model, but explicit delete is fine too.
-        # PasswordAccess.query.filter_by(password_id=password_id).delete() # This is now handled by permission_storage delete route
-        db.session.delete(password_entry)
-        db.session.commit()
-        return jsonify({"msg": "Password deleted successfully"}), 200
+        # 只移到垃圾桶（設定 deleted_at），授權保留到背景清除時才隨條目一併刪除
+        soft_delete(password_entry, current_user_id)
+        audit('entry.delete', user_id=current_user_id, password_id=password_id)
+        events.notify(events.ENTRY_CHANGED, events.password_audience(password_id), action='deleted', password_id=password_id)
+        return jsonify({"msg": "Password deleted successfully", "trashed": True}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"msg": "Failed to delete password", "error": str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,61 @@
+# server/tests/conftest.py
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+# 伺服器模組以平坦的方式互相匯入（from models import ...）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db
+
+# 不啟動背景工作，測試只量測請求本身
+TEST_CONFIG = {
+    'TESTING': True,
+    'JWT_SECRET_KEY': 'test-secret-key-with-at-least-32-bytes',
+    'TRASH_PURGE_INTERVAL': 0,
+    'HISTORY_PRUNE_INTERVAL': 0,
+    'ATTACHMENT_GC_INTERVAL': 0,
+    'GRANT_SWEEP_INTERVAL': 0,
+}
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        **TEST_CONFIG,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'vault.db'}",
+        'SQLALCHEMY_BINDS': {'audit': f"sqlite:///{tmp_path / 'audit.db'}"},
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+        'ATTACHMENT_DIR': str(tmp_path / 'attachments'),
+    }, components=('auth', 'storage', 'permission_storage', 'groups', 'history'))
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def statements(app):
+    """List of SQL statements run on vault.db; clear() it right before the call being measured."""
+    executed = []
+    with app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+def register(client, email):
+    client.post('/register', json={'email': email, 'login_key': 'key'})
+    response = client.post('/login', json={'email': email, 'login_key': 'key'})
+    return {'Authorization': 'Bearer ' + response.json['token']}, response.json['user_id']
@@ -0,0 +1,63 @@
+# server/tests/test_group_delete.py
+import time
+
+from sqlalchemy import insert
+
+from conftest import register
+from models import db, User, UserPassword, PasswordAccess, Group, GroupMembership, GroupNesting, GroupClosure, \
+    PermissionEnum
+
+GRANTS = 10000
+MEMBERS = 500
+MAX_STATEMENTS = 15
+MAX_SECONDS = 2.0
+
+def test_delete_group_with_10k_grants(app, client, statements):
+    manager, manager_id = register(client, 'manager@example.com')
+    # 1 -> 2 -> 3：刪除中間的群組時，1 到 3 的 closure 路徑也要一併移除
+    group_ids = [client.post('/groups', json={'name': f'g{i}'}, headers=manager).json['group_id'] for i in range(3)]
+    top, middle, bottom = group_ids
+    client.post(f'/groups/{top}/subgroups', json={'group_id': middle, 'permission': 'write'}, headers=manager)
+    client.post(f'/groups/{middle}/subgroups', json={'group_id': bottom, 'permission': 'read'}, headers=manager)
+
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"id": uid, "email": f"member{uid}@example.com", "password_hash": "x", "login_count": 0}
+            for uid in range(100, 100 + MEMBERS)
+        ])
+        db.session.execute(insert(GroupMembership), [
+            {"user_id": uid, "group_id": middle, "permission": PermissionEnum.READ}
+            for uid in range(100, 100 + MEMBERS)
+        ])
+        db.session.execute(insert(UserPassword), [
+            {"id": pid, "user_id": manager_id, "site": "s", "encrypted_data": "e", "iv": "i"}
+            for pid in range(1, GRANTS + 1)
+        ])
+        db.session.execute(insert(PasswordAccess), [
+            {"user_id": None, "group_id": middle, "password_id": pid, "permission": PermissionEnum.READ}
+            for pid in range(1, GRANTS + 1)
+        ])
+        db.session.commit()
+        assert db.session.query(GroupClosure).filter_by(ancestor_id=top, descendant_id=bottom).count() == 1
+
+    statements.clear()
+    start = time.perf_counter()
+    response = client.delete(f'/groups/{middle}', headers=manager)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+
+    # 以集合操作刪除：語句數與授權數量無關
+    assert len(statements) <= MAX_STATEMENTS, statements
+    assert elapsed < MAX_SECONDS
+
+    with app.app_context():
+        assert db.session.get(Group, middle) is None
+        assert PasswordAccess.query.filter_by(group_id=middle).count() == 0
+        assert GroupMembership.query.filter_by(group_id=middle).count() == 0
+        assert GroupNesting.query.filter(
+            (GroupNesting.parent_group_id == middle) | (GroupNesting.child_group_id == middle)).count() == 0
+        assert GroupClosure.query.filter(
+            (GroupClosure.ancestor_id == middle) | (GroupClosure.descendant_id == middle)).count() == 0
+        assert GroupClosure.query.filter_by(ancestor_id=top, descendant_id=bottom).count() == 0
+        # 條目本身不受影響
+        assert UserPassword.query.count() == GRANTS
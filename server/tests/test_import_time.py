@@ -0,0 +1,12 @@
+# server/tests/test_import_time.py
+import statistics
+
+from benchmark import IMPORT_BUDGET_MS, probe_cold_start
+
+RUNS = 3
+
+def test_cold_start_within_budget():
+    # 每次都在新的直譯器中 import app 並呼叫 create_app()，取中位數降低雜訊
+    runs = [probe_cold_start() for _ in range(RUNS)]
+    total_ms = statistics.median(r["import_ms"] + r["create_ms"] for r in runs)
+    assert total_ms <= IMPORT_BUDGET_MS, f"cold start {total_ms:.0f} ms exceeds the {IMPORT_BUDGET_MS} ms budget"
@@ -0,0 +1,43 @@
+# server/tests/test_request_context.py
+from conftest import register
+
+def _shared_entry(client):
+    """An entry owned by one user and shared WRITE with a group whose member is returned."""
+    owner, _ = register(client, 'owner@example.com')
+    member, member_id = register(client, 'member@example.com')
+    password_id = client.post('/storage', json={'site': 's', 'encrypted_data': 'e', 'iv': 'i'},
+                              headers=owner).json['password_id']
+    group_id = client.post('/groups', json={'name': 'team'}, headers=owner).json['group_id']
+    client.post(f'/groups/{group_id}/members', json={'user_id': member_id, 'permission': 'write'}, headers=owner)
+    client.post('/permission/grant', json={'password_id': password_id, 'group_id': group_id, 'permission': 'write'},
+                headers=owner)
+    return member, password_id
+
+def _selects_from(statements, table):
+    return [s for s in statements if s.lstrip().upper().startswith('SELECT') and f'FROM {table}' in s]
+
+def test_group_member_update_statement_count(client, statements):
+    member, password_id = _shared_entry(client)
+
+    statements.clear()
+    response = client.put(f'/storage/{password_id}', json={'site': 's2', 'encrypted_data': 'e2', 'iv': 'i2'},
+                          headers=member)
+    assert response.status_code == 200
+
+    # 只看 UPDATE 之前的查詢（之後是 commit 後的通知對象查詢）
+    before_update = statements[:next(i for i, s in enumerate(statements) if s.startswith('UPDATE user_password'))]
+    # 路由與 get_user_permission 共用同一次條目查詢
+    assert len(_selects_from(before_update, 'user_password ')) == 1
+    assert len(_selects_from(before_update, 'group_membership')) == 1
+    # 條目、成員資格、授權各一次，再加上版本紀錄
+    assert len(before_update) == 4, before_update
+
+def test_group_member_read_statement_count(client, statements):
+    member, password_id = _shared_entry(client)
+
+    statements.clear()
+    response = client.get(f'/api/storage/{password_id}', headers=member)
+    assert response.status_code == 200
+    assert len(_selects_from(statements, 'user_password ')) == 1
+    # 條目、成員資格、授權與包裝金鑰各一次
+    assert len(statements) == 4, statements
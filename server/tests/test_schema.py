@@ -0,0 +1,89 @@
+# server/tests/test_schema.py
+import sqlite3
+
+from argon2 import PasswordHasher
+from sqlalchemy import inspect
+
+from app import create_app
+from conftest import TEST_CONFIG
+from models import db, GroupClosure
+
+# 最初版本（巢狀群組、垃圾桶、限時授權等功能之前）建立的 vault.db
+BASELINE_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, email VARCHAR(120) NOT NULL, password_hash VARCHAR(256) NOT NULL,
+    data_salt VARCHAR(64), login_count INTEGER, created_at DATETIME, updated_at DATETIME,
+    PRIMARY KEY (id), UNIQUE (email)
+);
+CREATE TABLE user_password (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, site VARCHAR(120) NOT NULL, encrypted_data TEXT NOT NULL,
+    iv VARCHAR(24) NOT NULL, notes TEXT, created_at DATETIME, updated_at DATETIME,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE INDEX ix_user_password_user_id ON user_password (user_id);
+CREATE TABLE "group" (
+    id INTEGER NOT NULL, name VARCHAR(120) NOT NULL, description VARCHAR(256), manager_id INTEGER NOT NULL,
+    created_at DATETIME, PRIMARY KEY (id), UNIQUE (name), FOREIGN KEY(manager_id) REFERENCES user (id)
+);
+CREATE INDEX ix_group_manager_id ON "group" (manager_id);
+CREATE TABLE group_membership (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, group_id INTEGER NOT NULL, permission VARCHAR(6) NOT NULL,
+    created_at DATETIME, PRIMARY KEY (id), CONSTRAINT _user_group_uc UNIQUE (user_id, group_id),
+    FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(group_id) REFERENCES "group" (id)
+);
+CREATE INDEX ix_group_membership_group_id ON group_membership (group_id);
+CREATE INDEX ix_group_membership_user_id ON group_membership (user_id);
+CREATE TABLE password_access (
+    id INTEGER NOT NULL, user_id INTEGER, group_id INTEGER, password_id INTEGER NOT NULL,
+    permission VARCHAR(6) NOT NULL, created_at DATETIME, PRIMARY KEY (id),
+    CONSTRAINT user_or_group_constraint CHECK (user_id IS NOT NULL OR group_id IS NOT NULL),
+    CONSTRAINT _user_group_password_uc UNIQUE (user_id, group_id, password_id),
+    FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(group_id) REFERENCES "group" (id),
+    FOREIGN KEY(password_id) REFERENCES user_password (id) ON DELETE CASCADE
+);
+CREATE INDEX ix_password_access_user_id ON password_access (user_id);
+CREATE INDEX ix_password_access_group_id ON password_access (group_id);
+CREATE INDEX ix_password_access_password_id ON password_access (password_id);
+"""
+
+def _baseline_db(path):
+    login_hash = PasswordHasher().hash('key')
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany("INSERT INTO user (id, email, password_hash, login_count) VALUES (?, ?, ?, 0)",
+                           [(1, 'owner@example.com', login_hash), (2, 'member@example.com', login_hash)])
+    connection.execute("INSERT INTO user_password (id, user_id, site, encrypted_data, iv) VALUES (1, 1, 's', 'e', 'i')")
+    connection.execute("INSERT INTO \"group\" (id, name, manager_id) VALUES (1, 'team', 1)")
+    connection.execute("INSERT INTO group_membership (user_id, group_id, permission) VALUES (2, 1, 'READ')")
+    connection.execute("INSERT INTO password_access (group_id, password_id, permission) VALUES (1, 1, 'READ')")
+    connection.commit()
+    connection.close()
+
+def test_create_app_upgrades_a_baseline_database(tmp_path):
+    _baseline_db(tmp_path / 'vault.db')
+    app = create_app({
+        **TEST_CONFIG,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'vault.db'}",
+        'SQLALCHEMY_BINDS': {'audit': f"sqlite:///{tmp_path / 'audit.db'}"},
+        'ATTACHMENT_DIR': str(tmp_path / 'attachments'),
+    })
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert {'token_blocklist', 'group_closure', 'wrapped_key'} <= set(inspector.get_table_names())
+        assert {'deleted_at', 'deleted_by'} <= {c['name'] for c in inspector.get_columns('user_password')}
+        assert 'expires_at' in {c['name'] for c in inspector.get_columns('password_access')}
+        assert 'ix_password_access_expires_at' in {i['name'] for i in inspector.get_indexes('password_access')}
+        # 巢狀群組之前建立的群組補上 closure 資料
+        assert db.session.query(GroupClosure).filter_by(ancestor_id=1, descendant_id=1).count() == 1
+
+    # 升級後，既有資料可經由需要新欄位與新資料表的路徑存取
+    client = app.test_client()
+    token = client.post('/login', json={'email': 'member@example.com', 'login_key': 'key'}).json['token']
+    response = client.get('/passwords', headers={'Authorization': 'Bearer ' + token})
+    assert response.status_code == 200
+    assert [entry['id'] for entry in response.json] == [1]
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,86 @@
+"""
+server/token_blocklist.py
+
+JWT revocation list keyed by jti.
+
+Revoked tokens are persisted to the token_blocklist table and mirrored in an
+in-memory map {jti: expires_at}, so the per-request check in
+token_in_blocklist_loader is a dict lookup instead of a database query.
+
+Every worker keeps its own map. It is synced from the table at most every
+TOKEN_BLOCKLIST_SYNC_INTERVAL seconds by reading only rows created since the
+previous sync, which bounds how long another worker's logout can go unseen
+for a 15-minute access token. Refresh tokens live for weeks and are only used
+on POST /refresh, so a miss on a refresh token is confirmed against the table
+by jti. Entries are dropped from the map once the token has expired.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, TokenBlocklist
+
+# 同步時往前多讀一段時間，涵蓋其他 worker 已寫入 created_at、但尚未 commit 的紀錄
+SYNC_OVERLAP = timedelta(seconds=60)
+
+_revoked_jtis = {}  # jti -> expires_at
+_synced_at = None  # 上次同步時的資料庫時間（UTC）
+_next_sync = 0.0  # time.monotonic()
+_lock = threading.Lock()
+
+def _sync():
+    global _synced_at, _next_sync
+    if time.monotonic() < _next_sync:
+        return
+    with _lock:
+        if time.monotonic() < _next_sync:
+            return
+        now = datetime.utcnow()
+        query = db.session.query(TokenBlocklist.jti, TokenBlocklist.expires_at).filter(
+            TokenBlocklist.expires_at > now
+        )
+        if _synced_at is not None:
+            query = query.filter(TokenBlocklist.created_at >= _synced_at - SYNC_OVERLAP)
+        _revoked_jtis.update(query.all())
+        # 過期的令牌本來就會被拒絕，不必再記住
+        for jti in [jti for jti, expires_at in _revoked_jtis.items() if expires_at <= now]:
+            del _revoked_jtis[jti]
+        _synced_at = now
+        _next_sync = time.monotonic() + current_app.config.get('TOKEN_BLOCKLIST_SYNC_INTERVAL', 5)
+
+def is_token_revoked(jwt_header, jwt_payload):
+    _sync()
+    jti = jwt_payload["jti"]
+    if jti in _revoked_jtis:
+        return True
+    if jwt_payload.get("type") == "refresh":
+        # 刷新令牌有效期長，其他 worker 剛撤銷的也必須拒絕：未命中時以 jti 查資料表
+        expires_at = db.session.query(TokenBlocklist.expires_at).filter_by(jti=jti).scalar()
+        if expires_at is not None:
+            with _lock:
+                _revoked_jtis[jti] = expires_at
+            return True
+    return False
+
+def revoke_token(jwt_payload):
+    """將令牌加入撤銷清單（寫入資料表並更新記憶體集合）"""
+    _sync()
+    jti = jwt_payload["jti"]
+    if jti in _revoked_jtis or db.session.query(TokenBlocklist.id).filter_by(jti=jti).first():
+        return
+
+    now = datetime.utcnow()
+    expires_at = datetime.utcfromtimestamp(jwt_payload["exp"])
+    # 順便清除已過期的撤銷紀錄，過期的令牌本來就會被拒絕
+    TokenBlocklist.query.filter(TokenBlocklist.expires_at <= now).delete(synchronize_session=False)
+    db.session.add(TokenBlocklist(
+        jti=jti,
+        token_type=jwt_payload.get("type", "access"),
+        user_id=int(jwt_payload["sub"]),
+        expires_at=expires_at
+    ))
+    db.session.commit()
+    # _sync() 持有同一把鎖走訪此 dict，寫入也必須上鎖
+    with _lock:
+        _revoked_jtis[jti] = expires_at
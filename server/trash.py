@@ -0,0 +1,218 @@
+# server/trash.py
+"""
+Trash: soft delete, restore and background purge of password entries.
+
+Deleting an entry only sets deleted_at, so the request never runs the cascade
+through password_access and wrapped_key. Trashed entries are hidden
+everywhere (get_password_entry returns None for them) and their grants stay
+in place, so a restore brings back the same sharing.
+
+A background purger hard-deletes entries trashed longer than TRASH_RETENTION,
+TRASH_PURGE_BATCH entries per transaction with a pause in between, which
+bounds how long each purge holds the SQLite write lock. Every purged entry
+leaves a tombstone that sync clients read from GET /tombstones.
+"""
+
+import time
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import delete, insert, select
+from models import db, UserPassword, Tombstone
+from request_context import invalidate as invalidate_request_cache
+from audit import record as audit
+from jobs import PeriodicJob
+import acl_index
+import events
+
+trash_bp = Blueprint('trash', __name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def soft_delete(entry, user_id):
+    """Moves an entry to the trash and commits."""
+    grants = acl_index.entry_grants(entry.id)
+    entry.deleted_at = datetime.utcnow()
+    entry.deleted_by = user_id
+    db.session.commit()
+    invalidate_request_cache(password_id=entry.id)
+    acl_index.entry_deleted(entry.id, grants)
+
+def purge(password_ids, cutoff=None):
+    """
+    Hard-deletes trashed entries in one transaction and writes their tombstones.
+    Child rows go through ON DELETE CASCADE. With cutoff, only entries trashed
+    before it are deleted, so an entry restored meanwhile is left alone.
+    Returns the ids actually purged.
+    """
+    if not password_ids:
+        return []
+    condition = [UserPassword.id.in_(password_ids), UserPassword.deleted_at.is_not(None)]
+    if cutoff is not None:
+        condition.append(UserPassword.deleted_at < cutoff)
+
+    # 清除後授權也會一併刪除，先算出通知對象
+    broker = current_app.extensions.get('events')
+    audiences = {pid: events.password_audience(pid) for pid in password_ids} if broker else {}
+
+    purged = db.session.execute(
+        delete(UserPassword).where(*condition).returning(
+            UserPassword.id, UserPassword.user_id, UserPassword.deleted_at
+        ).execution_options(synchronize_session=False)
+    ).all()
+    now = datetime.utcnow()
+    if purged:
+        db.session.execute(insert(Tombstone), [
+            {"password_id": pid, "user_id": owner_id, "deleted_at": deleted_at, "purged_at": now}
+            for pid, owner_id, deleted_at in purged
+        ])
+    db.session.commit()
+
+    for pid, owner_id, _ in purged:
+        events.notify(events.ENTRY_CHANGED, audiences.get(pid, ()), action='purged', password_id=pid)
+    return [pid for pid, _, _ in purged]
+
+def purge_expired(batch_size, pause=0.0, max_batches=None):
+    """Purges entries past TRASH_RETENTION batch by batch; returns how many were purged."""
+    cutoff = datetime.utcnow() - current_app.config['TRASH_RETENTION']
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [pid for (pid,) in db.session.execute(
+            select(UserPassword.id).where(
+                UserPassword.deleted_at.is_not(None),
+                UserPassword.deleted_at < cutoff
+            ).order_by(UserPassword.deleted_at).limit(batch_size)
+        )]
+        if not ids:
+            break
+        total += len(purge(ids, cutoff))
+        batches += 1
+        if pause:
+            time.sleep(pause)  # 讓其他寫入有機會取得資料庫鎖
+
+    # 墓碑只需保留到同步用戶端都讀過為止
+    tombstone_retention = current_app.config.get('TOMBSTONE_RETENTION')
+    if tombstone_retention:
+        db.session.execute(delete(Tombstone).where(Tombstone.purged_at < datetime.utcnow() - tombstone_retention))
+        db.session.commit()
+    return total
+
+def _purge_job(app):
+    purged = purge_expired(app.config.get('TRASH_PURGE_BATCH', 100), app.config.get('TRASH_PURGE_PAUSE', 0.05))
+    if purged:
+        app.logger.info("Purged %d entries from the trash", purged)
+
+def init_app(app):
+    if not app.config.get('TRASH_PURGE_INTERVAL'):
+        return None
+    job = PeriodicJob(app, 'trash-purger', app.config['TRASH_PURGE_INTERVAL'], lambda: _purge_job(app))
+    app.extensions['trash_purger'] = job
+    return job
+
+def _page_args():
+    limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError
+    return limit
+
+def _trashed_entry(password_id, user_id):
+    entry = db.session.get(UserPassword, password_id)
+    if not entry or entry.deleted_at is None or entry.user_id != user_id:
+        return None
+    return entry
+
+# GET /trash - Trashed entries owned by the caller, newest first
+# Query: limit, offset. Ciphertext is included so master-password rotation can re-encrypt trashed entries too.
+@trash_bp.route('/trash', methods=['GET'])
+@jwt_required()
+def list_trash():
+    current_user_id = int(get_jwt_identity())
+    try:
+        limit = _page_args()
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"msg": "limit and offset must be positive integers"}), 400
+
+    rows = db.session.query(
+        UserPassword.id, UserPassword.site, UserPassword.encrypted_data, UserPassword.iv, UserPassword.notes,
+        UserPassword.deleted_at, UserPassword.deleted_by
+    ).filter(
+        UserPassword.user_id == current_user_id,
+        UserPassword.deleted_at.is_not(None)
+    ).order_by(UserPassword.deleted_at.desc(), UserPassword.id.desc()).limit(limit + 1).offset(offset).all()
+
+    retention = current_app.config['TRASH_RETENTION']
+    response = jsonify([
+        {
+            "id": pid,
+            "site": site,
+            "encrypted_data": encrypted_data,
+            "iv": iv,
+            "notes": notes,
+            "deleted_at": deleted_at.isoformat(),
+            "deleted_by": deleted_by,
+            "purge_after": (deleted_at + retention).isoformat()
+        }
+        for pid, site, encrypted_data, iv, notes, deleted_at, deleted_by in rows[:limit]
+    ])
+    if len(rows) > limit:
+        response.headers['X-Next-Offset'] = str(offset + limit)
+    return response, 200
+
+# POST /trash/<password_id>/restore - Move an entry back out of the trash (owner only)
+@trash_bp.route('/trash/<int:password_id>/restore', methods=['POST'])
+@jwt_required()
+def restore_entry(password_id):
+    current_user_id = int(get_jwt_identity())
+    entry = _trashed_entry(password_id, current_user_id)
+    if not entry:
+        return jsonify({"msg": "Entry not found in trash"}), 404
+
+    entry.deleted_at = None
+    entry.deleted_by = None
+    db.session.commit()
+    invalidate_request_cache(password_id=password_id)
+    acl_index.entry_restored(password_id, current_user_id)
+    audit('entry.restore', user_id=current_user_id, password_id=password_id)
+    events.notify(events.ENTRY_CHANGED, events.password_audience(password_id), action='restored', password_id=password_id)
+    return jsonify({"msg": "Entry restored"}), 200
+
+# DELETE /trash/<password_id> - Purge one entry now instead of waiting for the retention period (owner only)
+@trash_bp.route('/trash/<int:password_id>', methods=['DELETE'])
+@jwt_required()
+def purge_entry(password_id):
+    current_user_id = int(get_jwt_identity())
+    if not _trashed_entry(password_id, current_user_id):
+        return jsonify({"msg": "Entry not found in trash"}), 404
+
+    purge([password_id])
+    audit('entry.purge', user_id=current_user_id, password_id=password_id)
+    return jsonify({"msg": "Entry permanently deleted"}), 200
+
+# GET /tombstones - Entries of the caller purged from the trash, oldest first
+# Query: after (last tombstone id seen), limit. Clients keep the highest id as their cursor.
+@trash_bp.route('/tombstones', methods=['GET'])
+@jwt_required()
+def list_tombstones():
+    current_user_id = int(get_jwt_identity())
+    try:
+        limit = _page_args()
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({"msg": "limit and after must be integers"}), 400
+
+    rows = db.session.query(Tombstone).filter(
+        Tombstone.user_id == current_user_id,
+        Tombstone.id > after
+    ).order_by(Tombstone.id).limit(limit).all()
+    return jsonify([
+        {
+            "id": t.id,
+            "password_id": t.password_id,
+            "deleted_at": t.deleted_at.isoformat() if t.deleted_at else None,
+            "purged_at": t.purged_at.isoformat()
+        }
+        for t in rows
+    ]), 200
@@ -0,0 +1,443 @@
+# server/vault_transfer.py
+"""
+Streaming vault export and import.
+
+GET /vault/export streams the caller's own entries (with notes) and the grants
+they made, as newline-delimited JSON compressed with gzip, or with zstd when the
+optional zstandard package is installed. Rows are read with yield_per, so the
+whole vault is never held in memory.
+
+POST /vault/import reads the same format from the request body and commits
+it in chunks. Each chunk moves the import's checkpoint forward in the same
+transaction. If an upload fails, the client sends the whole archive again
+with ?checkpoint=<token>, and the import continues after the last committed
+record.
+
+Archive layout, one JSON object per line:
+    {"type": "header", "version": 1, "export_id": ..., "email": ..., "data_salt": ...}
+    {"type": "entry", "id": ..., "site": ..., "encrypted_data": ..., "iv": ..., "notes": ..., "wrapped_key": ...}
+    {"type": "grant", "password_id": ..., "user_email": ... | "group_name": ..., "permission": ..., "expires_at": optional}
+    {"type": "footer", "entries": n, "grants": m}
+"""
+
+import io
+import gzip
+import json
+import secrets
+import zlib
+from datetime import datetime, timezone
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import insert, select
+from models import db, User, UserPassword, PasswordAccess, Group, PermissionEnum, VaultImport, VaultImportMap, WrappedKey
+from audit import record as audit
+import acl_index
+from limits import oversized_field
+
+try:
+    import zstandard
+except ImportError:  # 可選套件：未安裝時只支援 gzip
+    zstandard = None
+
+vault_bp = Blueprint('vault', __name__)
+
+ARCHIVE_VERSION = 1
+EXPORT_BATCH_SIZE = 500  # 每次從 cursor 取回的列數
+IMPORT_CHUNK_SIZE = 500  # 每個交易提交的記錄數
+READ_SIZE = 64 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+ARCHIVE_FORMATS = {
+    'gzip': ('application/gzip', 'ndjson.gz'),
+    'zstd': ('application/zstd', 'ndjson.zst'),
+}
+
+class ArchiveError(ValueError):
+    pass
+
+# --- Export ---
+
+def _compressor(fmt):
+    if fmt == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+def export_records(user_id):
+    """Yields the archive records for user_id's vault, reading rows through server-side cursors."""
+    user = db.session.get(User, user_id)
+    yield {
+        "type": "header",
+        "version": ARCHIVE_VERSION,
+        "export_id": secrets.token_hex(16),
+        "exported_at": datetime.utcnow().isoformat(),
+        "user_id": user.id,
+        "email": user.email,
+        "data_salt": user.data_salt,
+    }
+
+    entries = db.session.execute(
+        select(
+            UserPassword.id, UserPassword.site, UserPassword.encrypted_data, UserPassword.iv,
+            UserPassword.notes, UserPassword.created_at, UserPassword.updated_at, WrappedKey.wrapped_key
+        ).outerjoin(WrappedKey, (WrappedKey.password_id == UserPassword.id) & (WrappedKey.user_id == user_id))
+        .where(UserPassword.user_id == user_id, UserPassword.deleted_at.is_(None)).order_by(UserPassword.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    entry_count = 0
+    for row in entries:
+        entry_count += 1
+        yield {
+            "type": "entry",
+            "id": row.id,
+            "site": row.site,
+            "encrypted_data": row.encrypted_data,
+            "iv": row.iv,
+            "notes": row.notes,
+            "wrapped_key": row.wrapped_key,  # 信封加密：以擁有者公鑰包裝的資料金鑰
+            "created_at": _isoformat(row.created_at),
+            "updated_at": _isoformat(row.updated_at),
+        }
+
+    # 目標以 email / 群組名稱表示，匯入到其他伺服器時也能對應
+    grants = db.session.execute(
+        select(
+            PasswordAccess.password_id, PasswordAccess.user_id, User.email,
+            PasswordAccess.group_id, Group.name, PasswordAccess.permission, PasswordAccess.expires_at
+        ).join(UserPassword, UserPassword.id == PasswordAccess.password_id)
+        .outerjoin(User, User.id == PasswordAccess.user_id)
+        .outerjoin(Group, Group.id == PasswordAccess.group_id)
+        .where(UserPassword.user_id == user_id, UserPassword.deleted_at.is_(None), PasswordAccess.active())
+        .order_by(PasswordAccess.password_id, PasswordAccess.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    grant_count = 0
+    for password_id, target_user_id, email, group_id, group_name, permission, expires_at in grants:
+        grant_count += 1
+        record = {"type": "grant", "password_id": password_id, "permission": permission.value}
+        if expires_at:
+            record["expires_at"] = _isoformat(expires_at)
+        if target_user_id:
+            record.update(user_id=target_user_id, user_email=email)
+        else:
+            record.update(group_id=group_id, group_name=group_name)
+        yield record
+
+    yield {"type": "footer", "entries": entry_count, "grants": grant_count}
+
+def compress_records(records, fmt):
+    compressor = _compressor(fmt)
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        # 壓縮器內部會累積到一個區塊才輸出，空字串不送出
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+# GET /vault/export?format=gzip|zstd
+@vault_bp.route('/vault/export', methods=['GET'])
+@jwt_required()
+def export_vault():
+    current_user_id = int(get_jwt_identity())
+    fmt = request.args.get('format', 'gzip')
+    if fmt not in ARCHIVE_FORMATS:
+        return jsonify({"msg": f"Unsupported format, choose from {', '.join(ARCHIVE_FORMATS)}"}), 400
+    if fmt == 'zstd' and zstandard is None:
+        return jsonify({"msg": "zstd export requires the zstandard package"}), 400
+
+    audit('vault.export', user_id=current_user_id, format=fmt)
+    mimetype, extension = ARCHIVE_FORMATS[fmt]
+    filename = f"vault-{current_user_id}-{datetime.utcnow():%Y%m%d%H%M%S}.{extension}"
+    return Response(
+        stream_with_context(compress_records(export_records(current_user_id), fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# --- Import ---
+
+class _PrefixedStream(io.RawIOBase):
+    """Puts back the bytes read to sniff the archive format."""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            n = min(len(buffer), len(self.prefix))
+            buffer[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _decompressed(stream):
+    prefix = stream.read(4)
+    raw = _PrefixedStream(prefix, stream)
+    if prefix.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if prefix.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ArchiveError("zstd archives require the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    raise ArchiveError("Unsupported archive format, expected gzip or zstd")
+
+def read_records(stream):
+    """Yields the JSON records of a compressed archive, decompressing READ_SIZE bytes at a time."""
+    reader = _decompressed(stream)
+    decode_errors = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+    buffer = b''
+    while True:
+        try:
+            data = reader.read(READ_SIZE)
+        except decode_errors as e:
+            raise ArchiveError(f"Corrupt or truncated archive: {e}")
+        if not data:
+            break
+        lines = (buffer + data).split(b'\n')
+        buffer = lines.pop()
+        if len(buffer) > MAX_RECORD_BYTES:
+            raise ArchiveError("Archive record too large")
+        for line in lines:
+            if line.strip():
+                yield _parse_record(line)
+    if buffer.strip():
+        yield _parse_record(buffer)
+
+def _parse_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ArchiveError("Invalid JSON record in archive")
+    if not isinstance(record, dict) or record.get('type') not in ('header', 'entry', 'grant', 'footer'):
+        raise ArchiveError("Unknown record in archive")
+    return record
+
+def _parse_time(value):
+    """Parses an ISO 8601 timestamp into naive UTC, the way the models store times."""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if parsed is not None and parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _validate_entry(entry):
+    if not entry.get('site') or not entry.get('encrypted_data') or not entry.get('iv') or entry.get('id') is None:
+        raise ArchiveError("Entry record is missing id, site, encrypted_data or iv")
+    if not _is_id(entry['id']):
+        raise ArchiveError("Entry record id must be an integer")
+    for name in ('site', 'encrypted_data', 'iv', 'notes', 'wrapped_key'):
+        if entry.get(name) is not None and not isinstance(entry[name], str):
+            raise ArchiveError(f"Entry field '{name}' must be a string")
+    oversized = oversized_field(entry, ('site', 'encrypted_data', 'iv', 'notes'))
+    if oversized:
+        raise ArchiveError(f"Entry field '{oversized[0]}' is longer than {oversized[1]} characters")
+
+def _validate_grant(grant):
+    if not _is_id(grant.get('password_id')):
+        raise ArchiveError("Grant record password_id must be an integer")
+    for name in ('user_email', 'group_name'):
+        if grant.get(name) is not None and not isinstance(grant[name], str):
+            raise ArchiveError(f"Grant field '{name}' must be a string")
+
+def _commit_chunk(job, records, consumed):
+    """Writes one chunk of records and moves the checkpoint forward in the same transaction."""
+    entries = [r for r in records if r['type'] == 'entry']
+    grants = [r for r in records if r['type'] == 'grant']
+
+    for entry in entries:
+        _validate_entry(entry)
+    for grant in grants:
+        _validate_grant(grant)
+
+    if entries:
+        # 重複的條目 id 會違反 VaultImportMap 主鍵，每次續傳都會以同樣方式失敗
+        source_ids = [entry['id'] for entry in entries]
+        duplicate = len(set(source_ids)) != len(source_ids) or db.session.query(VaultImportMap.source_id).filter(
+            VaultImportMap.import_id == job.id, VaultImportMap.source_id.in_(source_ids)
+        ).first()
+        if duplicate:
+            raise ArchiveError("Archive contains duplicate entry ids")
+
+    if entries:
+        now = datetime.utcnow()
+        new_entries = [
+            UserPassword(
+                user_id=job.user_id,
+                site=entry['site'],
+                encrypted_data=entry['encrypted_data'],
+                iv=entry['iv'],
+                notes=entry.get('notes'),
+                created_at=_parse_time(entry.get('created_at')) or now,
+                updated_at=_parse_time(entry.get('updated_at')) or now,
+            )
+            for entry in entries
+        ]
+        db.session.add_all(new_entries)
+        db.session.flush()
+        db.session.execute(insert(VaultImportMap), [
+            {"import_id": job.id, "source_id": entry['id'], "password_id": new_entry.id}
+            for entry, new_entry in zip(entries, new_entries)
+        ])
+        wrapped = [
+            {"password_id": new_entry.id, "user_id": job.user_id, "wrapped_key": entry['wrapped_key']}
+            for entry, new_entry in zip(entries, new_entries) if entry.get('wrapped_key')
+        ]
+        if wrapped:
+            db.session.execute(insert(WrappedKey), wrapped)
+
+    created_ids = [new_entry.id for new_entry in new_entries] if entries else []
+
+    skipped = 0
+    rows = []
+    if grants:
+        source_ids = {g.get('password_id') for g in grants}
+        mapping = dict(db.session.query(VaultImportMap.source_id, VaultImportMap.password_id).filter(
+            VaultImportMap.import_id == job.id,
+            VaultImportMap.source_id.in_(source_ids)
+        ))
+        emails = {g['user_email'] for g in grants if g.get('user_email')}
+        names = {g['group_name'] for g in grants if g.get('group_name')}
+        users_by_email = dict(db.session.query(User.email, User.id).filter(User.email.in_(emails))) if emails else {}
+        groups_by_name = dict(db.session.query(Group.name, Group.id).filter(Group.name.in_(names))) if names else {}
+
+        seen = set()
+        now = datetime.utcnow()
+        for grant in grants:
+            try:
+                permission = PermissionEnum(str(grant.get('permission')).upper())
+            except ValueError:
+                raise ArchiveError("Grant record has an invalid permission")
+            password_id = mapping.get(grant.get('password_id'))
+            target_user_id = users_by_email.get(grant.get('user_email'))
+            target_group_id = None if target_user_id else groups_by_name.get(grant.get('group_name'))
+            key = (password_id, target_user_id, target_group_id)
+            expires_at = _parse_time(grant.get('expires_at'))
+            # 找不到對應條目或目標（例如匯入到其他伺服器）、或已過期時略過該授權
+            if password_id is None or (target_user_id is None and target_group_id is None) \
+                    or target_user_id == job.user_id or key in seen or (expires_at and expires_at <= now):
+                skipped += 1
+                continue
+            seen.add(key)
+            rows.append({
+                "password_id": password_id,
+                "user_id": target_user_id,
+                "group_id": target_group_id,
+                "permission": permission,
+                "expires_at": expires_at,
+            })
+        if rows:
+            db.session.execute(insert(PasswordAccess), rows)
+
+    job.records_committed += consumed
+    job.entries_imported += len(entries)
+    job.grants_imported += len(rows)
+    job.grants_skipped += skipped
+    db.session.commit()
+    for password_id in created_ids:
+        acl_index.entry_created(password_id, job.user_id)
+    for row in rows:
+        acl_index.grant_set(row["password_id"], row["user_id"], row["group_id"], row["permission"], row["expires_at"])
+
+def _import_summary(job):
+    return {
+        "checkpoint": job.token,
+        "completed": job.completed,
+        "records_committed": job.records_committed,
+        "entries_imported": job.entries_imported,
+        "grants_imported": job.grants_imported,
+        "grants_skipped": job.grants_skipped,
+    }
+
+def import_archive(job, stream):
+    """Imports records after job.records_committed. Returns False if the archive ended without a footer."""
+    records = read_records(stream)
+    header = next(records, None)
+    if not header or header['type'] != 'header' or header.get('version') != ARCHIVE_VERSION:
+        raise ArchiveError("Archive header missing or unsupported version")
+    if job.export_id is None:
+        job.export_id = header.get('export_id')
+        db.session.commit()
+    elif job.export_id != header.get('export_id'):
+        raise ArchiveError("Checkpoint belongs to a different archive")
+
+    pending = []
+    index = 0
+    for index, record in enumerate(records, start=1):
+        if index <= job.records_committed:
+            continue  # 續傳：已提交的記錄直接略過
+        if record['type'] == 'header':
+            raise ArchiveError("Unexpected header record")
+        if record['type'] == 'footer':
+            job.completed = True
+            _commit_chunk(job, pending, len(pending) + 1)
+            return True
+        pending.append(record)
+        if len(pending) >= IMPORT_CHUNK_SIZE:
+            _commit_chunk(job, pending, len(pending))
+            pending = []
+
+    if pending:
+        _commit_chunk(job, pending, len(pending))
+    return False
+
+# POST /vault/import[?checkpoint=<token>] - Body: archive produced by /vault/export
+@vault_bp.route('/vault/import', methods=['POST'])
+@jwt_required()
+def import_vault():
+    current_user_id = int(get_jwt_identity())
+    token = request.args.get('checkpoint')
+
+    if token:
+        job = VaultImport.query.filter_by(token=token, user_id=current_user_id).first()
+        if not job:
+            return jsonify({"msg": "Import checkpoint not found"}), 404
+        if job.completed:
+            return jsonify(dict(_import_summary(job), msg="Import already completed")), 200
+    else:
+        job = VaultImport(token=secrets.token_urlsafe(24), user_id=current_user_id)
+        db.session.add(job)
+        db.session.commit()
+
+    try:
+        completed = import_archive(job, request.stream)
+    except ArchiveError as e:
+        db.session.rollback()
+        return jsonify(dict(_import_summary(job), msg=str(e))), 400
+    except Exception:
+        db.session.rollback()
+        # 例外內容可能含 SQL 與密文，只寫入日誌
+        current_app.logger.exception("Vault import %s failed", job.id)
+        return jsonify(dict(_import_summary(job), msg="Import failed, resume with the checkpoint")), 500
+
+    if not completed:
+        return jsonify(dict(_import_summary(job), msg="Archive ended before the footer, resume with the checkpoint")), 400
+
+    audit('vault.import', user_id=current_user_id, entries=job.entries_imported, grants=job.grants_imported)
+    return jsonify(dict(_import_summary(job), msg="Vault imported successfully")), 200
+
+# GET /vault/import/<token> - Progress of an import
+@vault_bp.route('/vault/import/<token>', methods=['GET'])
+@jwt_required()
+def get_import_status(token):
+    current_user_id = int(get_jwt_identity())
+    job = VaultImport.query.filter_by(token=token, user_id=current_user_id).first()
+    if not job:
+        return jsonify({"msg": "Import checkpoint not found"}), 404
+    return jsonify(_import_summary(job)), 200